@@ -16,16 +16,202 @@
 
 """
 from math import *
+from array import array
+
+NUMPY=True
+try:
+    import numpy
+except:
+    NUMPY = False
+
+##############################################################################
+# ECoordArray holds ecoords in parallel typed arrays instead of one python  #
+# list per point.  It can be used in place of the usual list of            #
+# [x,y,loop] (or [x,y,loop,feed,spindle]) lists; indexing and iterating     #
+# return the same lists.                                                   #
+##############################################################################
+class ECoordArray:
+    def __init__(self,x=None,y=None,loop=None,feed=None,spindle=None):
+        if x == None:
+            x = array('d')
+            y = array('d')
+            loop = array('i')
+        self.x       = x
+        self.y       = y
+        self.loop    = loop
+        self.feed    = feed
+        self.spindle = spindle
+
+    @staticmethod
+    def from_list(ecoords):
+        x    = array('d',[c[0] for c in ecoords])
+        y    = array('d',[c[1] for c in ecoords])
+        loop = array('i',[c[2] for c in ecoords])
+        feed    = None
+        spindle = None
+        if len(ecoords) > 0 and len(ecoords[0]) > 3:
+            feed    = array('d',[c[3] for c in ecoords])
+            spindle = array('d',[c[4] for c in ecoords])
+        return ECoordArray(x,y,loop,feed,spindle)
+
+    @staticmethod
+    def from_numpy(x,y,loop):
+        ecoords = ECoordArray()
+        ecoords.x.frombytes(numpy.ascontiguousarray(x,dtype=numpy.float64).tobytes())
+        ecoords.y.frombytes(numpy.ascontiguousarray(y,dtype=numpy.float64).tobytes())
+        ecoords.loop.frombytes(numpy.ascontiguousarray(loop,dtype=numpy.intc).tobytes())
+        return ecoords
+
+    def numpy_arrays(self):
+        # numpy views of the data (no copy)
+        x    = numpy.frombuffer(self.x,dtype=numpy.float64)
+        y    = numpy.frombuffer(self.y,dtype=numpy.float64)
+        loop = numpy.frombuffer(self.loop,dtype=numpy.intc)
+        feed = None
+        if self.feed != None:
+            feed = numpy.frombuffer(self.feed,dtype=numpy.float64)
+        return x,y,loop,feed
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self,i):
+        if isinstance(i,slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if self.feed == None:
+            return [self.x[i],self.y[i],self.loop[i]]
+        return [self.x[i],self.y[i],self.loop[i],self.feed[i],self.spindle[i]]
+
+    def __iter__(self):
+        if self.feed == None:
+            for coord in zip(self.x,self.y,self.loop):
+                yield list(coord)
+        else:
+            for coord in zip(self.x,self.y,self.loop,self.feed,self.spindle):
+                yield list(coord)
+
+    def __eq__(self,other):
+        if len(self) != len(other):
+            return False
+        for a,b in zip(self,other):
+            if a != b:
+                return False
+        return True
+
+    def __ne__(self,other):
+        return not self.__eq__(other)
+
+    def append(self,coord):
+        self.x.append(coord[0])
+        self.y.append(coord[1])
+        self.loop.append(coord[2])
+        if self.feed != None:
+            self.feed.append(coord[3])
+            self.spindle.append(coord[4])
+
+    def extend(self,ecoords):
+        for coord in ecoords:
+            self.append(coord)
+
+
+##############################################################################
+# RasterRuns holds raster scan lines as runs instead of ecoords.  For each  #
+# scan line (row) there is the y position and the index of its first run,  #
+# and for each run the x positions where the laser turns on and off.  This  #
+# is all the EGV raster writer needs so the image can go to EGV data        #
+# without making a point (and a python list) for each end of each run.     #
+##############################################################################
+class RasterRuns:
+    def __init__(self,y,first,x0,x1):
+        self.y     = y      # y of each row
+        self.first = first  # runs of row i are first[i]:first[i+1]
+        self.x0    = x0     # x where each run starts
+        self.x1    = x1     # x where each run ends
+
+    @staticmethod
+    def from_ecoords(ecoords):
+        # Raster ecoords are made of (start,end) pairs on rows of equal y.
+        # Returns None if ecoords is not like that.
+        if not NUMPY or not isinstance(ecoords,ECoordArray):
+            return None
+        x,y,loop,feed = ecoords.numpy_arrays()
+        n = len(x)
+        if n == 0 or n%2 != 0 or feed is not None:
+            return None
+        if not ((loop[0::2] == loop[1::2]).all() and (y[0::2] == y[1::2]).all()):
+            return None
+        if (loop[2::2] == loop[1:-1:2]).any():
+            return None
+        ys = y[0::2]
+        brk = numpy.flatnonzero(ys[1:] != ys[:-1])+1
+        first = numpy.concatenate(([0],brk,[n//2]))
+        return RasterRuns(ys[first[:-1]],first,x[0::2],x[1::2])
+
+    def __len__(self):
+        return len(self.y)
+
+    def ecoords(self,first_loop=2):
+        # The same points as the raster ecoords, each run is one loop
+        n = len(self.x0)
+        X = numpy.column_stack((self.x0,self.x1)).ravel()
+        Y = numpy.repeat(self.y,numpy.diff(self.first)*2)
+        loop = numpy.arange(first_loop,n+first_loop).repeat(2)
+        return ECoordArray.from_numpy(X,Y,loop)
+
+    def round_mils(self,values):
+        # int(round(v,0)) of each value.  numpy rounds halves to even (as
+        # python 3 does) so the few exact halves are done by python.
+        r = numpy.rint(values)
+        half = (values-numpy.floor(values)) == 0.5
+        if half.any():
+            r[half] = [round(v,0) for v in values[half].tolist()]
+        return r.astype(numpy.int64)
+
+    def egv_rows(self,Raster_step,FlipXoffset,scale):
+        # Yields (y,xs,None) for each row in the order they are engraved
+        # with the positions rounded to mils the same way as
+        # egv.ecoord_adj().  xs is an array of the ends of the runs in
+        # increasing order (as the points of the scan lines in
+        # egv.make_egv_data()).  None means each pair of points is a run.
+        n_rows = len(self.y)
+        if Raster_step < 0.0:
+            rows = range(n_rows)
+        else:
+            rows = range(n_rows-1,-1,-1)
+        first = self.first.tolist()
+        for i in rows:
+            a,b = first[i],first[i+1]
+            X = numpy.column_stack((self.x0[a:b],self.x1[a:b])).ravel()
+            if FlipXoffset > 0:
+                X = (FlipXoffset-X)*scale
+            else:
+                X = X*scale
+            if bool(FlipXoffset):
+                X = X[::-1]
+            y = int(round(float(self.y[i])*scale,0))
+            yield y,self.round_mils(X),None
+
 
 class ECoord:
-    def __init__(self):
+    n_changes = 0 # number of changes to the data of all ECoord objects
+
+    def __init__(self,compact=False):
+        # If compact is True the ecoords are stored in an ECoordArray
+        self.compact = compact
         self.reset()
         
     def reset(self):
         self.image      = None
         self.reset_path()
 
+    def changed(self):
+        # version is different every time the path data changes (used to
+        # know when the preview needs to be redrawn)
+        ECoord.n_changes = ECoord.n_changes+1
+        self.version = ECoord.n_changes
+
     def reset_path(self):
+        self.changed()
         self.ecoords    = []
         self.len        = None
         self.move       = 0
@@ -35,9 +221,13 @@ class ECoord:
         self.gcode_time = 0
         self.hull_coords= []
         self.n_scanlines= 0
+        self.raster_runs= None
 
     def make_ecoords(self,coords,scale=1):
         self.reset()
+        if NUMPY and len(coords) > 0:
+            self.make_ecoords_numpy(coords,scale)
+            return
         self.len  = 0
         self.move = 0
         
@@ -78,12 +268,78 @@ class ECoord:
             xmin=min(xmin,x1,x2)
             ymin=min(ymin,y1,y2)
         self.bounds = (xmin,xmax,ymin,ymax)
+        if self.compact:
+            self.ecoords = ECoordArray.from_list(self.ecoords)
+
+    def make_ecoords_numpy(self,coords,scale):
+        # Same as make_ecoords() using numpy array operations.  The sums are
+        # taken with cumsum() so they are accumulated in the same order (and
+        # give the same result) as the loop in make_ecoords().
+        XY = numpy.array([line[0:4] for line in coords],dtype=numpy.float64)*scale
+        x1,y1,x2,y2 = XY[:,0],XY[:,1],XY[:,2],XY[:,3]
+        dxline = x2-x1
+        dyline = y2-y1
+        len_line = numpy.sqrt(dxline*dxline + dyline*dyline)
+        keep = len_line != 0.0
+        x1,y1,x2,y2,len_line = x1[keep],y1[keep],x2[keep],y2[keep],len_line[keep]
+        n = len(x1)
+        self.len  = 0
+        self.move = 0
+        if n == 0:
+            self.ecoords = []
+            self.bounds = (1e10,-1e10,1e10,-1e10)
+            return
+
+        Acc=.001
+        dx = numpy.concatenate(([-99990.0],x2[:-1])) - x1
+        dy = numpy.concatenate(([-99990.0],y2[:-1])) - y1
+        dist = numpy.sqrt(dx*dx + dy*dy)
+        new_loop = dist > Acc
+        new_loop[0] = True
+        loop = numpy.cumsum(new_loop)
+
+        # Each line adds its end point, lines starting a new loop also add their start point
+        n_start = numpy.cumsum(new_loop)
+        i_end   = numpy.arange(n) + n_start
+        i_start = (i_end-1)[new_loop]
+        npts = n + int(n_start[-1])
+        X = numpy.empty(npts)
+        Y = numpy.empty(npts)
+        L = numpy.empty(npts,dtype=numpy.intc)
+        X[i_end],Y[i_end],L[i_end] = x2,y2,loop
+        X[i_start],Y[i_start],L[i_start] = x1[new_loop],y1[new_loop],loop[new_loop]
+
+        self.len  = self.ordered_sum(len_line)
+        self.move = self.ordered_sum(dist[new_loop][1:])
+        self.bounds = (float(min(x1.min(),x2.min())),float(max(x1.max(),x2.max())),
+                       float(min(y1.min(),y2.min())),float(max(y1.max(),y2.max())))
+        if self.compact:
+            self.ecoords = ECoordArray.from_numpy(X,Y,L)
+        else:
+            self.ecoords = [list(c) for c in zip(X.tolist(),Y.tolist(),L.tolist())]
 
     def set_ecoords(self,ecoords,data_sorted=False):
+        if self.compact and not isinstance(ecoords,ECoordArray):
+            try:
+                ecoords = ECoordArray.from_list(ecoords)
+            except (TypeError,OverflowError):
+                # keep the list if the values do not fit in the arrays
+                pass
+        self.changed()
         self.ecoords = ecoords
+        self.raster_runs = None
         self.computeEcoordsLen()
         self.data_sorted=data_sorted
 
+    def set_raster_runs(self,runs):
+        # Raster scan lines as RasterRuns.  The EGV data is made from the
+        # runs, the ecoords made from them are used by the preview.
+        if len(runs.x0) == 0:
+            self.set_ecoords([],data_sorted=True)
+        else:
+            self.set_ecoords(runs.ecoords(),data_sorted=True)
+        self.raster_runs = runs
+
     def set_image(self,PIL_image):
         self.image = PIL_image
         self.reset_path()
@@ -92,9 +348,12 @@ class ECoord:
         xmax, ymax = -1e10, -1e10
         xmin, ymin =  1e10,  1e10
         
-        if self.ecoords == [] :
+        if len(self.ecoords) == 0 :
             self.len=0
             return
+        if NUMPY:
+            self.computeEcoordsLen_numpy()
+            return
         on = 0
         move = 0
         time = 0
@@ -129,3 +388,73 @@ class ECoord:
         self.move = move
         self.gcode_time = time
 
+    def computeEcoordsLen_numpy(self):
+        # Same as computeEcoordsLen() using numpy array operations
+        if isinstance(self.ecoords,ECoordArray):
+            x,y,loop,feed = self.ecoords.numpy_arrays()
+        else:
+            x    = numpy.array([c[0] for c in self.ecoords],dtype=numpy.float64)
+            y    = numpy.array([c[1] for c in self.ecoords],dtype=numpy.float64)
+            loop = numpy.array([c[2] for c in self.ecoords])
+            feed = None
+            if len(self.ecoords[0]) > 3:
+                feed = numpy.array([c[3] for c in self.ecoords],dtype=numpy.float64)
+
+        # segments between points i-1 and i for i >= 2 (as in computeEcoordsLen)
+        if len(x) < 3:
+            self.bounds = (1e10,-1e10,1e10,-1e10)
+            self.len = 0
+            self.move = 0
+            self.gcode_time = 0
+            return
+        xs = x[1:]
+        ys = y[1:]
+        dx = xs[1:]-xs[:-1]
+        dy = ys[1:]-ys[:-1]
+        dist = numpy.sqrt(dx*dx + dy*dy)
+        on = loop[2:] == loop[1:-1]
+
+        self.bounds = (float(xs.min()),float(xs.max()),float(ys.min()),float(ys.max()))
+        self.len  = self.ordered_sum(dist[on])
+        self.move = self.ordered_sum(dist[~on])
+        if feed is not None:
+            self.gcode_time = self.ordered_sum(dist/feed[2:]*60)
+        else:
+            self.gcode_time = 0
+
+    def ordered_sum(self,values):
+        # cumsum() adds the values in order (numpy.sum() does not) so the
+        # result is the same as adding them up in a python loop
+        if len(values) == 0:
+            return 0
+        return float(numpy.cumsum(values)[-1])
+
+
+if __name__ == "__main__":
+    # Compare the memory used by a list of lists and an ECoordArray
+    import tracemalloc
+    from time import time
+    n = 1000000
+
+    tracemalloc.start()
+    ecoords = []
+    for i in range(n):
+        ecoords.append([i*0.001,(i//1000)*0.003,i//2])
+    mem_list = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    ecoords_array = ECoordArray.from_list(ecoords)
+    mem_array = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print("list of lists : %8.1f MB (%5.1f bytes per point)" %(mem_list/1e6,float(mem_list)/n))
+    print("ECoordArray   : %8.1f MB (%5.1f bytes per point)" %(mem_array/1e6,float(mem_array)/n))
+
+    for data in (ecoords,ecoords_array):
+        ec = ECoord()
+        ec.ecoords = data
+        t0=time()
+        ec.computeEcoordsLen()
+        print("computeEcoordsLen(%s): %.3f s" %(type(data).__name__,time()-t0))
+    print("DONE")
@@ -20,18 +20,39 @@ Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
 '''
 
 import sys
+import re
 import struct
 import os
 from shutil import copyfile
 from math import *
 from interpolate import interpolate
 from time import time
+from itertools import chain
 from LaserSpeed import LaserSpeed
+from ecoords import RasterRuns
+from process_pool import process_pool, stop_pool, OrderedTasks
+
+NUMPY=True
+try:
+    import numpy
+except:
+    NUMPY = False
 
 ##############################################################################
 class egv:
+    DISTANCE_CODES = None # codes for 0 to 254 mils (made when first used)
+    SPEED_CODES    = {}   # codes returned by make_speed()
+    DIRECTION_CODES = re.compile(b"([BTLRME])")
+    RASTER_CODES   = {}   # codes used by make_raster_row() for each direction
+
     def __init__(self, target=lambda s: sys.stdout.write(s)):
-        self.write = target
+        # target is a function that is called with each code or a
+        # bytearray that the codes are added to
+        if isinstance(target,bytearray):
+            self.write       = target.append
+            self.write_codes = target.extend
+        else:
+            self.write = target
         self.Modal_dir  = 0
         self.Modal_dist = 0
         self.Modal_on   = False
@@ -91,11 +112,14 @@ class egv:
                 self.Modal_AY = direction
                 
         
+    def write_codes(self,codes):
+        for code in bytearray(codes):
+            self.write(code)
+
     def flush(self,laser_on=None):
         if self.Modal_dist > 0:
             self.write(self.Modal_dir)
-            for code in self.make_distance(self.Modal_dist):
-                self.write(code)
+            self.write_codes(self.distance_codes(self.Modal_dist))
         if (laser_on!=None) and (laser_on!=self.Modal_on):
             if laser_on:
                 self.write(self.ON)
@@ -133,6 +157,17 @@ class egv:
             raise Exception("Error in EGV make_distance_in(): dist_milsA=",dist_milsA)
         return code
     
+    def distance_codes(self,dist_mils):
+        # Same as make_distance() using a table of the codes for 0 to 254
+        d = int(dist_mils)
+        if d != dist_mils or d < 0:
+            return bytearray(self.make_distance(dist_mils))
+        if egv.DISTANCE_CODES == None:
+            egv.DISTANCE_CODES = [bytes(bytearray(self.make_distance(i))) for i in range(255)]
+        if d < 255:
+            return egv.DISTANCE_CODES[d]
+        return b"z"*(d//255) + egv.DISTANCE_CODES[d%255]
+
     def make_dir_dist(self,dxmils,dymils,laser_on=False):
         adx = abs(dxmils)
         ady = abs(dymils)
@@ -169,7 +204,6 @@ class egv:
         elif dxmils==dymils:
             self.move(self.ANGLE,abs(dxmils),laser_on=Spindle,angle_dirs=[XCODE,YCODE])
         else:
-            h=[]
             if adx > ady:
                 slope = ady/adx
                 n = int(abs(dxmils))
@@ -181,39 +215,16 @@ class egv:
                 CODE  = YCODE
                 CODE1 = XCODE
 
-            for i in range(1,n+1):
-                h.append(round(i*slope,0))
-
-            Lh=0.0
-            d1=0.0
-            d2=0.0
             d1cnt=0.0
             d2cnt=0.0
-            for i in range(len(h)):
-                if h[i]==Lh:
-                    d1=d1+1
-                    if d2>0.0:
-                        self.move(self.ANGLE,d2,laser_on=Spindle,angle_dirs=[XCODE,YCODE])
-                        d2cnt=d2cnt+d2
-                        d2=0.0
+            for straight,d in self.cut_line_runs(n,slope):
+                if straight:
+                    self.move(CODE,float(d),laser_on=Spindle)
+                    d1cnt=d1cnt+d
                 else:
-                    d2=d2+1
-                    if d1>0.0:
-                        self.move(CODE,d1,laser_on=Spindle)
-                        d1cnt=d1cnt+d1
-                        d1=0.0
-                Lh=h[i]
-
-            if d1>0.0:
-                self.move(CODE,d1,laser_on=Spindle)
-                d1cnt=d1cnt+d1
-                d1=0.0
-            if d2>0.0:
-                self.move(self.ANGLE,d2,laser_on=Spindle,angle_dirs=[XCODE,YCODE])
-                d2cnt=d2cnt+d2
-                d2=0.0
+                    self.move(self.ANGLE,float(d),laser_on=Spindle,angle_dirs=[XCODE,YCODE])
+                    d2cnt=d2cnt+d
 
-        
             DX = d2cnt
             DY = (d1cnt+d2cnt)
             if adx < ady:
@@ -224,13 +235,84 @@ class egv:
                 raise Exception("egv.py: Error delta =%f" %(error))
 
 
+    #######################################################################
+    # Returns the (straight,length) runs of a line that is n mils long in
+    # the major direction.  After step i the line has moved h(i) =
+    # round(i*slope) mils in the minor direction; step i is diagonal when
+    # h(i) != h(i-1) and straight otherwise.  Only the steps of the less
+    # common kind are located (each one directly from its index using
+    # integer arithmetic), so the work depends on the number of runs
+    # instead of the length of the line.  When i*slope is (close to) a
+    # tie the float expression above decides, so the result is the same
+    # as evaluating h(i) for every step.
+    #######################################################################
+    def cut_line_runs(self,n,slope):
+        a = int(round(n*slope,0))   # length in the minor direction
+        if a <= n-a:
+            # mark the diagonal steps, the k-th one is the first i with h(i) >= k
+            marks_straight = False
+            n_marks = a
+            den = 2*a
+        else:
+            # mark the straight steps, the k-th one is the first i with i-h(i) >= k
+            marks_straight = True
+            n_marks = n-a
+            den = 2*(n-a)
+        # float error allowed for (possible) ties
+        band = int(n*n*4e-15)
+
+        def count(i):
+            c = round(i*slope,0)
+            if marks_straight:
+                c = i-c
+            return c
+
+        runs = []
+        last   = 0 # steps 1 to last are in runs
+        c_last = 0 # marks up to step last
+        for k in range(1,n_marks+1):
+            if c_last >= k:
+                continue
+            num = (2*k-1)*n
+            r = num % den
+            if marks_straight:
+                i = num//den+1
+            else:
+                i = num//den+(r > 0)
+            c = k
+            if r <= band or den-r <= band:
+                # (close to) a tie, let the float expression decide
+                i = min(max(i,last+1),n)
+                while i > last+1 and count(i-1) >= k:
+                    i = i-1
+                c = count(i)
+                while c < k:
+                    i = i+1
+                    c = count(i)
+            if i > last+1:
+                runs.append([not marks_straight,i-last-1])
+                runs.append([marks_straight,1])
+            elif runs != [] and runs[-1][0] == marks_straight:
+                runs[-1][1] = runs[-1][1]+1
+            else:
+                runs.append([marks_straight,1])
+            last   = i
+            c_last = c
+        if last < n:
+            runs.append([not marks_straight,n-last])
+        return runs
+
     def make_speed(self,Feed=None,board_name="LASER-M2",Raster_step=0):
+        key = (Feed,board_name,Raster_step)
+        if key in egv.SPEED_CODES:
+            return list(egv.SPEED_CODES[key])
         board_code = board_name.split('-')[1]
         speed_text = LaserSpeed.get_code_from_speed(Feed, abs(Raster_step), board=board_code)
         
         speed=[]
         for c in speed_text:
             speed.append(ord(c))
+        egv.SPEED_CODES[key] = tuple(speed)
         return speed
 
 
@@ -258,6 +340,99 @@ class egv:
         return e0,e1,e2
 
 
+    #######################################################################
+    # Writes the runs of one raster scan line (xs are the ends of the runs
+    # in increasing order, engraved from lastx in the sign direction).
+    # The output is the same as the make_cut_line()/make_dir_dist() calls
+    # in make_egv_data() but the moves are worked out with numpy: all the
+    # moves are in the same direction so the laser on and off moves only
+    # need to be merged and written with their distance codes.  Returns
+    # False (nothing written) for rows with runs of zero length.
+    #######################################################################
+    def make_raster_row(self,xs,sign,lastx):
+        if sign == 1:
+            V = xs
+            D = self.RIGHT
+        else:
+            V = xs[::-1]
+            D = self.LEFT
+        d = numpy.diff(V,prepend=lastx)
+        if (d[1::2]*sign <= 0).any():
+            return False
+        on = numpy.zeros(len(d),dtype=bool)
+        on[1::2] = True
+        keep = on | (d*sign > 0)
+        on   = on[keep]
+        dist = numpy.abs(d[keep])
+        start = numpy.flatnonzero(on[1:] != on[:-1])+1
+        start = numpy.concatenate(([0],start))
+        dist = numpy.add.reduceat(dist,start)
+        on   = on[start]
+
+        self.move(D,int(dist[0]),laser_on=bool(on[0]))
+        if len(dist) > 1:
+            self.move(D,int(dist[1]),laser_on=bool(on[1]))
+        if len(dist) > 2:
+            # After the first two moves each move only flushes the one
+            # before it (direction and distance) and turns the laser on
+            # or off: codes[2*d+on] for distances d below 255
+            codes = self.raster_codes(D)
+            d = dist[1:-1]
+            i = numpy.minimum(d,255)*2 + on[2:]
+            data = [codes[k] for k in i.tolist()]
+            for k in numpy.flatnonzero(d >= 255).tolist():
+                data[k] = bytes(bytearray([D])) + self.distance_codes(int(d[k])) + codes[510+int(on[k+2])]
+            self.write_codes(b"".join(data))
+            self.Modal_dist = int(dist[-1])
+            self.Modal_on   = bool(on[-1])
+        return True
+
+    def raster_codes(self,direction):
+        if direction not in egv.RASTER_CODES:
+            codes = []
+            for d in range(255):
+                dist = bytes(bytearray([direction])) + self.distance_codes(d)
+                codes.append(dist + bytes(bytearray([self.OFF])))
+                codes.append(dist + bytes(bytearray([self.ON])))
+            # the end of the code for each laser state (index 2*255+on)
+            codes.append(bytes(bytearray([self.OFF])))
+            codes.append(bytes(bytearray([self.ON])))
+            egv.RASTER_CODES[direction] = codes
+        return egv.RASTER_CODES[direction]
+
+    #######################################################################
+    # Groups raster ecoords into scan lines in the order they are engraved.
+    # Returns a list of (y,xs,loops) with the positions in mils and the
+    # points of each scan line in order of increasing x.
+    #######################################################################
+    def make_scanlines(self,ecoords_in,Raster_step,FlipXoffset,scale,update_gui):
+        scanline = []
+        scanline_y = None
+        if Raster_step < 0.0:
+            irange = range(len(ecoords_in))
+        else:
+            irange = range(len(ecoords_in)-1,-1,-1)
+        reverse = bool(FlipXoffset) ^ bool(Raster_step > 0.0) # ^ is bitwise XOR
+        timestamp=0
+        for i in irange:
+            stamp=int(3*time()) #update every 1/3 of a second
+            if (stamp != timestamp):
+                timestamp=stamp #interlock
+                update_gui("Preprocessing Raster Data: %.1f%%" %(100.0*float(i)/float(len(ecoords_in))))
+            y    = ecoords_in[i][1]
+            if y != scanline_y:
+                scanline.append([])
+                scanline_y = y
+            scanline[-1].append(ecoords_in[i])
+
+        rows = []
+        for scan_raw in scanline:
+            if reverse:
+                scan_raw.reverse()
+            scan = [self.ecoord_adj(point,scale,FlipXoffset) for point in scan_raw]
+            rows.append( (scan[0][1],[e[0] for e in scan],[e[2] for e in scan]) )
+        return rows
+
     def make_egv_data(self, ecoords_in,
                             startX=0,
                             startY=0,
@@ -269,7 +444,9 @@ class egv:
                             stop_calc=None,
                             FlipXoffset=0,
                             Rapid_Feed_Rate=0,
-                            use_laser=True):
+                            use_laser=True,
+                            workers=1,
+                            pool=None):
 
         #print("make_egv_data",Rapid_Feed_Rate,len(ecoords_in))
         #print("Rapid_Feed_Rate=",Rapid_Feed_Rate)
@@ -304,8 +481,7 @@ class egv:
         
         if Raster_step==0:
             #self.write(ord("I"))
-            for code in speed:
-                self.write(code)
+            self.write_codes(speed)
 
             lastx,lasty,last_loop = self.ecoord_adj(ecoords_in[0],scale,FlipXoffset)
             if not Rapid_Feed_Rate:
@@ -324,9 +500,7 @@ class egv:
                 self.write(self.LEFT)
                 
             # Insert "S1E"
-            self.write(ord("S"))
-            self.write(ord("1"))
-            self.write(ord("E"))
+            self.write_codes(b"S1E")
             ###########################################################
             laser   = False
             
@@ -385,31 +559,34 @@ class egv:
               ###########################################################
             Rapid_flag=True
             ###################################################
-            scanline = []
-            scanline_y = None
-            if Raster_step < 0.0:
-                irange = range(len(ecoords_in))
+            # ecoords_in can also be RasterRuns (the rows are then made
+            # directly from the runs without any ecoords)
+            raster_runs = ecoords_in
+            if not isinstance(raster_runs,RasterRuns):
+                raster_runs = RasterRuns.from_ecoords(ecoords_in)
+            if raster_runs != None:
+                n_rows   = len(raster_runs)
+                scanline = raster_runs.egv_rows(Raster_step,FlipXoffset,scale)
             else:
-                irange = range(len(ecoords_in)-1,-1,-1)
-            timestamp=0
-            for i in irange:
-                #if i%1000 == 0:
-                stamp=int(3*time()) #update every 1/3 of a second
-                if (stamp != timestamp):
-                    timestamp=stamp #interlock
-                    update_gui("Preprocessing Raster Data: %.1f%%" %(100.0*float(i)/float(len(ecoords_in))))
-                y    = ecoords_in[i][1]
-                if y != scanline_y:
-                    scanline.append([ecoords_in[i]])
-                    scanline_y = y
-                else:
-                    if bool(FlipXoffset) ^ bool(Raster_step > 0.0): # ^ is bitwise XOR
-                        scanline[-1].insert(0,ecoords_in[i])
-                    else:
-                        scanline[-1].append(ecoords_in[i])
+                scanline = self.make_scanlines(ecoords_in,Raster_step,FlipXoffset,scale,update_gui)
+                n_rows   = len(scanline)
             update_gui("Raster Data Ready")
+            batches = None
+            if raster_runs != None and n_rows > 1:
+                # pool is a pool shared with other work (it is not shut
+                # down here), otherwise a pool of workers is made
+                if pool != None:
+                    batches = RasterBatches(self,pool,pool.workers,shared=True)
+                else:
+                    pool = process_pool(workers)
+                    if pool != None:
+                        batches = RasterBatches(self,pool,workers)
             ###################################################
-            lastx,lasty,last_loop = self.ecoord_adj(scanline[0][0],scale,FlipXoffset)
+            scanline = iter(scanline)
+            first_row = next(scanline)
+            scanline = chain([first_row],scanline)
+            lasty = first_row[0]
+            lastx = int(first_row[1][0])
             
             DXstart = lastx-startX
             DYstart = lasty-startY
@@ -418,8 +595,7 @@ class egv:
                 self.make_egv_rapid(DXstart,DYstart,Rapid_Feed_Rate,board_name,finish=False)
 
             ##self.write(ord("I"))
-            for code in speed:
-                self.write(code)
+            self.write_codes(speed)
 
             if not Rapid_Feed_Rate:
                 self.make_dir_dist(DXstart,DYstart)
@@ -433,24 +609,21 @@ class egv:
                 self.write(ord("L"))
             self.write(ord("B"))
             # Insert "S1E"
-            self.write(ord("S"))
-            self.write(ord("1"))
-            self.write(ord("E"))
+            self.write_codes(b"S1E")
             dx_last   = 0
 
             sign = -1
             cnt = 1
             timestamp=0
-            for scan_raw in scanline:
-                scan = []
-                for point in scan_raw:
-                    e0,e1,e2 = self.ecoord_adj(point,scale,FlipXoffset)
-                    scan.append([e0,e1,e2])
+            move = self.move
+            for y,xs,loops in scanline:
                 stamp=int(3*time()) #update every 1/3 of a second
                 if (stamp != timestamp):
                     timestamp=stamp #interlock
-                    update_gui("Generating EGV Data: %.1f%%" %(100.0*float(cnt)/float(len(scanline))))
+                    update_gui("Generating EGV Data: %.1f%%" %(100.0*float(cnt)/float(n_rows)))
                     if stop_calc[0]==True:
+                        if batches != None:
+                            batches.close(cancel=True)
                         raise Exception("Action Stopped by User.")
                 cnt = cnt+1
                 ######################################
@@ -458,12 +631,11 @@ class egv:
                 ######################################
                 sign      = -sign
                 last_loop =  None
-                y         =  scan[0][1]
                 dy        =  y-lasty
                 if sign == 1:
-                    xr = scan[0][0]
+                    xr = int(xs[0])
                 else:
-                    xr = scan[-1][0]
+                    xr = int(xs[-1])
                 dxr = xr - lastx
                 ######################################
                 ## Make Rapid move if needed        ##
@@ -482,8 +654,7 @@ class egv:
                             self.write(ord("N"))
                             self.make_dir_dist(0,dy+yoffset)
                             self.flush(laser_on=False)
-                            self.write(ord("S"))
-                            self.write(ord("E"))
+                            self.write_codes(b"SE")
                         else:
                             DX=0
                             DY=dy+yoffset
@@ -500,18 +671,18 @@ class egv:
 
                             sign  = -sign
                             if sign == 1:
-                                xr = scan[0][0]
+                                xr = int(xs[0])
                             else:
-                                xr = scan[-1][0]
+                                xr = int(xs[-1])
                             dxr = xr - lastx
                     lasty = y
 
                         
                 ######################################
                 if sign == 1:
-                    rng = range(0,len(scan),1)
+                    rng = range(0,len(xs),1)
                 else:
-                    rng = range(len(scan)-1,-1,-1)
+                    rng = range(len(xs)-1,-1,-1)
                 ######################################
                 ## Pad row end if needed ##
                 ###########################
@@ -526,20 +697,40 @@ class egv:
                     lastx = lastx+dxr
                     
                 Rapid_flag=False
-                ######################################   
+                ######################################
+                if loops == None:
+                    if (batches != None and batches.add_row(xs,sign,lastx)) \
+                       or self.make_raster_row(xs,sign,lastx):
+                        lastx = int(xs[0]) if sign < 0 else int(xs[-1])
+                        lasty = y
+                        continue
+                    xs = xs.tolist()
+                    loops = [j//2 for j in range(len(xs))]
                 for j in rng:
-                    x  = scan[j][0]
+                    x  = xs[j]
                     dx = x - lastx
                     ##################################
-                    loop = scan[j][2]
+                    loop = loops[j]
                     if loop==last_loop:
-                        self.make_cut_line(dx,0,True)
+                        # same as self.make_cut_line(dx,0,True)
+                        if dx > 0:
+                            move(self.RIGHT,dx,laser_on=True)
+                        elif dx < 0:
+                            move(self.LEFT,-dx,laser_on=True)
+                        else:
+                            move(self.UP,0,laser_on=True)
                     else:
+                        # same as self.make_dir_dist(dx,0)
                         if dx*sign > 0.0:
-                            self.make_dir_dist(dx,0)
+                            if dx > 0:
+                                move(self.RIGHT,dx)
+                            else:
+                                move(self.LEFT,-dx)
                     lastx     = x
                     last_loop = loop
                 lasty = y
+            if batches != None:
+                batches.finish()
             
             # Make final move to ensure last move is to the right 
             self.make_dir_dist(pad,0)
@@ -574,17 +765,13 @@ class egv:
                 self.write(ord("N"))
                 self.make_dir_dist(dx_final,dy_final)
                 self.flush(laser_on=False)
-                self.write(ord("S"))
-                self.write(ord("E"))
+                self.write_codes(b"SE")
             ##############################################################
             
            
         # Append Footer
         self.flush(laser_on=False)
-        self.write(ord("F"))
-        self.write(ord("N"))
-        self.write(ord("S"))
-        self.write(ord("E"))
+        self.write_codes(b"FNSE")
         update_gui("EGV Data Complete")
         return
 
@@ -592,16 +779,11 @@ class egv:
         speed = self.make_speed(Feed,board_name=board_name,Raster_step=0)
         if finish:
             self.write(ord("I"))
-        for code in speed:
-            self.write(code)
+        self.write_codes(speed)
         self.flush(laser_on=False)
-        self.write(ord("N"))
-        self.write(ord("R"))
-        self.write(ord("B"))
+        self.write_codes(b"NRB")
         # Insert "S1E"
-        self.write(ord("S"))
-        self.write(ord("1"))
-        self.write(ord("E"))
+        self.write_codes(b"S1E")
         ###########################################################
         # Move Distance
         self.make_cut_line(DX,DY,Spindle=0)
@@ -612,9 +794,7 @@ class egv:
             self.write(ord("F"))
         else:
             self.write(ord("@"))
-        self.write(ord("N"))
-        self.write(ord("S"))
-        self.write(ord("E"))
+        self.write_codes(b"NSE")
         return
 
     def rapid_move_slow(self,dx,dy,Rapid_Feed_Rate,Feed,board_name):
@@ -635,8 +815,7 @@ class egv:
         self.write(ord("N"))
         self.make_dir_dist(0,tiny_step)
         self.flush(laser_on=False)
-        self.write(ord("S"))
-        self.write(ord("E"))
+        self.write_codes(b"SE")
 
 
     def rapid_move_fast(self,dx,dy):
@@ -654,8 +833,7 @@ class egv:
         self.write(ord("N"))
         self.make_dir_dist(dx+pad,dy-pad)
         self.flush(laser_on=False)
-        self.write(ord("S"))
-        self.write(ord("E"))
+        self.write_codes(b"SE")
 
 
     def change_speed(self,Feed,board_name,laser_on=False,Raster_step=0,pad=True):
@@ -667,22 +845,13 @@ class egv:
             self.make_dir_dist(-cspad,-cspad)
         self.flush(laser_on=False)
         
-        self.write(ord("@"))
-        self.write(ord("N"))
-        self.write(ord("S"))
-        self.write(ord("E"))
+        self.write_codes(b"@NSE")
         speed = self.make_speed(Feed,board_name,Raster_step=Raster_step)
         #print Feed,speed
-        for code in speed:
-            self.write(code)
-        self.write(ord("N"))
-        self.write(ord("R"))
-        self.write(ord("B"))
+        self.write_codes(speed)
+        self.write_codes(b"NRB")
         ## Insert "SIE"
-        self.write(ord("S"))
-        self.write(ord("1"))
-        self.write(ord("E"))
-        self.write(ord("U"))
+        self.write_codes(b"S1EU")
 
         if pad:
             self.make_dir_dist(cspad,cspad)
@@ -704,9 +873,235 @@ class egv:
                 modal_value = code
             new_data.append(code)
         return new_data
+
+    def strip_redundant_data(self, data, modal_value=None):
+        # Same as strip_redundant_codes() for bytes (only the direction
+        # codes are looked at one by one).  Returns the data and the modal
+        # value at the end of the data so the data can be stripped in parts.
+        E = b"E"
+        parts = egv.DIRECTION_CODES.split(bytes(data))
+        new_data = [parts[0]]
+        for k in range(1,len(parts),2):
+            code = parts[k]
+            if code != modal_value or code == E:
+                new_data.append(code)
+                modal_value = code
+            new_data.append(parts[k+1])
+        return b"".join(new_data),modal_value
             
+
+
+#######################################################################
+# Makes the codes of a batch of RasterBatches.  items are codes (that
+# are written as they are) and (state,xs,sign,lastx) raster rows.  This
+# is a module level function so it can run in a worker process.
+#######################################################################
+def make_raster_batch(items):
+    data = bytearray()
+    EGV = egv(target=data)
+    for item in items:
+        if isinstance(item,tuple):
+            state,xs,sign,lastx = item
+            EGV.Modal_dir,EGV.Modal_dist,EGV.Modal_on,EGV.Modal_AX,EGV.Modal_AY = state
+            EGV.make_raster_row(xs,sign,lastx)
+            EGV.flush()
+        else:
+            data.extend(item)
+    return bytes(data)
+
+##############################################################################
+# RasterBatches makes the codes of the raster rows in worker processes.    #
+# make_egv_data() still does everything between the rows (so the direction #
+# of each row is known when it is added) but those codes are collected     #
+# with the rows in batches, and the codes of the batches are written in    #
+# order as the workers finish them.  The last move of each row is flushed  #
+# by the worker: the move after a row is always in the other direction or  #
+# with the laser off so it would be flushed by make_egv_data() anyway.     #
+##############################################################################
+class RasterBatches:
+    BATCH_RUNS = 20000 # runs in each batch
+
+    def __init__(self,EGV,pool,workers,shared=False):
+        self.EGV   = EGV
+        self.pool  = pool
+        self.shared = shared
+        self.tasks = OrderedTasks(pool,2*workers)
+        self.items = []
+        self.runs  = 0
+        self.codes = bytearray()
+        # codes written by EGV go into self.codes until finish()
+        self.write       = EGV.__dict__.get("write")
+        self.write_codes = EGV.__dict__.get("write_codes")
+        self.redirect()
+
+    def redirect(self):
+        self.EGV.write       = self.codes.append
+        self.EGV.write_codes = self.codes.extend
+
+    def restore(self):
+        self.EGV.write = self.write
+        if self.write_codes != None:
+            self.EGV.write_codes = self.write_codes
+        else:
+            del self.EGV.write_codes
+
+    def output(self,results):
+        if results != []:
+            self.restore()
+            for data in results:
+                self.EGV.write_codes(data)
+            self.redirect()
+
+    def add_row(self,xs,sign,lastx):
+        # Returns False for rows that make_raster_row() can not do
+        if not (xs[1::2] > xs[0::2]).all():
+            return False
+        EGV = self.EGV
+        state = (EGV.Modal_dir,EGV.Modal_dist,EGV.Modal_on,EGV.Modal_AX,EGV.Modal_AY)
+        self.items.append(bytes(self.codes))
+        self.items.append((state,xs,sign,lastx))
+        del self.codes[:]
+        # state after the row (the last move is flushed by the worker)
+        if sign == 1:
+            EGV.Modal_dir = EGV.RIGHT
+        else:
+            EGV.Modal_dir = EGV.LEFT
+        EGV.Modal_AX   = EGV.Modal_dir
+        EGV.Modal_dist = 0
+        EGV.Modal_on   = True
+        self.runs = self.runs + len(xs)//2
+        if self.runs >= RasterBatches.BATCH_RUNS:
+            self.submit()
+        return True
+
+    def submit(self):
+        if self.items != []:
+            self.output(self.tasks.add(make_raster_batch,self.items))
+            self.items = []
+            self.runs  = 0
+
+    def finish(self):
+        self.items.append(bytes(self.codes))
+        del self.codes[:]
+        self.submit()
+        self.output(self.tasks.finish())
+        self.close()
+
+    def close(self,cancel=False):
+        self.tasks.cancel()
+        if not self.shared:
+            stop_pool(self.pool,cancel)
+        if self.EGV.write == self.codes.append:
+            self.restore()
+
         
 if __name__ == "__main__":
+    if "--benchmark" in sys.argv:
+        # Cut line runs of a dense vector design (short segments of circles
+        # and long diagonal lines) compared with the per mil list used before
+        def runs_per_mil(n,slope):
+            h=[]
+            for i in range(1,n+1):
+                h.append(round(i*slope,0))
+            runs=[]
+            Lh=0.0
+            for i in range(len(h)):
+                straight = (h[i]==Lh)
+                if runs != [] and runs[-1][0] == straight:
+                    runs[-1][1] = runs[-1][1]+1
+                else:
+                    runs.append([straight,1])
+                Lh=h[i]
+            return runs
+
+        segments = []
+        for j in range(200):
+            r = 50+j*20
+            for i in range(72):
+                a0 = 2*pi*i/72
+                a1 = 2*pi*(i+1)/72
+                segments.append((round(r*cos(a1))-round(r*cos(a0)),round(r*sin(a1))-round(r*sin(a0))))
+        for i in range(1,500):
+            segments.append((8000,8000*i//500))
+            segments.append((8000*i//500,-8000))
+        segments = [(dx,dy) for dx,dy in segments if abs(dx) != abs(dy) and dx != 0 and dy != 0]
+        lines = []
+        for dx,dy in segments:
+            adx = abs(dx/1000.0)
+            ady = abs(dy/1000.0)
+            if adx > ady:
+                lines.append((abs(dx),ady/adx))
+            else:
+                lines.append((abs(dy),adx/ady))
+        EGV=egv()
+        t0=time()
+        runs_old = [runs_per_mil(n,slope) for n,slope in lines]
+        t_old = time()-t0
+        t0=time()
+        runs_new = [EGV.cut_line_runs(n,slope) for n,slope in lines]
+        t_new = time()-t0
+        mils = sum([n for n,slope in lines])
+        print("%d segments, %.1f inches" %(len(lines),mils/1000.0))
+        print("per mil list  : %10.0f segments/s" %(len(lines)/t_old))
+        print("cut_line_runs : %10.0f segments/s" %(len(lines)/t_new))
+        print("identical     :",runs_old==runs_new)
+
+        data=[]
+        EGV=egv(target=data.append)
+        t0=time()
+        for dx,dy in segments:
+            EGV.make_cut_line(dx,dy,True)
+        EGV.flush()
+        print("make_cut_line : %10.0f segments/s (%d bytes)" %(len(segments)/(time()-t0),len(data)))
+
+        # Whole vector job written with a function per code and into a bytearray
+        ecoords = []
+        x = y = 0.0
+        for loop,(dx,dy) in enumerate(segments):
+            ecoords.append([x,y,loop//72])
+            x = x+dx/1000.0
+            y = y+dy/1000.0
+        results = []
+        for name in ("function","bytearray"):
+            if name == "function":
+                data = []
+                EGV = egv(target=lambda s:data.append(s))
+            else:
+                data = bytearray()
+                EGV = egv(target=data)
+            t0=time()
+            EGV.make_egv_data(ecoords,Feed=20)
+            results.append(bytes(bytearray(data)))
+            print("%-14s: %10.0f bytes/s" %(name,len(data)/(time()-t0)))
+        print("identical     :",results[0]==results[1])
+
+        # Raster job of a dithered image made from the ecoords lists (one
+        # python list per point) and directly from the runs of the image
+        if NUMPY:
+            import tracemalloc
+            from PIL import Image
+            from raster_scan import RasterScan
+            image = Image.radial_gradient("L").resize((2000,1500)).convert("1")
+            def raster_job(name):
+                runs = RasterScan(1000.0).make_raster_runs(image,2)[0]
+                if name == "ecoords lists":
+                    runs = [list(c) for c in runs.ecoords()]
+                data = bytearray()
+                egv(target=data).make_egv_data(runs,Feed=12,Raster_step=2,FlipXoffset=2.0)
+                return data
+            results = []
+            for name in ("ecoords lists","raster runs"):
+                t0=time()
+                results.append(raster_job(name))
+                t = time()-t0
+                tracemalloc.start()
+                raster_job(name)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print("%-14s: %7.2f s %8.1f MB peak (%d bytes)" %(name,t,peak/1e6,len(results[-1])))
+            print("identical     :",results[0]==results[1])
+        sys.exit()
+
     EGV=egv()
     bname = "LASER-M2"
     values  = [.1,.2,.3,.4,.5,.6,.7,.8,.9,1,2,3,4,5,6,7,8,9,10,20,30,40,50,70,90,100]
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+"""
+    This script keeps the EGV data of jobs in a cache directory so the
+    same job does not need to be generated again
+
+    Copyright (C) <2017-2023>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import os
+import json
+import hashlib
+from ecoords import ECoordArray, RasterRuns
+
+NUMPY=True
+try:
+    import numpy
+except:
+    NUMPY = False
+
+##############################################################################
+# EGV_CACHE stores the EGV data of a job in a file named by a hash of the  #
+# job (the coordinates and every setting passed to make_egv_data()).  The  #
+# modification time of a file is updated when it is used and the least    #
+# recently used files are deleted when the cache is larger than max_bytes. #
+# Changing version (the program version) makes all old entries unused.     #
+##############################################################################
+class EGV_CACHE:
+    def __init__(self, directory, max_bytes=500000000, version=""):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version   = version
+
+    def key(self, ecoords, settings):
+        # settings is a dictionary of the make_egv_data() arguments
+        h = hashlib.sha1()
+        h.update(("%s %r" %(self.version,sorted(settings.items()))).encode("utf-8"))
+        if isinstance(ecoords,RasterRuns):
+            arrays = [ecoords.y,ecoords.first,ecoords.x0,ecoords.x1]
+        else:
+            if not isinstance(ecoords,ECoordArray):
+                ecoords = ECoordArray.from_list(ecoords)
+            arrays = [ecoords.x,ecoords.y,ecoords.loop]
+            if ecoords.feed != None:
+                arrays = arrays + [ecoords.feed,ecoords.spindle]
+        h.update(type(ecoords).__name__.encode("utf-8"))
+        for a in arrays:
+            if NUMPY and isinstance(a,numpy.ndarray):
+                a = numpy.ascontiguousarray(a)
+            h.update(("%d " %(len(a))).encode("utf-8"))
+            h.update(memoryview(a))
+        return h.hexdigest()
+
+    def filename(self, key, extension=".egv"):
+        return os.path.join(self.directory,key+extension)
+
+    def contains(self, key):
+        return os.path.isfile(self.filename(key))
+
+    def get(self, key):
+        # Returns the data or None
+        try:
+            fin = open(self.filename(key),'rb')
+            data = fin.read()
+            fin.close()
+            os.utime(self.filename(key),None)
+        except:
+            return None
+        return data
+
+    def put(self, key, data):
+        entry = self.writer(key)
+        entry.write(data)
+        entry.close()
+
+    def get_path(self, key):
+        # Returns the ecoords stored with put_path() or None
+        try:
+            fin = open(self.filename(key,".path"),'r')
+            ecoords = json.load(fin)
+            fin.close()
+            os.utime(self.filename(key,".path"),None)
+        except:
+            return None
+        return ecoords
+
+    def put_path(self, key, ecoords):
+        # Stores ecoords (a list of [x,y,loop]) for key, used for the
+        # order of paths made by an optimization that is not the same
+        # every time it runs
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            temp_name = self.filename(key,".path")+".%d.tmp" %(os.getpid())
+            fout = open(temp_name,'w')
+            json.dump([[float(x),float(y),int(loop)] for x,y,loop in ecoords],fout)
+            fout.close()
+            if os.path.isfile(self.filename(key,".path")):
+                os.remove(self.filename(key,".path"))
+            os.rename(temp_name,self.filename(key,".path"))
+        except:
+            return
+        self.evict()
+
+    def writer(self, key):
+        # Returns an EGV_CACHE_WRITER to store the data of key as it is made
+        return EGV_CACHE_WRITER(self,key)
+
+    def evict(self):
+        # Delete the least recently used files until the cache fits
+        try:
+            files = []
+            total = 0
+            for name in os.listdir(self.directory):
+                if not (name.endswith(".egv") or name.endswith(".path")):
+                    continue
+                path = os.path.join(self.directory,name)
+                st = os.stat(path)
+                files.append((st.st_mtime,path,st.st_size))
+                total = total+st.st_size
+            files.sort()
+            for mtime,path,size in files:
+                if total <= self.max_bytes:
+                    break
+                os.remove(path)
+                total = total-size
+        except:
+            pass
+
+    def clear(self):
+        try:
+            for name in os.listdir(self.directory):
+                if name.endswith(".egv") or name.endswith(".path") or name.endswith(".tmp"):
+                    os.remove(os.path.join(self.directory,name))
+        except:
+            pass
+
+##############################################################################
+# EGV_CACHE_WRITER writes the data of one entry to a temporary file as it  #
+# is made, so the data does not need to be kept in memory.  close() gives  #
+# the file the name of the key (so a file with that name is always         #
+# complete).  Nothing is stored if the data gets larger than max_bytes or  #
+# abort() is called.                                                       #
+##############################################################################
+class EGV_CACHE_WRITER:
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key   = key
+        self.size  = 0
+        self.fout  = None
+        self.temp_name = cache.filename(key)+".%d.tmp" %(os.getpid())
+        try:
+            if not os.path.isdir(cache.directory):
+                os.makedirs(cache.directory)
+            self.fout = open(self.temp_name,'wb')
+        except:
+            self.fout = None
+
+    def write(self, data):
+        if self.fout == None:
+            return
+        self.size = self.size+len(data)
+        if self.size > self.cache.max_bytes:
+            self.abort()
+            return
+        try:
+            self.fout.write(data)
+        except:
+            self.abort()
+
+    def close(self):
+        if self.fout == None:
+            return
+        try:
+            self.fout.close()
+            self.fout = None
+            filename = self.cache.filename(self.key)
+            if os.path.isfile(filename):
+                os.remove(filename)
+            os.rename(self.temp_name,filename)
+        except:
+            self.abort()
+            return
+        self.cache.evict()
+
+    def abort(self):
+        try:
+            if self.fout != None:
+                self.fout.close()
+            self.fout = None
+            os.remove(self.temp_name)
+        except:
+            pass
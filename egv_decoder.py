@@ -0,0 +1,361 @@
+#!/usr/bin/env python
+"""
+    This script reads EGV data and estimates the time the laser needs to
+    run it
+
+    Copyright (C) <2017-2023>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import re
+from math import *
+from LaserSpeed import LaserSpeed
+
+##############################################################################
+# EGV_DECODER walks EGV data (the codes written by egv.py) and calls       #
+#     speed(code)                   for each speed code ("CV..." / "V...G") #
+#     move(direction,dist,laser_on) for each move (dist in mils)           #
+#     execute()                     when "E" runs the moves made after "N"  #
+# The moves are "compact" (at the speed of the last speed code) after      #
+# "S1E" until "@" or "F".  Moves after "N" (until "E") and moves outside   #
+# of compact mode are rapid moves.  Codes that are not EGV codes (the      #
+# header of an EGV file, white space) are skipped.                         #
+# decode_start(), decode_part() and decode_part(data,final=True) decode   #
+# data given in pieces (cut anywhere) the same as decode() of all of it.  #
+##############################################################################
+class EGV_DECODER:
+    TOKENS = re.compile(b"(C?V[0-9]+(?:G[0-9]{3})?(?:C(?!V))?)|((?:[a-z]|\\|[a-z]|[0-9]{3})+)|([A-Z@])")
+    DISTANCES = re.compile(b"\\|[a-z]|[a-z]|[0-9]{3}")
+    # codes that always start a new token (data can be split before them)
+    BREAKS = [bytes(bytearray([c])) for c in bytearray(b"BTLRMDUNEF@")]
+
+    RIGHT = 66 #ord("B")=66
+    LEFT  = 84 #ord("T")=84
+    UP    = 76 #ord("L")=76
+    DOWN  = 82 #ord("R")=82
+    ANGLE = 77 #ord("M")=77
+    ON    = 68 #ord("D")=68
+    OFF   = 85 #ord("U")=85
+
+    def __init__(self):
+        self.distances = {}
+
+    def distance(self, codes):
+        # Distance in mils of a run of distance codes
+        if codes in self.distances:
+            return self.distances[codes]
+        dist = 0
+        for code in self.DISTANCES.findall(codes):
+            c = bytearray(code)
+            if len(c) == 3:
+                dist = dist + int(code)
+            elif len(c) == 2:  # "|a" through "|z"
+                dist = dist + c[1]-96+25
+            elif c[0] == 122:  # "z"
+                dist = dist + 255
+            else:              # "a" through "y"
+                dist = dist + c[0]-96
+        self.distances[codes] = dist
+        return dist
+
+    def decode(self, data):
+        self.decode_start()
+        self.decode_part(data,final=True)
+
+    def decode_start(self):
+        self.compact   = False # compact mode ("S1E" until "@" or "F")
+        self.paused    = False # "N" was seen, moves wait for "E"
+        self.laser_on  = False
+        self.direction = None
+        self.AX = self.RIGHT
+        self.AY = self.UP
+        self.s1 = False
+        self.tail = b""
+
+    def decode_part(self, data, final=False):
+        # Decodes the data up to the last code that starts a new token and
+        # keeps the rest for the next part (all of it when final is True)
+        if not isinstance(data,(bytes,bytearray)):
+            data = bytes(bytearray(data))
+        if self.tail != b"":
+            data = self.tail+data
+        if not final:
+            end = max([data.rfind(c) for c in self.BREAKS])
+            if end <= 0:
+                self.tail = bytes(data)
+                return
+            self.tail = bytes(data[end:])
+            data = data[:end]
+        else:
+            self.tail = b""
+        s1 = self.s1
+        for m in self.TOKENS.finditer(data):
+            speed,dist,code = m.groups()
+            if dist != None:
+                if self.direction != None:
+                    self.move(self.direction,self.distance(dist),self.laser_on)
+                continue
+            if speed != None:
+                self.speed(speed.decode("ascii"))
+                continue
+            c = ord(code)
+            if c == self.RIGHT or c == self.LEFT:
+                self.direction = c
+                self.AX = c
+            elif c == self.UP or c == self.DOWN:
+                self.direction = c
+                self.AY = c
+            elif c == self.ANGLE:
+                self.direction = c
+            elif c == self.ON:
+                self.laser_on = True
+            elif c == self.OFF:
+                self.laser_on = False
+            elif c == 78:                      # "N"
+                self.paused = True
+            elif c == 83:                      # "S" ("S1E", "SE" or "S1P")
+                s1 = data[m.end():m.end()+1] == b"1"
+            elif c == 69:                      # "E"
+                self.execute()
+                self.paused = False
+                if s1:
+                    self.compact = True
+                s1 = False
+            elif c == 64 or c == 70:           # "@" or "F"
+                self.compact  = False
+                self.laser_on = False
+        self.s1 = s1
+
+    def rapid(self):
+        # True if moves are rapid moves
+        return self.paused or not self.compact
+
+    def speed(self, code):
+        pass
+
+    def move(self, direction, dist, laser_on):
+        pass
+
+    def execute(self):
+        pass
+
+
+##############################################################################
+# EGV_TIME estimates the run time of EGV data.  Compact moves take the     #
+# step period of the speed code for each mil (diagonal steps are slower by #
+# the diagonal ratio in the speed code).  Each change of the horizontal    #
+# direction while rastering (the laser moves to the next row) takes        #
+# turnaround(period,raster_step) seconds.  The time the board takes to     #
+# stop and start again at each turnaround is not in the model, it is the   #
+# "turnarounds" coefficient.  Rapid moves run at rapid_speed (mm/s), plus  #
+# rapid_overhead seconds each time they are executed.                      #
+# The time of an operation is the sum of its features (see features())     #
+# times the coefficients, which can be fitted to measured run times (see   #
+# time_calibration.py).  The default coefficients give the model times.    #
+##############################################################################
+class EGV_TIME(EGV_DECODER):
+    FEATURES = ("step_time","rapid_time","turnaround_time","turnarounds","packets","rapids",
+                "speed_changes","runs")
+    # 0.12 s to stop and start at a turnaround is the old measured raster
+    # estimate at 300 inches/minute
+    DEFAULT_COEFFICIENTS = {"step_time":1.0, "rapid_time":1.0, "turnaround_time":1.0, "turnarounds":0.12}
+
+    def __init__(self, board="M2", rapid_speed=100.0, rapid_overhead=0.0, turnaround=None,
+                 coefficients=None):
+        EGV_DECODER.__init__(self)
+        self.board          = board
+        self.rapid_speed    = rapid_speed
+        self.rapid_overhead = rapid_overhead
+        if turnaround != None:
+            self.turnaround = turnaround
+        if coefficients == None:
+            coefficients = self.DEFAULT_COEFFICIENTS
+        self.coefficients = coefficients
+
+    def turnaround(self, period, raster_step):
+        # The board moves to the next row by itself: raster_step mils (the
+        # step in the speed code) at the step period of the speed code
+        return abs(raster_step)*period
+
+    def speed(self, code):
+        self.counts["speeds"] = self.counts["speeds"]+1
+        code_value, gear, step_value, diagonal, raster_step = LaserSpeed.parse_speed_code(code)
+        speed = LaserSpeed.get_speed_from_code(code, board=self.board)
+        self.feed   = speed
+        self.raster = raster_step != 0
+        self.raster_step = raster_step
+        self.period = 0.0254/speed   # seconds per mil
+        self.diagonal_period = self.period
+        if not self.raster and step_value > 0:
+            b, m, gear = LaserSpeed.get_gearing(self.board, gear=gear, uses_raster_step=False)
+            self.diagonal_period = self.period + diagonal*step_value/(-m)/1000.0
+        self.last_x = None
+
+    def move(self, direction, dist, laser_on):
+        if dist == 0:
+            return
+        if self.rapid():
+            if direction == self.RIGHT:
+                self.rapid_x = self.rapid_x + dist
+            elif direction == self.LEFT:
+                self.rapid_x = self.rapid_x - dist
+            elif direction == self.UP:
+                self.rapid_y = self.rapid_y + dist
+            elif direction == self.DOWN:
+                self.rapid_y = self.rapid_y - dist
+            else:
+                if self.AX == self.RIGHT:
+                    self.rapid_x = self.rapid_x + dist
+                else:
+                    self.rapid_x = self.rapid_x - dist
+                if self.AY == self.UP:
+                    self.rapid_y = self.rapid_y + dist
+                else:
+                    self.rapid_y = self.rapid_y - dist
+            return
+        if direction == self.ANGLE:
+            t = dist*self.diagonal_period
+        else:
+            t = dist*self.period
+            if self.raster and (direction == self.RIGHT or direction == self.LEFT):
+                if self.last_x != None and direction != self.last_x:
+                    self.times["turnaround"] = self.times["turnaround"]+self.turnaround(self.period,self.raster_step)
+                    self.counts["turnarounds"] = self.counts["turnarounds"]+1
+                self.last_x = direction
+        if laser_on:
+            self.times["cut"] = self.times["cut"]+t
+            self.counts["cut_mils"] = self.counts["cut_mils"]+dist
+        else:
+            self.times["travel"] = self.times["travel"]+t
+            self.counts["travel_mils"] = self.counts["travel_mils"]+dist
+
+    def execute(self):
+        if self.rapid_x != 0 or self.rapid_y != 0:
+            dist = sqrt(self.rapid_x**2+self.rapid_y**2)
+            self.times["rapid"] = self.times["rapid"]+dist*0.0254/self.rapid_speed+self.rapid_overhead
+            self.counts["rapid_mils"] = self.counts["rapid_mils"]+dist
+            self.counts["rapids"] = self.counts["rapids"]+1
+        self.rapid_x = 0
+        self.rapid_y = 0
+
+    def estimate(self, data):
+        # Returns a dictionary of times in seconds ("cut", "travel",
+        # "rapid", "turnaround" and "total") and a dictionary of counts
+        self.estimate_start()
+        self.estimate_part(data)
+        return self.estimate_finish()
+
+    def estimate_start(self):
+        # estimate_start(), estimate_part() for each piece of the data and
+        # estimate_finish() estimate data as it is made (or sent)
+        self.times  = {"cut":0.0,"travel":0.0,"rapid":0.0,"turnaround":0.0}
+        self.counts = {"cut_mils":0,"travel_mils":0,"rapid_mils":0.0,"rapids":0,"turnarounds":0,
+                       "speeds":0,"bytes":0}
+        self.period = self.diagonal_period = 0.0254/self.rapid_speed
+        self.feed   = self.rapid_speed
+        self.raster = False
+        self.raster_step = 0
+        self.last_x = None
+        self.rapid_x = 0
+        self.rapid_y = 0
+        self.decode_start()
+
+    def estimate_part(self, data):
+        self.counts["bytes"] = self.counts["bytes"]+len(data)
+        self.decode_part(data)
+
+    def estimate_finish(self):
+        self.decode_part(b"",final=True)
+        self.execute()
+        self.times["total"] = sum(self.times.values())
+        return self.times,self.counts
+
+    def features(self, operations):
+        # Sum of the features of operations, a list of (name,data,passes)
+        # (one run of the laser).  Returns a dictionary.
+        features = dict([(name,0.0) for name in self.FEATURES])
+        for name,data,passes in operations:
+            times,counts = self.estimate(data)
+            self.add_features(features,times,counts,passes)
+        if operations != []:
+            features["runs"] = 1
+        return features
+
+    def add_features(self, features, times, counts, passes):
+        # Adds the features of an operation (times and counts from
+        # estimate()) run passes times to features
+        job = {"step_time"       : times["cut"]+times["travel"],
+               "rapid_time"      : times["rapid"],
+               "turnaround_time" : times["turnaround"],
+               "turnarounds"     : counts["turnarounds"],
+               "packets"         : (counts["bytes"]+29)//30,
+               "rapids"          : counts["rapids"],
+               "speed_changes"   : max(counts["speeds"]-1,0)}
+        for key in job:
+            features[key] = features[key]+job[key]*passes
+
+    def predict(self, features):
+        t = 0.0
+        for name in features:
+            t = t+self.coefficients.get(name,0.0)*features[name]
+        return t
+
+    def operation_times(self, operations):
+        # operations is a list of (name,data,passes).  Returns a dictionary
+        # of the total time of each operation (all passes) in seconds.  The
+        # time of starting a run is not included.
+        result = {}
+        for operation in operations:
+            features = self.features([operation])
+            features["runs"] = 0
+            name = operation[0]
+            result[name] = result.get(name,0.0)+self.predict(features)
+        return result
+
+
+if __name__ == "__main__":
+    # Time estimates of generated jobs and the time to decode them
+    from time import time
+    from egv import egv
+
+    def job(coords,**kwargs):
+        data = bytearray()
+        egv(target=data).make_egv_data(coords,**kwargs)
+        return data
+
+    square = [[0,0,1],[2,0,1],[2,2,1],[0,2,1],[0,0,1]]
+    diamond = [[1,0,1],[2,1,1],[1,2,1],[0,1,1],[1,0,1]]
+    rows = []
+    loop = 0
+    for k in range(1000):
+        y = 2.0-k*0.002
+        for x0 in (0.1,0.9):
+            loop = loop+1
+            rows.append([x0,y,loop])
+            rows.append([x0+0.5,y,loop])
+    estimator = EGV_TIME()
+    for name,data,expected in (
+        ("square 8 in at 10 mm/s",     job(square,Feed=10),       8*25.4/10),
+        ("diamond 5.66 in at 10 mm/s", job(diamond,Feed=10),      4*sqrt(2)*25.4/10),
+        ("1000 raster rows",           job(rows,Feed=100,Raster_step=2), None)):
+        t0 = time()
+        times,counts = estimator.estimate(data)
+        t_decode = time()-t0
+        line = "%-28s %8.1f s" %(name,times["total"])
+        if expected != None:
+            line = line+" (cut %.1f s, path length/speed %.1f s)" %(times["cut"],expected)
+        else:
+            line = line+" (cut %.1f s, %d turnarounds %.1f s)" %(times["cut"],counts["turnarounds"],times["turnaround"])
+        print(line+"  decoded in %.3f s" %(t_decode))
+    print("DONE")
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+"""
+    This script reads and writes EGV files
+
+    Copyright (C) <2017-2023>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import os
+import re
+import mmap
+
+##############################################################################
+# An EGV file is a text header, four values between "%" characters         #
+#     %y_start%x_start%y_end%x_end%                                         #
+# (the start and end positions of the head in mils) and the EGV data.      #
+# The data may be split into lines (white space is not part of the data).  #
+##############################################################################
+EGV_HEADER = re.compile(b"%([^%]*)%([^%]*)%([^%]*)%([^%]*)%")
+WHITE_SPACE = b" \r\n"
+
+def read_egv_file(filename):
+    # Returns (data,y_start,x_start,y_end,x_end), data is bytes.  The file
+    # is mapped into memory so the header is found and the white space is
+    # removed without reading the file in pieces.
+    f = open(filename,'rb')
+    try:
+        try:
+            contents = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+        except (ValueError,mmap.error):
+            # empty files can not be mapped
+            contents = f.read()
+        try:
+            header = EGV_HEADER.match(contents,max(contents.find(b"%"),0))
+            if header == None:
+                raise Exception("No EGV header found in file ( %s )." %(filename))
+            y_start,x_start,y_end,x_end = [int(v) for v in header.groups()]
+            data = contents[header.end():].translate(None,WHITE_SPACE)
+        finally:
+            if isinstance(contents,mmap.mmap):
+                contents.close()
+    finally:
+        f.close()
+    return data,y_start,x_start,y_end,x_end
+
+def open_egv_file(filename):
+    # Same as read_egv_file() but data is a memoryview of the mapped file
+    # when the data has no white space (as written by write_egv_file()),
+    # so nothing is read until the data is used.  The file stays mapped
+    # while data is in use.
+    f = open(filename,'rb')
+    try:
+        try:
+            contents = mmap.mmap(f.fileno(),0,access=mmap.ACCESS_READ)
+            data = memoryview(contents)
+        except (ValueError,TypeError,mmap.error):
+            # empty files can not be mapped (and Python 2 can not make a
+            # memoryview of a mapped file)
+            return read_egv_file(filename)
+    finally:
+        f.close()
+    header = EGV_HEADER.match(contents,max(contents.find(b"%"),0))
+    if header == None:
+        raise Exception("No EGV header found in file ( %s )." %(filename))
+    y_start,x_start,y_end,x_end = [int(v) for v in header.groups()]
+    start = header.end()
+    for c in bytearray(WHITE_SPACE):
+        if contents.find(bytes(bytearray([c])),start) != -1:
+            data.release()
+            contents.close()
+            return read_egv_file(filename)
+    return data[start:],y_start,x_start,y_end,x_end
+
+# Data of a mapped file framed at a time when it is sent, so the first
+# packets go out without waiting for the whole file to be read
+EGV_SEND_BLOCK = 30*1024
+
+EGV_BUFFER_SIZE = 1<<20
+
+def write_egv_file(fout, chunks, y_start=0, x_start=0, y_end=0, x_end=0):
+    # fout is a file opened with open(filename,'wb',EGV_BUFFER_SIZE) so
+    # the writes go through one large buffer.  chunks is an iterable of
+    # bytes/bytearrays (an EGV_STREAM or a list with all the data).
+    header = "Document type : LHYMICRO-GL file\n" + \
+             "Creator-Software: K40 Whisperer\n"  + \
+             "\n"
+    fout.write(header.replace("\n",os.linesep).encode('ascii'))
+    fout.write(("%%%d%%%d%%%d%%%d%%" %(y_start,x_start,y_end,x_end)).encode('ascii'))
+    for chunk in chunks:
+        fout.write(chunk)
+
+
+if __name__ == "__main__":
+    # Read a large EGV file with the old character by character loop and
+    # with read_egv_file()
+    import tempfile
+    from time import time
+
+    def read_egv_file_old(filemname):
+        EGV_data=[]
+        value1 = ""
+        value2 = ""
+        value3 = ""
+        value4 = ""
+        data=""
+        with open(filemname) as f:
+            c = f.read(1)
+            while c!="%" and c:
+                c = f.read(1)
+            for values in (1,2,3,4):
+                value = ""
+                c = f.read(1)
+                while c!="%" and c:
+                    value = value + c
+                    c = f.read(1)
+                if values == 1: value1 = value
+                if values == 2: value2 = value
+                if values == 3: value3 = value
+                if values == 4: value4 = value
+            while True:
+                c = f.read(1)
+                if not c:
+                    break
+                if c=='\n' or c==' ' or c=='\r':
+                    pass
+                else:
+                    data=data+"%c" %c
+                    EGV_data.append(ord(c))
+        return EGV_data,int(value1),int(value2),int(value3),int(value4)
+
+    filename = os.path.join(tempfile.mkdtemp(),"test.egv")
+    line = b"CV2232502G002NLBS1EDBz245UBbTbDTz245UBb" * 2
+    for n_lines,newline in ((10000,b"\n"),(10000,b""),(1000000,b"\n"),(1000000,b""),(4000000,b"")):
+        chunks = [line+newline]*n_lines
+        t0 = time()
+        fout = open(filename,'wb',EGV_BUFFER_SIZE)
+        write_egv_file(fout,chunks,0,0,12,-5)
+        fout.close()
+        t_write = time()-t0
+        size = os.path.getsize(filename)
+        t0 = time()
+        data,y_start,x_start,y_end,x_end = read_egv_file(filename)
+        t_read = time()-t0
+        result = "%6.1f MB %-10s write %6.3f s   read_egv_file %6.3f s" %(size/1e6,["no newlines","newlines"][newline!=b""],t_write,t_read)
+        if n_lines <= 10000:
+            t0 = time()
+            old = read_egv_file_old(filename)
+            result = result + "   old loop %6.3f s  same result = %s" \
+                     %(time()-t0,(bytes(bytearray(old[0])),)+old[1:] == (data,y_start,x_start,y_end,x_end))
+        t0 = time()
+        data,y_start,x_start,y_end,x_end = open_egv_file(filename)
+        result = result + "   open_egv_file %6.3f s" %(time()-t0)
+        print(result)
+        del data
+    os.remove(filename)
+    print("DONE")
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+'''
+This script streams egv data from the egv generators to the laser
+
+Copyright (C) 2017-2023 Scorch www.scorchworks.com
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  USA
+'''
+import threading
+from egv import egv
+from process_pool import start_pool, stop_pool
+try:
+    from concurrent.futures import TimeoutError as futures_timeout
+except:
+    futures_timeout = None
+try:
+    import queue
+except:
+    import Queue as queue
+
+pool_jobs = None # jobs of the EGV_STREAM for the (forked) worker processes
+
+#######################################################################
+# Makes the data of job number index of pool_jobs (module level so it
+# can run in a worker process)
+#######################################################################
+def make_job_data(index):
+    make_data = pool_jobs[index][0]
+    data = bytearray()
+    make_data(data,lambda msg=None: None,None)
+    return bytes(data)
+
+##############################################################################
+#  EGV_STREAM runs the egv generators in a producer thread.  The data is   #
+#  joined the same way Application.send_data() joins the operations (the   #
+#  "F" of each footer is changed to "@" when more data follows) and passed  #
+#  to the consumer through a bounded queue, so the laser can start while    #
+#  the rest of the job is still being generated.  The data is kept in      #
+#  bytearrays (the generators write into a bytearray).  With more than one #
+#  worker the jobs after the first are generated in worker processes at    #
+#  the same time as the first one, and joined in order when they are done. #
+#  There is one pool of workers for the whole stream: it is made by start()#
+#  (from the main thread) and the jobs get it to do their own work in it,  #
+#  so there are never more than workers processes.                         #
+#  When the framer's packet_size is given, the full packets of a repeated  #
+#  pass are framed once for each place the pass starts in a packet and     #
+#  sent again as they are (see repeat_pass()).                             #
+#  With an estimator (egv_decoder.EGV_TIME) the data of each job is        #
+#  decoded as it passes through the stream and features holds the time    #
+#  features of the whole stream when it is done.                           #
+##############################################################################
+class EGV_STREAM:
+    def __init__(self, chunk_size=1024, max_chunks=256, workers=1, max_frame_bytes=16000000,
+                 estimator=None):
+        self.workers    = workers
+        self.estimator  = estimator
+        self.features   = None
+        self.max_frame_bytes = max_frame_bytes
+        self.packet_size = None
+        self.pool       = None
+        self.jobs       = []
+        self.chunk_size = chunk_size
+        self.queue      = queue.Queue(maxsize=max_chunks)
+        self.thread     = None
+        self.cancelled  = False
+        self.error      = None
+        self.framer     = None
+        self.idle       = None
+        self.n_codes    = 0
+
+    def add_job(self, make_data, passes=1, strip_redundant=False):
+        # make_data(data,update,pool) generates the egv data for one
+        # operation by adding it to the bytearray data.  It should call
+        # update() from time to time so the data can be sent while it is
+        # generated.  pool is the pool of the stream (None when there are
+        # no workers or the job is done in a worker process).
+        if passes > 0:
+            self.jobs.append([make_data, passes, strip_redundant])
+
+    def empty(self):
+        return self.jobs == []
+
+    def start(self, framer=None, chunk_size=None, idle=None, packet_size=None):
+        # If a framer is supplied the queue holds the packets built by
+        # framer(chunk,final) instead of the raw chunks of data.  idle() is
+        # called while the consumer is waiting for data (used to keep the
+        # GUI alive).  packet_size is the number of bytes of data in each
+        # packet made by framer (chunk_size should be a multiple of it).
+        self.framer = framer
+        self.idle   = idle
+        self.packet_size = packet_size
+        if chunk_size != None:
+            self.chunk_size = chunk_size
+        global pool_jobs
+        pool_jobs = self.jobs
+        self.pool = start_pool(self.workers)
+        self.thread = threading.Thread(target=self.producer)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def cancel(self):
+        self.cancelled = True
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def __iter__(self):
+        if self.thread == None:
+            self.start()
+        try:
+            while True:
+                try:
+                    item = self.queue.get(timeout=0.1)
+                except queue.Empty:
+                    if self.idle != None:
+                        self.idle()
+                    continue
+                if item is None:
+                    break
+                yield item
+        finally:
+            self.cancel()
+        if self.error != None:
+            raise self.error
+
+    ##########################################################################
+    def put(self, item):
+        while not self.cancelled:
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+        raise Exception("EGV data stream cancelled.")
+
+    def emit(self, data, final=False, whole=False):
+        # Send all but the last four codes (the footer may still change)
+        if final or whole:
+            n_send = len(data)
+        else:
+            n_send = max(len(data)-4,0)
+            n_send = n_send - n_send % self.chunk_size
+        for i in range(0,n_send,self.chunk_size):
+            chunk = data[i:i+self.chunk_size]
+            if self.framer != None:
+                chunk = self.framer(chunk, final and i+self.chunk_size >= n_send)
+            self.put(chunk)
+        if final and n_send == 0 and self.framer != None:
+            self.put(self.framer([],True))
+        del data[:n_send]
+
+    def producer(self):
+        try:
+            self.produce()
+        except Exception as e:
+            self.error = e
+        try:
+            self.put(None)
+        except:
+            pass
+
+    def produce(self):
+        global pool_jobs
+        pool = self.pool
+        futures = {}
+        if pool != None:
+            for index in range(1,len(self.jobs)):
+                futures[index] = pool.submit(make_job_data,index)
+        try:
+            self.produce_jobs(futures)
+        finally:
+            if pool != None:
+                # the jobs that have not started are dropped when the
+                # stream is cancelled (all are done otherwise)
+                for future in futures.values():
+                    future.cancel()
+                stop_pool(pool,cancel=True)
+                self.pool = None
+            pool_jobs = None
+
+    def produce_jobs(self, futures):
+        pending = bytearray(b"I")
+        total   = 1
+        stripper = egv()
+        estimator = self.estimator
+        if estimator != None:
+            features = dict([(name,0.0) for name in estimator.FEATURES])
+
+        for index in range(len(self.jobs)):
+            make_data,passes,strip_redundant = self.jobs[index]
+            if total > 4:
+                pending[-4] = ord("@")
+            if passes > 1:
+                recorded = bytearray()
+            else:
+                recorded = None
+            job   = bytearray()
+            modal = [None]
+            n_job = [0]
+            if estimator != None:
+                estimator.estimate_start()
+
+            def update(msg=None):
+                # Move the data generated so far to the pending data
+                if strip_redundant:
+                    data,modal[0] = stripper.strip_redundant_data(job,modal[0])
+                else:
+                    data = job
+                pending.extend(data)
+                n_job[0] = n_job[0]+len(data)
+                if recorded != None:
+                    recorded.extend(data)
+                if estimator != None:
+                    estimator.estimate_part(data)
+                del job[:]
+                if len(pending) >= self.chunk_size+4:
+                    self.emit(pending)
+                if self.cancelled:
+                    raise Exception("EGV data stream cancelled.")
+
+            if index in futures:
+                while True:
+                    try:
+                        job.extend(futures[index].result(timeout=0.1))
+                        break
+                    except futures_timeout:
+                        if self.cancelled:
+                            raise Exception("EGV data stream cancelled.")
+            else:
+                make_data(job,update,self.pool)
+            update()
+            total = total+n_job[0]
+            self.emit(pending)
+            if estimator != None:
+                times,counts = estimator.estimate_finish()
+                estimator.add_features(features,times,counts,passes)
+
+            frames = {}
+            for k in range(1,passes):
+                pending[-4] = ord("@")
+                total = total+len(recorded)
+                if self.framer != None and self.packet_size != None:
+                    self.repeat_pass(pending,recorded,frames)
+                else:
+                    pending.extend(recorded)
+                    self.emit(pending)
+            recorded = None
+            frames = None
+
+        self.n_codes = total
+        self.emit(pending,final=True)
+        if estimator != None and self.jobs != []:
+            features["runs"] = 1
+            self.features = features
+
+    def repeat_pass(self, pending, recorded, frames):
+        # Sends recorded after pending.  pending is filled up to the start
+        # of a packet and sent, then the full packets of the pass (all but
+        # the footer) are sent from frames if they were framed for the same
+        # start in an earlier pass.  The rest of the pass (with its footer)
+        # is left in pending.  frames {head:[framed chunk,...]} is kept
+        # while it is smaller than max_frame_bytes.
+        packet_size = self.packet_size
+        head = (-len(pending)) % packet_size
+        n_body = max(len(recorded)-4-head,0)
+        n_body = n_body - n_body % packet_size
+        if n_body == 0:
+            pending.extend(recorded)
+            self.emit(pending)
+            return
+        pending.extend(recorded[:head])
+        self.emit(pending,whole=True)
+        body = frames.get(head)
+        if body == None:
+            body = []
+            for i in range(head,head+n_body,self.chunk_size):
+                body.append(self.framer(recorded[i:min(i+self.chunk_size,head+n_body)],False))
+            n_framed = sum([len(chunk) for chunk in body])
+            for chunks in frames.values():
+                n_framed = n_framed+sum([len(chunk) for chunk in chunks])
+            if n_framed <= self.max_frame_bytes:
+                frames[head] = body
+        for chunk in body:
+            self.put(chunk)
+        pending.extend(recorded[head+n_body:])
+        self.emit(pending)
+
+
+if __name__ == "__main__":
+    # Time to generate a job with a raster engrave and two vector
+    # operations with the jobs done one after the other and at the same
+    # time in worker processes
+    import random
+    from time import time
+    from PIL import Image
+    from raster_scan import RasterScan
+    from process_pool import default_workers
+
+    image = Image.radial_gradient("L").resize((3000,2000)).convert("1")
+    runs  = RasterScan(1000.0).make_raster_runs(image,1)[0]
+    random.seed(0)
+    vector = []
+    for loop in range(300):
+        x = random.uniform(0,10)
+        y = random.uniform(0,8)
+        for k in range(100):
+            a = 2*3.14159265*k/99
+            vector.append([x+0.2*random.random()*(1+a),y+0.2*random.random()*a,loop])
+
+    def make_job(ecoords,**kwargs):
+        def make_data(data,update,pool):
+            egv(target=data).make_egv_data(ecoords,update_gui=update,pool=pool,**kwargs)
+        return make_data
+    jobs = [("raster",make_job(runs,Feed=100,Raster_step=1),1,True),
+            ("engrave",make_job(vector,Feed=50),1,False),
+            ("cut",make_job(vector[::-1],Feed=10),2,False)]
+    for name,make_data,passes,strip_redundant in jobs:
+        t0 = time()
+        make_data(bytearray(),lambda msg=None: None,None)
+        print("%-8s %6.2f s" %(name,time()-t0))
+
+    results = []
+    for workers in (1,max(default_workers(),2)):
+        stream = EGV_STREAM(workers=workers)
+        for name,make_data,passes,strip_redundant in jobs:
+            stream.add_job(make_data,passes,strip_redundant)
+        data = bytearray()
+        t0 = time()
+        for chunk in stream:
+            data.extend(chunk)
+        results.append(data)
+        print("workers=%d  whole job %6.2f s" %(workers,time()-t0))
+    print("identical =",results[0] == results[1])
+    print("DONE")
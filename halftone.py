@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+"""
+    This script adjusts the darkness of raster images and converts them
+    to halftone (dithered) images
+
+    Copyright (C) <2017-2023>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from math import *
+from time import time
+from PIL import Image
+
+NUMPY=True
+try:
+    import numpy
+except:
+    NUMPY = False
+
+DITHER_METHODS = ("Floyd-Steinberg","Jarvis","Stucki","Atkinson","Bayer")
+
+# Error diffusion kernels: (divisor,[(dy,dx,weight),...])
+ERROR_KERNELS = {
+    "Floyd-Steinberg" : (16,[(0,1,7),
+                             (1,-1,3),(1,0,5),(1,1,1)]),
+    "Jarvis"          : (48,[(0,1,7),(0,2,5),
+                             (1,-2,3),(1,-1,5),(1,0,7),(1,1,5),(1,2,3),
+                             (2,-2,1),(2,-1,3),(2,0,5),(2,1,3),(2,2,1)]),
+    "Stucki"          : (42,[(0,1,8),(0,2,4),
+                             (1,-2,2),(1,-1,4),(1,0,8),(1,1,4),(1,2,2),
+                             (2,-2,1),(2,-1,2),(2,0,4),(2,1,2),(2,2,1)]),
+    # Atkinson only spreads 6/8 of the error
+    "Atkinson"        : (8, [(0,1,1),(0,2,1),
+                             (1,-1,1),(1,0,1),(1,1,1),
+                             (2,0,1)]),
+    }
+
+def bayer_matrix(n=8):
+    # n x n ordered dither matrix (n is a power of 2) with values 0 to n*n-1
+    M = [[0]]
+    while len(M) < n:
+        m = len(M)
+        M = [[4*M[i%m][j%m]+[[0,2],[3,1]][i//m][j//m] for j in range(2*m)] for i in range(2*m)]
+    return M
+
+#######################################################################
+# Apply a darkness map (a list of 256 output values) to an image
+#######################################################################
+def tone_map(image, val_map):
+    return image.convert('L').point(val_map)
+
+#######################################################################
+# Convert an image to a halftone ('1' mode) image with one of the
+# DITHER_METHODS.  Floyd-Steinberg uses PIL (the same as
+# image.convert('1')), the others use numpy when it is available.
+#######################################################################
+def dither(image, method="Floyd-Steinberg", update_gui=None, stop_calc=None):
+    if stop_calc == None:
+        stop_calc=[0]
+    if update_gui == None:
+        update_gui = lambda msg=None: None
+    image = image.convert('L')
+    if method == "Floyd-Steinberg" or method not in DITHER_METHODS:
+        return image.convert('1')
+    if NUMPY:
+        pixels = numpy.asarray(image,dtype=numpy.uint8)
+        if method == "Bayer":
+            white = bayer_numpy(pixels)
+        else:
+            white = error_diffusion_numpy(pixels,ERROR_KERNELS[method],update_gui,stop_calc)
+        return Image.fromarray(white.astype(numpy.uint8)*255).convert('1')
+    if method == "Bayer":
+        return bayer_python(image)
+    return error_diffusion_python(image,ERROR_KERNELS[method],update_gui,stop_calc)
+
+def progress(update_gui,stop_calc,fraction,timestamp):
+    stamp=int(3*time()) #update every 1/3 of a second
+    if (stamp != timestamp):
+        timestamp=stamp #interlock
+        update_gui("Creating Halftone Image: %.1f%%" %(100.0*fraction))
+        if stop_calc[0]==True:
+            raise Exception("Action Stopped by User.")
+    return timestamp
+
+def bayer_numpy(pixels, y0=0):
+    # y0 is the image row of the first row of pixels
+    M = numpy.array(bayer_matrix(8),dtype=numpy.float32)
+    threshold = (M+0.5)*(256.0/64)
+    H,W = pixels.shape
+    T = numpy.tile(numpy.roll(threshold,-(y0%8),axis=0),((H+7)//8,(W+7)//8))[:H,:W]
+    return pixels > T
+
+def bayer_python(image):
+    M = bayer_matrix(8)
+    W,H = image.size
+    pixel = image.load()
+    out = Image.new('1',(W,H),0)
+    out_pixel = out.load()
+    for y in range(H):
+        row = M[y%8]
+        for x in range(W):
+            if pixel[x,y] > (row[x%8]+0.5)*4.0:
+                out_pixel[x,y] = 255
+    return out
+
+#######################################################################
+# Error diffusion with numpy.  A pixel can be set when the pixels that
+# pass error to it are done, so pixel (x,y) is set at step x+k*y (k is
+# large enough that all of the kernel is ahead of the step) and all of
+# the pixels of one step are set together.  band() takes the image in
+# bands of rows (the error for the next band is carried over) so only
+# one band needs to be in memory.
+#######################################################################
+class ERROR_DIFFUSION:
+    def __init__(self, kernel, width):
+        div,taps = kernel
+        self.width = width
+        self.k = 1
+        for dy,dx,w in taps:
+            if dy > 0:
+                self.k = max(self.k,int(floor(-float(dx)/dy))+1)
+        self.pad    = 2
+        self.stride = width+2*self.pad
+        self.offsets = [dy*self.stride+dx for dy,dx,w in taps]
+        self.weights = [numpy.float32(float(w)/div) for dy,dx,w in taps]
+        self.carry = numpy.zeros((2,self.stride),dtype=numpy.float32)
+
+    def band(self, pixels, progress=None):
+        # pixels are the next rows of the image (uint8), returns the white
+        # pixels (bool).  progress(fraction) is called every 1000 steps.
+        b,W = pixels.shape
+        k,pad,stride = self.k,self.pad,self.stride
+        white = numpy.empty((b,W),dtype=bool)
+        A = numpy.zeros((b+2,stride),dtype=numpy.float32)
+        A[:b,pad:pad+W] = pixels
+        A[:2] += self.carry
+        flat = A.ravel()
+        out  = white.ravel()
+        ys_all  = numpy.arange(b)
+        idx_all = ys_all*(stride-k)+pad   # index of pixel (t-k*y,y) minus t
+        out_all = ys_all*(W-k)            # output index minus t
+        n_steps = W+k*(b-1)
+        for t in range(n_steps):
+            if progress != None and t % 1000 == 0:
+                progress(float(t)/n_steps)
+            ylo = max(0,(t-W+k)//k)
+            yhi = min(b-1,t//k)
+            idx = idx_all[ylo:yhi+1]+t
+            v = flat[idx]
+            on = v >= 128
+            out[out_all[ylo:yhi+1]+t] = on
+            err = v-255*on
+            for off,w in zip(self.offsets,self.weights):
+                flat[idx+off] += err*w
+        self.carry = A[b:b+2].copy()
+        return white
+
+def error_diffusion_numpy(pixels, kernel, update_gui, stop_calc, band_rows=1024):
+    H,W = pixels.shape
+    diffusion = ERROR_DIFFUSION(kernel,W)
+    white = numpy.empty((H,W),dtype=bool)
+    timestamp = [0]
+    for y0 in range(0,H,band_rows):
+        b = min(band_rows,H-y0)
+        def band_progress(fraction):
+            timestamp[0] = progress(update_gui,stop_calc,(y0+b*fraction)/H,timestamp[0])
+        white[y0:y0+b] = diffusion.band(pixels[y0:y0+b],band_progress)
+    return white
+
+def error_diffusion_python(image, kernel, update_gui, stop_calc):
+    div,taps = kernel
+    W,H = image.size
+    pixel = image.load()
+    # errors of the next rows
+    rows = [[0.0]*(W+4) for i in range(3)]
+    out = Image.new('1',(W,H),0)
+    out_pixel = out.load()
+    taps = [(dy,dx,float(w)/div) for dy,dx,w in taps]
+    timestamp = 0
+    for y in range(H):
+        timestamp = progress(update_gui,stop_calc,float(y)/H,timestamp)
+        for x in range(W):
+            v = pixel[x,y]+rows[0][x+2]
+            if v >= 128:
+                out_pixel[x,y] = 255
+                err = v-255
+            else:
+                err = v
+            for dy,dx,w in taps:
+                rows[dy][x+2+dx] += err*w
+        rows = rows[1:]+[[0.0]*(W+4)]
+    return out
+
+
+if __name__ == "__main__":
+    # Time of the darkness map and of each dither method for a photo sized
+    # image compared with the pixel by pixel versions
+    W,H = 2000,1500
+    if NUMPY:
+        yy,xx = numpy.mgrid[0:H,0:W]
+        photo = (127.5+127.5*numpy.sin(xx/97.0)*numpy.cos(yy/61.0)).astype(numpy.uint8)
+        image = Image.fromarray(photo)
+    else:
+        image = Image.new('L',(W,H))
+        image.putdata([int(127.5+127.5*sin(x/97.0)*cos(y/61.0)) for y in range(H) for x in range(W)])
+    val_map = [int(round(255*(v/255.0)**1.5)) for v in range(256)]
+
+    # The old loop of convert_halftoning() started at 1 and left the first
+    # row and column unmapped.  tone_map() maps them too (an intended
+    # change), so the rest of the image is compared with the old loop and
+    # the first row and column with val_map.
+    t0 = time()
+    old = image.copy()
+    pixel = old.load()
+    for y in range(1,H):
+        for x in range(1,W):
+            pixel[x,y] = val_map[pixel[x,y]]
+    t_old = time()-t0
+    t0 = time()
+    new = tone_map(image,val_map)
+    t_new = time()-t0
+    same  = old.crop((1,1,W,H)).tobytes() == new.crop((1,1,W,H)).tobytes()
+    first = bytearray(new.crop((0,0,W,1)).tobytes()+new.crop((0,0,1,H)).tobytes())
+    edges = bytearray(image.crop((0,0,W,1)).tobytes()+image.crop((0,0,1,H)).tobytes())
+    print("darkness map   pixel loop %7.3f s   tone_map %7.3f s   same = %s" \
+          %(t_old,t_new,same))
+    print("first row and column mapped by tone_map = %s" \
+          %(list(first) == [val_map[v] for v in edges]))
+
+    small = new.crop((0,0,200,150))
+    for method in DITHER_METHODS:
+        t0 = time()
+        result = dither(new,method)
+        line = "%-16s %dx%d %7.3f s" %(method,W,H,time()-t0)
+        if NUMPY and method != "Floyd-Steinberg":
+            # same result as the pixel by pixel version
+            if method == "Bayer":
+                check = bayer_python(small)
+            else:
+                check = error_diffusion_python(small,ERROR_KERNELS[method],lambda msg=None: None,[0])
+            line = line+"   same as pixel loop = %s" %(dither(small,method).tobytes() == check.tobytes())
+        print(line)
+    print("DONE")
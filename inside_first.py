@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+"""
+    This script finds which loops are inside other loops so the inside
+    loops can be cut first
+
+    Copyright (C) <2017-2023>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from math import *
+
+NUMPY=True
+try:
+    import numpy
+except:
+    NUMPY = False
+
+##############################################################################
+# InsideFirst builds the loop tree used by optimize_paths().  loop_tree[i]  #
+# is the list of loops that have their first point inside loop i.  The     #
+# first points are put in a uniform grid so each loop only tests the       #
+# points inside its bounding box, and the tests are done with numpy when   #
+# it is available.  The tree is walked with explicit stacks (no recursion). #
+##############################################################################
+class InsideFirst:
+    def __init__(self, use_numpy=True):
+        self.use_numpy = use_numpy and NUMPY
+
+    #####################################################
+    # determine if a point is inside a given polygon or not
+    # Polygon is a list of (x,y) pairs.
+    # http://www.ariel.com.au/a/python-point-int-poly.html
+    #####################################################
+    def point_inside_polygon(self,x,y,poly):
+        n = len(poly)
+        inside = -1
+        p1x = poly[0][0]
+        p1y = poly[0][1]
+        for i in range(n+1):
+            p2x = poly[i%n][0]
+            p2y = poly[i%n][1]
+            if y > min(p1y,p2y):
+                if y <= max(p1y,p2y):
+                    if x <= max(p1x,p2x):
+                        if p1y != p2y:
+                            xinters = (y-p1y)*(p2x-p1x)/(p2y-p1y)+p1x
+                        if p1x == p2x or x <= xinters:
+                            inside = inside * -1
+            p1x,p1y = p2x,p2y
+
+        return inside
+
+    def points_inside_polygon(self,X,Y,poly):
+        # Same test as point_inside_polygon() for arrays of points.
+        # Returns a boolean array.
+        P = numpy.array(poly,dtype=numpy.float64)[:,0:2]
+        p1x = P[:,0]
+        p1y = P[:,1]
+        p2x = numpy.roll(p1x,-1)
+        p2y = numpy.roll(p1y,-1)
+        ymin = numpy.minimum(p1y,p2y)
+        ymax = numpy.maximum(p1y,p2y)
+        xmax = numpy.maximum(p1x,p2x)
+        vertical = p1x == p2x
+        count = numpy.zeros(len(X),dtype=numpy.int64)
+        # limit the size of the (points x edges) arrays
+        step = max(1,200000//max(len(X),1))
+        with numpy.errstate(divide='ignore',invalid='ignore'):
+            for k in range(0,len(P),step):
+                e = slice(k,k+step)
+                x = X[:,None]
+                y = Y[:,None]
+                xinters = (y-p1y[e])*(p2x[e]-p1x[e])/(p2y[e]-p1y[e])+p1x[e]
+                cross = (y > ymin[e]) & (y <= ymax[e]) & (x <= xmax[e]) & \
+                        (vertical[e] | (x <= xinters))
+                count += cross.sum(axis=1)
+        return (count % 2) == 1
+
+    #######################################################################
+    # For each loop determine which other loops are inside
+    #######################################################################
+    def loop_tree(self,cuts):
+        Nloops = len(cuts)
+        loop_tree = [[] for i in range(Nloops)]
+        if Nloops < 2:
+            return loop_tree
+        # Grid of the first point of each loop
+        px = [cut[0][0] for cut in cuts]
+        py = [cut[0][1] for cut in cuts]
+        xmin = min(px)
+        ymin = min(py)
+        w = max(px)-xmin
+        h = max(py)-ymin
+        if w > 0 and h > 0:
+            cs = sqrt(w*h/Nloops)
+        else:
+            cs = max(w,h)/Nloops
+        if cs <= 0:
+            cs = 1.0
+        nx = int(w/cs)+1
+        ny = int(h/cs)+1
+        grid = {}
+        for j in range(Nloops):
+            key = (int((px[j]-xmin)/cs),int((py[j]-ymin)/cs))
+            grid.setdefault(key,[]).append(j)
+
+        if self.use_numpy:
+            PX = numpy.array(px,dtype=numpy.float64)
+            PY = numpy.array(py,dtype=numpy.float64)
+
+        for iloop in range(Nloops):
+            ipoly = cuts[iloop]
+            if ipoly == []:
+                continue
+            bx = [p[0] for p in ipoly]
+            by = [p[1] for p in ipoly]
+            bxmin,bxmax = min(bx),max(bx)
+            bymin,bymax = min(by),max(by)
+            # Points outside of the bounding box can not be inside
+            i0 = max(int(floor((bxmin-xmin)/cs)),0)
+            i1 = min(int(floor((bxmax-xmin)/cs)),nx-1)
+            j0 = max(int(floor((bymin-ymin)/cs)),0)
+            j1 = min(int(floor((bymax-ymin)/cs)),ny-1)
+            candidates = []
+            if (i1-i0+1)*(j1-j0+1) > len(grid):
+                for key in grid:
+                    if i0 <= key[0] <= i1 and j0 <= key[1] <= j1:
+                        candidates.extend(grid[key])
+            else:
+                for i in range(i0,i1+1):
+                    for j in range(j0,j1+1):
+                        candidates.extend(grid.get((i,j),()))
+            candidates = [j for j in candidates if j != iloop and \
+                          bxmin <= px[j] <= bxmax and bymin < py[j] <= bymax]
+            if candidates == []:
+                continue
+            candidates.sort()
+            if self.use_numpy and len(candidates)*len(ipoly) > 64:
+                C = numpy.array(candidates)
+                inside = self.points_inside_polygon(PX[C],PY[C],ipoly)
+                loop_tree[iloop] = C[inside].tolist()
+            else:
+                for jloop in candidates:
+                    if self.point_inside_polygon(px[jloop],py[jloop],ipoly) > 0:
+                        loop_tree[iloop].append(jloop)
+        return loop_tree
+
+    #######################################################################
+    # Remove references that would make a loop inside itself (same result
+    # as the recursive version that used to be in optimize_paths)
+    #######################################################################
+    def remove_self_references(self,loop_tree):
+        for i in range(len(loop_tree)):
+            loop_numbers = set([i])
+            stack = [[loop_tree[i],0]]
+            while stack != []:
+                frame = stack[-1]
+                loops,k = frame
+                if k >= len(loops):
+                    stack.pop()
+                    continue
+                loop = loops[k]
+                if loop in loop_numbers:
+                    loops.pop(k)
+                    stack.pop()
+                    continue
+                frame[1] = k+1
+                if loop_tree[loop] != []:
+                    loop_numbers.add(loop)
+                    stack.append([loop_tree[loop],0])
+
+    #######################################################################
+    # Returns the loops in order with the inside loops before the loops
+    # they are inside of.  The loop tree is emptied.
+    #######################################################################
+    def order(self,loop_tree):
+        Nloops = len(loop_tree)
+        done  = [False]*Nloops
+        order = []
+        for i in range(Nloops):
+            stack = [[i,0]]
+            children = {i:loop_tree[i]}
+            loop_tree[i] = []
+            while stack != []:
+                frame = stack[-1]
+                loop,k = frame
+                inner = children[loop]
+                if k < len(inner):
+                    frame[1] = k+1
+                    c = inner[k]
+                    if loop_tree[c] != []:
+                        children[c] = loop_tree[c]
+                        loop_tree[c] = []
+                        stack.append([c,0])
+                    elif not done[c]:
+                        order.append(c)
+                        done[c] = True
+                else:
+                    stack.pop()
+                    if not done[loop]:
+                        order.append(loop)
+                        done[loop] = True
+        return order
+
+
+if __name__ == "__main__":
+    # Compare the loop tree of a lattice of nested squares with the
+    # pairwise point in polygon test
+    from time import time
+
+    def lattice(n):
+        cuts = []
+        for i in range(n):
+            for j in range(n):
+                x = i*1.0
+                y = j*1.0
+                for s in (0.1,0.2,0.3,0.4):
+                    cuts.append([[x+0.5-s,y+0.5-s],[x+0.5+s,y+0.5-s],[x+0.5+s,y+0.5+s],
+                                 [x+0.5-s,y+0.5+s],[x+0.5-s,y+0.5-s]])
+        # frame around everything
+        cuts.append([[-1,-1],[n+1,-1],[n+1,n+1],[-1,n+1],[-1,-1]])
+        return cuts
+
+    def pairwise(inside_first,cuts):
+        Nloops = len(cuts)
+        loop_tree = []
+        for iloop in range(Nloops):
+            loop_tree.append([])
+            for jloop in range(Nloops):
+                if jloop != iloop:
+                    if inside_first.point_inside_polygon(cuts[jloop][0][0],cuts[jloop][0][1],cuts[iloop]) > 0:
+                        loop_tree[iloop].append(jloop)
+        return loop_tree
+
+    for n in (5,10,20,50):
+        cuts = lattice(n)
+        results = []
+        line = "%6d loops" %(len(cuts))
+        for use_numpy in (False,True):
+            if use_numpy and not NUMPY:
+                continue
+            inside_first = InsideFirst(use_numpy=use_numpy)
+            t0 = time()
+            tree = inside_first.loop_tree(cuts)
+            inside_first.remove_self_references(tree)
+            order = inside_first.order(tree)
+            line = line + "   numpy=%-5s %7.3f s" %(use_numpy,time()-t0)
+            results.append(order)
+        if len(cuts) < 2000:
+            t0 = time()
+            pairwise(InsideFirst(),cuts)
+            line = line + "   pairwise %7.3f s" %(time()-t0)
+        print(line)
+
+    # Deeply nested loops (too deep for the old recursive version)
+    for n in (500,2000):
+        cuts = [[[-s,-s],[s,-s],[s,s],[-s,s]] for s in range(n,0,-1)]
+        inside_first = InsideFirst()
+        t0 = time()
+        tree = inside_first.loop_tree(cuts)
+        inside_first.remove_self_references(tree)
+        order = inside_first.order(tree)
+        print("%6d nested loops %7.3f s  inside first = %s" %(n,time()-t0,order == list(range(n-1,-1,-1))))
+    print("DONE")
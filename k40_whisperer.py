@@ -23,6 +23,11 @@ title_text = "K40 Whisperer V"+version
 import sys
 from math import *
 from egv import egv
+from egv_stream import EGV_STREAM
+from egv_cache import EGV_CACHE
+from egv_file import open_egv_file, write_egv_file, EGV_BUFFER_SIZE, EGV_SEND_BLOCK
+from egv_decoder import EGV_TIME
+from time_calibration import TIME_CALIBRATION
 from nano_library import K40_CLASS
 from dxf import DXF_CLASS
 from svg_reader import SVG_READER
@@ -30,8 +35,17 @@ from svg_reader import SVG_TEXT_EXCEPTION
 from svg_reader import SVG_PXPI_EXCEPTION
 from g_code_library import G_Code_Rip
 from interpolate import interpolate
+from halftone import tone_map, dither, DITHER_METHODS
 from ecoords import ECoord
 from convex_hull import hull2D
+from raster_scan import RasterScan
+from raster_pipeline import RASTER_PIPELINE, FULL_SIZE_STEPS
+from raster_tiles import bilevel_tiles, preview_tiles, TILED_RASTER
+import raster_tiles
+from process_pool import default_workers
+from path_order import PathOrder
+from inside_first import InsideFirst
+from preview_layers import PreviewLayer
 from embedded_images import K40_Whisperer_Images
 
 import inkex
@@ -131,10 +145,10 @@ class Application(Frame):
         
 
     def resetPath(self):
-        self.RengData  = ECoord()
+        self.RengData  = ECoord(compact=True)
         self.VengData  = ECoord()
         self.VcutData  = ECoord()
-        self.GcodeData = ECoord()
+        self.GcodeData = ECoord(compact=True)
         self.SCALE = 1
         self.Design_bounds = (0,0,0,0)
         self.UI_image = None
@@ -248,10 +262,12 @@ class Application(Frame):
         self.inside_first = BooleanVar()
         self.rotary       = BooleanVar()
         self.reduced_mem  = BooleanVar()
+        self.tiled_raster = BooleanVar()
         self.wait         = BooleanVar()
         
 
         self.ht_size    = StringVar()
+        self.dither_method = StringVar()
         self.Reng_feed  = StringVar()
         self.Veng_feed  = StringVar()
         self.Vcut_feed  = StringVar()
@@ -299,6 +315,7 @@ class Application(Frame):
         self.inkscape_path = StringVar()
         self.batch_path    = StringVar()
         self.ink_timeout   = StringVar()
+        self.tour_time     = StringVar()
         
         self.t_timeout  = StringVar()
         self.n_timeouts  = StringVar()
@@ -345,9 +362,11 @@ class Application(Frame):
         self.inside_first.set(1)
         self.rotary.set(0)
         self.reduced_mem.set(0)
+        self.tiled_raster.set(0)
         self.wait.set(1)
         
         self.ht_size.set(500)
+        self.dither_method.set("Floyd-Steinberg")
 
         self.Reng_feed.set("100")
         self.Veng_feed.set("20")
@@ -383,6 +402,7 @@ class Application(Frame):
         self.units.set("mm")            # Options are "in" and "mm"
 
         self.ink_timeout.set("3")
+        self.tour_time.set("0")
         self.t_timeout.set("200")
         self.n_timeouts.set("30")
 
@@ -391,6 +411,13 @@ class Application(Frame):
         if not os.path.isdir(self.HOME_DIR):
             self.HOME_DIR = ""
 
+        self.egv_cache = EGV_CACHE(os.path.join(self.HOME_DIR,".k40_whisperer_cache"),version=version)
+        self.egv_cache_hits   = 0
+        self.egv_cache_misses = 0
+        self.egv_times = None # (settings,times) from calc_egv_times()
+        self.time_calibration = TIME_CALIBRATION(os.path.join(self.HOME_DIR,".k40_whisperer_times"))
+        self.raster_pipeline  = RASTER_PIPELINE()
+
         self.DESIGN_FILE = (self.HOME_DIR+"/None")
         self.EGV_FILE    = None
         
@@ -434,10 +461,10 @@ class Application(Frame):
         self.move_start_y = 0
 
         
-        self.RengData  = ECoord()
+        self.RengData  = ECoord(compact=True)
         self.VengData  = ECoord()
         self.VcutData  = ECoord()
-        self.GcodeData = ECoord()
+        self.GcodeData = ECoord(compact=True)
         self.SCALE = 1
         self.Design_bounds = (0,0,0,0)
         self.UI_image = None
@@ -481,6 +508,11 @@ class Application(Frame):
         self.PreviewCanvas = Canvas(lbframe, width=self.w-(220+20), height=self.h-200, background="grey75")
         self.PreviewCanvas.pack(side=LEFT, fill=BOTH, expand=1)
         self.PreviewCanvas_frame.place(x=230, y=10)
+        # Cached preview layers (in the order they are drawn)
+        self.RengLayer  = PreviewLayer(self.PreviewCanvas, 'RengLayer' , "black", tags=('LaserTag',))
+        self.VengLayer  = PreviewLayer(self.PreviewCanvas, 'VengLayer' , "blue" , tags=('LaserTag',))
+        self.VcutLayer  = PreviewLayer(self.PreviewCanvas, 'VcutLayer' , "red"  , tags=('LaserTag',))
+        self.GcodeLayer = PreviewLayer(self.PreviewCanvas, 'GcodeLayer', "white", tags=('LaserTag',))
 
         self.PreviewCanvas.tag_bind('LaserTag',"<1>"              , self.mousePanStart)
         self.PreviewCanvas.tag_bind('LaserTag',"<B1-Motion>"      , self.mousePan)
@@ -935,6 +967,7 @@ class Application(Frame):
         header.append('(k40_whisperer_set zoom2image    %s )'  %( int(self.zoom2image.get())    ))
         header.append('(k40_whisperer_set rotary        %s )'  %( int(self.rotary.get())        ))
         header.append('(k40_whisperer_set reduced_mem   %s )'  %( int(self.reduced_mem.get())   ))
+        header.append('(k40_whisperer_set tiled_raster  %s )'  %( int(self.tiled_raster.get())  ))
         header.append('(k40_whisperer_set wait          %s )'  %( int(self.wait.get())          ))
 
         header.append('(k40_whisperer_set trace_w_laser %s )'  %( int(self.trace_w_laser.get()) ))
@@ -954,6 +987,7 @@ class Application(Frame):
 
         header.append('(k40_whisperer_set rast_step     %s )'  %( self.rast_step.get()      ))
         header.append('(k40_whisperer_set ht_size       %s )'  %( self.ht_size.get()        ))
+        header.append('(k40_whisperer_set dither_method %s )'  %( self.dither_method.get()  ))
         
         header.append('(k40_whisperer_set LaserXsize    %s )'  %( self.LaserXsize.get()     ))
         header.append('(k40_whisperer_set LaserYsize    %s )'  %( self.LaserYsize.get()     ))
@@ -981,6 +1015,7 @@ class Application(Frame):
         header.append('(k40_whisperer_set n_timeouts    %s )'  %( self.n_timeouts.get()     ))
 
         header.append('(k40_whisperer_set ink_timeout   %s )'  %( self.ink_timeout.get()    ))
+        header.append('(k40_whisperer_set tour_time     %s )'  %( self.tour_time.get()      ))
 
         
         header.append('(k40_whisperer_set designfile    \042%s\042 )' %( self.DESIGN_FILE   ))
@@ -1011,6 +1046,8 @@ class Application(Frame):
         dy = event.y-self.pany
 
         self.PreviewCanvas.move('LaserTag', dx, dy)
+        for layer in (self.RengLayer,self.VengLayer,self.VcutLayer,self.GcodeLayer):
+            layer.moved(dx, dy)
         self.lastx = self.lastx + dx
         self.lasty = self.lasty + dy
         self.panx = event.x
@@ -1206,6 +1243,15 @@ class Application(Frame):
             
         Gcode_time =  self.GcodeData.gcode_time * Gcode_passes
 
+        # Use the times estimated from the EGV data if the design and
+        # settings did not change since they were calculated
+        if self.egv_times != None and self.egv_times[0] == self.egv_time_settings():
+            egv_times  = self.egv_times[1]
+            Reng_time  = egv_times.get("Raster_Eng",Reng_time)
+            Veng_time  = egv_times.get("Vector_Eng",Veng_time)
+            Vcut_time  = egv_times.get("Vector_Cut",Vcut_time)
+            Gcode_time = egv_times.get("Gcode_Cut",Gcode_time)
+
         self.Reng_time.set("Raster Engrave: %s" %(self.format_time(Reng_time)))  
         self.Veng_time.set("Vector Engrave: %s" %(self.format_time(Veng_time)))
         self.Vcut_time.set("    Vector Cut: %s" %(self.format_time(Vcut_time)))
@@ -1444,6 +1490,22 @@ class Application(Frame):
         return 0         # Value is a valid number
     def Entry_Ink_Timeout_Callback(self, varName, index, mode):
         self.entry_set(self.Entry_Ink_Timeout,self.Entry_Ink_Timeout_Check(), new=1)
+
+    #############################
+    def Entry_Tour_Time_Check(self):
+        try:
+            value = float(self.tour_time.get())
+            if  value < 0.0:
+                self.statusMessage.set(" Optimization time should be 0 or greater")
+                return 2 # Value is invalid number
+        except:
+            return 3     # Value not a number
+        return 0         # Value is a valid number
+    def Entry_Tour_Time_Callback(self, varName, index, mode):
+        self.entry_set(self.Entry_Tour_Time,self.Entry_Tour_Time_Check(), new=1)
+        # the vector paths are ordered again with the new time
+        self.VcutData.sorted = False
+        self.VengData.sorted = False
         
      
     #############################
@@ -1877,57 +1939,11 @@ class Application(Frame):
         
     def Open_EGV(self,filemname,n_passes=1):
         self.stop[0]=False
-        EGV_data=[]
-        value1 = ""
-        value2 = ""
-        value3 = ""
-        value4 = ""
-        data=""
-        #value1 and value2 are the absolute y and x starting positions
-        #value3 and value4 are the absolute y and x end positions
-        with open(filemname) as f:
-            while True:
-                ## Skip header
-                c = f.read(1)
-                while c!="%" and c:
-                    c = f.read(1)
-                ## Read 1st Value
-                c = f.read(1)
-                while c!="%" and c:
-                    value1 = value1 + c
-                    c = f.read(1)
-                y_start_mils = int(value1) 
-                ## Read 2nd Value
-                c = f.read(1)
-                while c!="%" and c:
-                    value2 = value2 + c
-                    c = f.read(1)
-                x_start_mils = int(value2)   
-                ## Read 3rd Value
-                c = f.read(1)
-                while c!="%" and c:
-                    value3 = value3 + c
-                    c = f.read(1)
-                y_end_mils = int(value3)
-                ## Read 4th Value
-                c = f.read(1)
-                while c!="%" and c:
-                    value4 = value4 + c
-                    c = f.read(1)
-                x_end_mils = int(value4)
-                break
-
-            ## Read Data
-            while True:
-                c = f.read(1)
-                if not c:
-                    break
-                if c=='\n' or c==' ' or c=='\r':
-                    pass
-                else:
-                    data=data+"%c" %c
-                    EGV_data.append(ord(c))
-                    
+        #y_start_mils and x_start_mils are the absolute y and x starting positions
+        #y_end_mils and x_end_mils are the absolute y and x end positions
+        #EGV_data is a memoryview of the file if it has no white space
+        EGV_data,y_start_mils,x_start_mils,y_end_mils,x_end_mils = open_egv_file(filemname)
+
         if ( (x_end_mils != 0) or (y_end_mils != 0) ):
             n_passes=1
         else:
@@ -1935,7 +1951,7 @@ class Application(Frame):
             y_start_mils = 0
 
         try:
-            self.send_egv_data(EGV_data,n_passes)
+            self.send_egv_data(EGV_data,n_passes,max_block=EGV_SEND_BLOCK)
         except MemoryError as e:
             msg1 = "Memory Error:"
             msg2 = "Memory Error:  Out of Memory."
@@ -1965,8 +1981,10 @@ class Application(Frame):
         self.SVG_FILE = filemname
         if self.reduced_mem.get():
             self.input_dpi = 500.0
+            self.raster_pipeline.max_entries = 1
         else:
             self.input_dpi = 1000.0
+            self.raster_pipeline.max_entries = 2
         svg_reader =  SVG_READER()
         svg_reader.image_dpi = self.input_dpi
         svg_reader.set_inkscape_path(self.inkscape_path.get())
@@ -2068,8 +2086,6 @@ class Application(Frame):
             hcoords=[]
             if (self.RengData.image != None and self.RengData.ecoords==[]):
                 ecoords=[]
-                cutoff=128
-                image_temp = self.RengData.image.convert("L")
 ##                if self.unsharp_flag.get():
 ##                    from PIL import ImageFilter       
 ##                    #image_temp = image_temp.filter(UnsharpMask(radius=self.unsharp_r, percent=self.unsharp_p, threshold=self.unsharp_t))
@@ -2079,123 +2095,81 @@ class Application(Frame):
 ##                    filter.threshold = int(float(self.unsharp_t.get())) # Threshold 0
 ##                    image_temp = image_temp.filter(filter)
 
-                if self.negate.get():
-                    image_temp = ImageOps.invert(image_temp)
-                    
-                if self.mirror.get():
-                    image_temp = ImageOps.mirror(image_temp)
-
-                if self.rotate.get():
-                    #image_temp = image_temp.rotate(90,expand=True)
-                    image_temp = self.rotate_raster(image_temp)
-
                 Xscale = float(self.LaserXscale.get())
                 Yscale = float(self.LaserYscale.get())    
                 if self.rotary.get():
                     Rscale = float(self.LaserRscale.get())
                     Yscale = Yscale*Rscale
 
-                if Xscale != 1.0 or Yscale != 1.0:
-                    wim,him = image_temp.size
-                    nw = int(wim*Xscale)
-                    nh = int(him*Yscale)
-                    image_temp = image_temp.resize((nw,nh))
-
-                    
+                halftone = None
+                halftone_key = None
                 if self.halftone.get():
                     ht_size_mils =  round( self.input_dpi / float(self.ht_size.get()) ,1)
                     npixels = int( round(ht_size_mils,1) )
                     if npixels == 0:
                         return
-                    wim,him = image_temp.size
-                    # Convert to Halftoning and save
-                    nw=int(wim / npixels)
-                    nh=int(him / npixels)
-                    image_temp = image_temp.resize((nw,nh))
-                    
-                    image_temp = self.convert_halftoning(image_temp)
-                    image_temp = image_temp.resize((wim,him))
+                    def halftone(image_temp):
+                        wim,him = image_temp.size
+                        # Convert to Halftoning and save
+                        nw=int(wim / npixels)
+                        nh=int(him / npixels)
+                        image_temp = image_temp.resize((nw,nh))
+                        image_temp = self.convert_halftoning(image_temp)
+                        return image_temp.resize((wim,him))
+                    halftone_key = (npixels, self.bezier_M1.get(), self.bezier_M2.get(),
+                                    self.bezier_weight.get(), self.dither_method.get())
+
+                # negate, mirror, rotate, scale and halftone (the steps that
+                # were done before with the same settings are not done again)
+                if self.tiled_raster.get() and raster_tiles.NUMPY:
+                    # a band at a time into a memory mapped file
+                    if halftone != None:
+                        val_map = self.halftone_val_map()
+                        if val_map == None:
+                            val_map = list(range(256))
+                        halftone = (npixels, val_map, self.dither_method.get())
+                    def make_tiles():
+                        return bilevel_tiles(self.RengData.image,
+                                             self.negate.get(),
+                                             self.mirror.get(),
+                                             self.rotate.get(),
+                                             Xscale, Yscale, halftone,
+                                             update_gui=self.update_gui,
+                                             stop_calc=self.stop)
+                    key = (self.negate.get(), self.mirror.get(), self.rotate.get(),
+                           Xscale, Yscale, halftone_key)
+                    # no full size images are kept in tiled mode
+                    self.raster_pipeline.drop(FULL_SIZE_STEPS)
+                    image_temp = self.raster_pipeline.cached("tiles", self.RengData.image, key, make_tiles)
                 else:
-                    image_temp = image_temp.point(lambda x: 0 if x<128 else 255, '1')
+                    image_temp = self.raster_pipeline.bilevel(self.RengData.image,
+                                                              self.negate.get(),
+                                                              self.mirror.get(),
+                                                              self.rotate.get(),
+                                                              Xscale, Yscale,
+                                                              halftone, halftone_key)
                     
-                if DEBUG:
+                if DEBUG and not isinstance(image_temp,TILED_RASTER):
                     image_name = os.path.expanduser("~")+"/IMAGE.png"
                     image_temp.save(image_name,"PNG")
 
-                Reng_np = image_temp.load()
-                wim,him = image_temp.size
-                del image_temp
-                #######################################
-                x=0
-                y=0
-                loop=1
-                LENGTH=0
-                n_scanlines = 0 
-                
-                my_hull = hull2D()
-                bignumber = 9999999;
                 Raster_step = int(self.get_raster_step_1000in())
-                timestamp=0
-                im_height_mils = int(him/self.input_dpi*1000.0)
-                for i_step in range(0,im_height_mils,Raster_step):
-                    i=floor(i_step*self.input_dpi/1000.0)
-                    #print(i_step,i)
-                    stamp=int(3*time()) #update every 1/3 of a second
-                    if (stamp != timestamp):
-                        timestamp=stamp #interlock
-                        self.statusMessage.set("Creating Scan Lines: %.1f %%" %( (100.0*i)/him ) )
-                        self.master.update()
-                    if self.stop[0]==True:
-                        raise Exception("Action stopped by User.")
-                    line = []
-                    cnt=1
-                    LEFT  = bignumber;
-                    RIGHT =-bignumber;
-                    for j in range(1,wim):
-                        if (Reng_np[j,i] == Reng_np[j-1,i]):
-                            cnt = cnt+1
-                        else:
-                            if Reng_np[j-1,i]:
-                                laser = "U"
-                            else:
-                                laser = "D"
-                                LEFT  = min(j-cnt,LEFT)
-                                RIGHT = max(j,RIGHT)
-                                
-                            line.append((cnt,laser))
-                            cnt=1
-                    if Reng_np[j-1,i] > cutoff:
-                        laser = "U"
-                    else:
-                        laser = "D"
-                        LEFT  = min(j-cnt,LEFT)
-                        RIGHT = max(j,RIGHT)
-                        
-                    line.append((cnt,laser))
-                    if LEFT != bignumber and RIGHT != -bignumber:
-                        LENGTH = LENGTH + (RIGHT - LEFT)/self.input_dpi
-                        n_scanlines = n_scanlines + 1
-                    
-                    y=(im_height_mils-i_step)/1000.0
-                    x=0
-                    if LEFT != bignumber:
-                        hcoords.append([LEFT/self.input_dpi,y])
-                    if RIGHT != -bignumber:
-                        hcoords.append([RIGHT/self.input_dpi,y])
-                    if hcoords!=[]:
-                        hcoords = my_hull.convexHullecoords(hcoords)
-                        
-                    rng = list(range(0,len(line),1))
-                        
-                    for i in rng:
-                        seg = line[i]
-                        delta = seg[0]/self.input_dpi
-                        if seg[1]=="D":
-                            loop=loop+1
-                            ecoords.append([x      ,y,loop])
-                            ecoords.append([x+delta,y,loop])
-                        x = x + delta
-                self.RengData.set_ecoords(ecoords,data_sorted=True)
+                raster_scan = RasterScan(self.input_dpi,workers=default_workers())
+                if raster_scan.use_numpy:
+                    # the EGV data is made straight from the runs
+                    runs,LENGTH,n_scanlines,hcoords = raster_scan.make_raster_runs(image_temp,
+                                                                                   Raster_step,
+                                                                                   update_gui=self.update_gui,
+                                                                                   stop_calc=self.stop)
+                    del image_temp
+                    self.RengData.set_raster_runs(runs)
+                else:
+                    ecoords,LENGTH,n_scanlines,hcoords = raster_scan.make_raster_coords(image_temp,
+                                                                                        Raster_step,
+                                                                                        update_gui=self.update_gui,
+                                                                                        stop_calc=self.stop)
+                    del image_temp
+                    self.RengData.set_ecoords(ecoords,data_sorted=True)
                 self.RengData.len=LENGTH
                 self.RengData.n_scanlines = n_scanlines
             #Set Flag indicating raster paths have been calculated    
@@ -2220,18 +2194,6 @@ class Application(Frame):
     #######################################################################
 
 
-    def rotate_raster(self,image_in):
-        wim,him = image_in.size
-        im_rotated = Image.new("L", (him, wim), "white")
-
-        image_in_np   = image_in.load()
-        im_rotated_np = im_rotated.load()
-        
-        for i in range(1,him):
-            for j in range(1,wim):
-                im_rotated_np[i,wim-j] = image_in_np[j,i]
-        return im_rotated
-    
     def get_raster_step_1000in(self):
         val_in = float(self.rast_step.get())
         value = int(round(val_in*1000.0,1)) 
@@ -2255,13 +2217,8 @@ class Application(Frame):
             y.append( Ct*( 2*(1-t)*t*w*y1+pow(t,2)*255) )
         return x,y
 
-    '''This Example opens an Image and transform the image into halftone.  -Isai B. Cicourel'''
-    # Create a Half-tone version of the image
-    def convert_halftoning(self,image):
-        image = image.convert('L')
-        x_lim, y_lim = image.size
-        pixel = image.load()
-        
+    def halftone_val_map(self):
+        # Darkness map of the bezier curve (None if there is no curve)
         M1 = float(self.bezier_M1.get())
         M2 = float(self.bezier_M2.get())
         w  = float(self.bezier_weight.get())
@@ -2275,20 +2232,22 @@ class Application(Frame):
             for val in range(0,256):
                 val_out = int(round(interp[val])) # Get the interpolated value at each value
                 val_map.append(val_out)
+            return val_map
+        return None
+
+    '''This Example opens an Image and transform the image into halftone.  -Isai B. Cicourel'''
+    # Create a Half-tone version of the image
+    def convert_halftoning(self,image):
+        image = image.convert('L')
+        
+        val_map = self.halftone_val_map()
+        if val_map != None:
             # Adjust image
-            timestamp=0
-            for y in range(1, y_lim):
-                stamp=int(3*time()) #update every 1/3 of a second
-                if (stamp != timestamp):
-                    timestamp=stamp #interlock
-                    self.statusMessage.set("Adjusting Image Darkness: %.1f %%" %( (100.0*y)/y_lim ) )
-                    self.master.update()
-                for x in range(1, x_lim):
-                    pixel[x, y] = val_map[ pixel[x, y] ]
+            image = tone_map(image, val_map)
 
         self.statusMessage.set("Creating Halftone Image." )
         self.master.update()
-        image = image.convert('1')
+        image = dither(image, self.dither_method.get(), self.update_gui, self.stop)
         return image
 
     #######################################################################
@@ -2510,6 +2469,8 @@ class Application(Frame):
                          self.rotary.set(line[line.find("rotary"):].split()[1])
                     elif "reduced_mem"  in line:
                          self.reduced_mem.set(line[line.find("reduced_mem"):].split()[1])
+                    elif "tiled_raster"  in line:
+                         self.tiled_raster.set(line[line.find("tiled_raster"):].split()[1])
                     elif "wait"  in line:
                          self.wait.set(line[line.find("wait"):].split()[1])
 
@@ -2543,6 +2504,8 @@ class Application(Frame):
                          self.rast_step.set(line[line.find("rast_step"):].split()[1])
                     elif "ht_size"    in line:
                          self.ht_size.set(line[line.find("ht_size"):].split()[1])
+                    elif "dither_method"    in line:
+                         self.dither_method.set(line[line.find("dither_method"):].split()[1])
 
                     elif "LaserXsize"    in line:
                          self.LaserXsize.set(line[line.find("LaserXsize"):].split()[1])
@@ -2591,6 +2554,8 @@ class Application(Frame):
 
                     elif "ink_timeout"    in line:
                          self.ink_timeout.set(line[line.find("ink_timeout"):].split()[1])
+                    elif "tour_time"    in line:
+                         self.tour_time.set(line[line.find("tour_time"):].split()[1])
 
                     elif "designfile"    in line:
                            self.DESIGN_FILE=(line[line.find("designfile"):].split("\042")[1])
@@ -2879,8 +2844,8 @@ class Application(Frame):
         if int(dxmils)==0 and int(dymils)==0:
             return
         self.stop[0]=False
-        Rapid_data=[]
-        Rapid_inst = egv(target=lambda s:Rapid_data.append(s))
+        Rapid_data=bytearray()
+        Rapid_inst = egv(target=Rapid_data)
         Rapid_feed = float(self.rapid_feed.get())*self.feed_factor()
         Rapid_inst.make_egv_rapid(dxmils,dymils,Feed=Rapid_feed,board_name=self.board_name.get())
         self.send_egv_data(Rapid_data, 1, None)
@@ -3124,101 +3089,8 @@ class Application(Frame):
             
     ################################################################################
     def Sort_Paths(self,ecoords,i_loop=2):
-        ##########################
-        ###   find loop ends   ###
-        ##########################
-        Lbeg=[]
-        Lend=[]
-        if len(ecoords)>0:
-            Lbeg.append(0)
-            loop_old=ecoords[0][i_loop]
-            for i in range(1,len(ecoords)):
-                loop = ecoords[i][i_loop]
-                if loop != loop_old:
-                    Lbeg.append(i)
-                    Lend.append(i-1)
-                loop_old=loop
-            Lend.append(i)
-
-        #######################################################
-        # Find new order based on distance to next beg or end #
-        #######################################################
-        order_out = []
-        use_beg=0
-        if len(ecoords)>0:
-            order_out.append([Lbeg[0],Lend[0]])
-        inext = 0
-        total=len(Lbeg)
-        for i in range(total-1):
-            if use_beg==1:
-                ii=Lbeg.pop(inext)
-                Lend.pop(inext)
-            else:
-                ii=Lend.pop(inext)
-                Lbeg.pop(inext)
-
-            Xcur = ecoords[ii][0]
-            Ycur = ecoords[ii][1]
-
-            dx = Xcur - ecoords[ Lbeg[0] ][0]
-            dy = Ycur - ecoords[ Lbeg[0] ][1]
-            min_dist = dx*dx + dy*dy
-
-            dxe = Xcur - ecoords[ Lend[0] ][0]
-            dye = Ycur - ecoords[ Lend[0] ][1]
-            min_diste = dxe*dxe + dye*dye
-
-            inext=0
-            inexte=0
-            for j in range(1,len(Lbeg)):
-                dx = Xcur - ecoords[ Lbeg[j] ][0]
-                dy = Ycur - ecoords[ Lbeg[j] ][1]
-                dist = dx*dx + dy*dy
-                if dist < min_dist:
-                    min_dist=dist
-                    inext=j
-                ###
-                dxe = Xcur - ecoords[ Lend[j] ][0]
-                dye = Ycur - ecoords[ Lend[j] ][1]
-                diste = dxe*dxe + dye*dye
-                if diste < min_diste:
-                    min_diste=diste
-                    inexte=j
-                ###
-            if min_diste < min_dist:
-                inext=inexte
-                order_out.append([Lend[inexte],Lbeg[inexte]])
-                use_beg=1
-            else:
-                order_out.append([Lbeg[inext],Lend[inext]])
-                use_beg=0
-        ###########################################################
-        return order_out
+        return PathOrder().sort_paths(ecoords,i_loop)
     
-    #####################################################
-    # determine if a point is inside a given polygon or not
-    # Polygon is a list of (x,y) pairs.
-    # http://www.ariel.com.au/a/python-point-int-poly.html
-    #####################################################
-    def point_inside_polygon(self,x,y,poly):
-        n = len(poly)
-        inside = -1
-        p1x = poly[0][0]
-        p1y = poly[0][1]
-        for i in range(n+1):
-            p2x = poly[i%n][0]
-            p2y = poly[i%n][1]
-            if y > min(p1y,p2y):
-                if y <= max(p1y,p2y):
-                    if x <= max(p1x,p2x):
-                        if p1y != p2y:
-                            xinters = (y-p1y)*(p2x-p1x)/(p2y-p1y)+p1x
-                        if p1x == p2x or x <= xinters:
-                            inside = inside * -1
-            p1x,p1y = p2x,p2y
-
-        return inside
-
     def optimize_paths(self,ecoords,inside_check=True):
         order_out = self.Sort_Paths(ecoords)    
         lastx=-999
@@ -3258,76 +3130,55 @@ class Application(Frame):
             #####################################################
             # For each loop determine if other loops are inside #
             #####################################################
-            Nloops=len(cuts)
-            self.LoopTree=[]
-            for iloop in range(Nloops):
-                self.LoopTree.append([])
-    ##            CUR_PCT=float(iloop)/Nloops*100.0
-    ##            if (not self.batch.get()):
-    ##                self.statusMessage.set('Determining Which Side of Loop to Cut: %d of %d' %(iloop+1,Nloops))
-    ##                self.master.update()
-                ipoly = cuts[iloop]
-                ## Check points in other loops (could just check one) ##
-                if ipoly != []:
-                    for jloop in range(Nloops):
-                        if jloop != iloop:
-                            inside = 0
-                            inside = inside + self.point_inside_polygon(cuts[jloop][0][0],cuts[jloop][0][1],ipoly)
-                            if inside > 0:
-                                self.LoopTree[iloop].append(jloop)
-            #####################################################
-            for i in range(Nloops):
-                lns=[]
-                lns.append(i)
-                self.remove_self_references(lns,self.LoopTree[i])
-
-            self.order=[]
-            self.loops = list(range(Nloops))
-            for i in range(Nloops):
-                if self.LoopTree[i]!=[]:
-                    self.addlist(self.LoopTree[i])
-                    self.LoopTree[i]=[]
-                if self.loops[i]!=[]:
-                    self.order.append(self.loops[i])
-                    self.loops[i]=[]
-        #END inside_check
-            ecoords_out = []
-            for i in self.order:
-                line = cuts[i]
-                for coord in line:
-                    ecoords_out.append([coord[0],coord[1],i])
+            inside_first = InsideFirst()
+            self.LoopTree = inside_first.loop_tree(cuts)
+            inside_first.remove_self_references(self.LoopTree)
+            # loops that have to be cut before each loop (used by optimize_order)
+            inside = [list(loops) for loops in self.LoopTree]
+            order = inside_first.order(self.LoopTree)
         #END inside_check
         else:
-            ecoords_out = []
-            for i in range(len(cuts)):
-                line = cuts[i]
-                for coord in line:
-                    ecoords_out.append([coord[0],coord[1],i])
+            order  = list(range(len(cuts)))
+            inside = None
+
+        ###########################################################
+        # Reduce the rapid moves between loops (2-opt / Or-opt)   #
+        ###########################################################
+        reverse = [False]*len(cuts)
+        try:
+            tour_time = float(self.tour_time.get())
+        except:
+            tour_time = 0.0
+        if tour_time > 0.0 and len(order) > 2:
+            order,reverse,rapid_in,rapid_out = PathOrder().optimize_order(cuts,order,inside,time_limit=tour_time)
+            if rapid_in > 0.0:
+                self.statusMessage.set("Rapid moves reduced from %.1f to %.1f %s (%.1f%%)" \
+                                       %(rapid_in*self.units_scale,rapid_out*self.units_scale, \
+                                         self.units.get(),100.0*(rapid_in-rapid_out)/rapid_in))
+
+        ecoords_out = []
+        for i in order:
+            line = cuts[i]
+            if reverse[i]:
+                line = line[::-1]
+            for coord in line:
+                ecoords_out.append([coord[0],coord[1],i])
                     
         return ecoords_out
             
-    def remove_self_references(self,loop_numbers,loops):
-        for i in range(0,len(loops)):
-            for j in range(0,len(loop_numbers)):
-                if loops[i]==loop_numbers[j]:
-                    loops.pop(i)
-                    return
-            if self.LoopTree[loops[i]]!=[]:
-                loop_numbers.append(loops[i])
-                self.remove_self_references(loop_numbers,self.LoopTree[loops[i]])
-
-    def addlist(self,list):
-        for i in list:
-            try: #this try/except is a bad hack fix to a recursion error. It should be fixed properly later.
-                if self.LoopTree[i]!=[]:
-                    self.addlist(self.LoopTree[i]) #too many recursions here causes cmp error
-                    self.LoopTree[i]=[]
-            except:
-                pass
-            if self.loops[i]!=[]:
-                self.order.append(self.loops[i])
-                self.loops[i]=[]
-
+    def sort_vector_paths(self,data,inside_check=True):
+        # optimize_paths() stops after tour_time seconds so the order can be
+        # different each time.  The order made for the same paths and
+        # settings is kept in the EGV cache and used again, so the EGV data
+        # (and its cache key) is the same for each run of the same design.
+        settings = {"path_order":True, "tour_time":self.tour_time.get(),
+                    "inside_check":inside_check}
+        key = self.egv_cache.key(data.ecoords,settings)
+        ecoords = self.egv_cache.get_path(key)
+        if ecoords == None:
+            ecoords = self.optimize_paths(data.ecoords,inside_check=inside_check)
+            self.egv_cache.put_path(key,ecoords)
+        data.set_ecoords(ecoords,data_sorted=True)
 
     def mirror_rotate_vector_coords(self,coords):
         xmin = self.Design_bounds[0]
@@ -3391,41 +3242,84 @@ class Application(Frame):
             self.statusbar.configure( bg = 'red' ) 
             return
         try:
-            feed_factor=self.feed_factor()
-            
-            if self.inputCSYS.get() and self.RengData.image == None:
-                xmin,xmax,ymin,ymax = 0.0,0.0,0.0,0.0
-            else:
-                xmin,xmax,ymin,ymax = self.Get_Design_Bounds()
-                        
-            startx = xmin
-            starty = ymax
+            self.egv_cache_hits   = 0
+            self.egv_cache_misses = 0
+            jobs = self.make_egv_jobs(operation_type)
 
-            if self.HomeUR.get():
-                Xscale = float(self.LaserXscale.get())
-                FlipXoffset = Xscale*abs(xmax-xmin)
-                if self.rotate.get():
-                    startx = -xmin
-            else:
-                FlipXoffset = 0
-
-            if self.rotary.get():
-                Rapid_Feed = float(self.rapid_feed.get())*feed_factor
+            ### Join Resulting Data together ###
+            self.statusMessage.set("Generating EGV data... (EGV cache: %d hit(s), %d miss(es))" \
+                                   %(self.egv_cache_hits,self.egv_cache_misses))
+            self.master.update()
+            # the time features of the data are collected as it is sent
+            data = EGV_STREAM(workers=default_workers(),estimator=self.egv_time_estimator())
+            for name,job,num_passes,strip_redundant in jobs:
+                data.add_job(job,num_passes,strip_redundant=strip_redundant)
+            if data.empty():
+                raise Exception("No laser data was generated.")    
+                
+            self.master.update()
+            if output_filename != None:
+                self.write_egv_to_file(data,output_filename)
             else:
-                Rapid_Feed = 0.0
+                self.send_egv_data(data, 1, output_filename)
+                self.record_run_time(data.features)
+                self.menu_View_Refresh()
                 
-            Raster_Eng_data=[]
-            Vector_Eng_data=[]
-            Trace_Eng_data=[]
-            Vector_Cut_data=[]
-            G_code_Cut_data=[]
-                        
-            if (operation_type.find("Vector_Cut") > -1) and  (self.VcutData.ecoords!=[]):
-                Feed_Rate = float(self.Vcut_feed.get())*feed_factor
-                self.statusMessage.set("Vector Cut: Determining Cut Order....")
-                self.master.update()
-                if not self.VcutData.sorted and self.inside_first.get():
-                    self.VcutData.set_ecoords(self.optimize_paths(self.VcutData.ecoords),data_sorted=True)
+        except MemoryError as e:
+            msg1 = "Memory Error:"
+            msg2 = "Memory Error:  Out of Memory."
+            self.statusMessage.set(msg2)
+            self.statusbar.configure( bg = 'red' )
+            message_box(msg1, msg2)
+            debug_message(traceback.format_exc())
+        
+        except Exception as e:
+            msg1 = "Sending Data Stopped: "
+            msg2 = "%s" %(e)
+            if msg2 == "":
+                formatted_lines = traceback.format_exc().splitlines()
+            self.statusMessage.set((msg1+msg2).split("\n")[0] )
+            self.statusbar.configure( bg = 'red' )
+            message_box(msg1, msg2)
+            debug_message(traceback.format_exc())
+
+    def make_egv_jobs(self,operation_type):
+        # Returns a list of (name,make_data,passes,strip_redundant) for the
+        # operations in operation_type (make_data is made by make_egv_job())
+        feed_factor=self.feed_factor()
+        if self.inputCSYS.get() and self.RengData.image == None:
+            xmin,xmax,ymin,ymax = 0.0,0.0,0.0,0.0
+        else:
+            xmin,xmax,ymin,ymax = self.Get_Design_Bounds()
+                    
+        startx = xmin
+        starty = ymax
+
+        if self.HomeUR.get():
+            Xscale = float(self.LaserXscale.get())
+            FlipXoffset = Xscale*abs(xmax-xmin)
+            if self.rotate.get():
+                startx = -xmin
+        else:
+            FlipXoffset = 0
+
+        if self.rotary.get():
+            Rapid_Feed = float(self.rapid_feed.get())*feed_factor
+        else:
+            Rapid_Feed = 0.0
+            
+        Raster_Eng_job=None
+        Vector_Eng_job=None
+        Trace_Eng_job=None
+        Vector_Cut_job=None
+        G_code_Cut_job=None
+                    
+        if (operation_type.find("Vector_Cut") > -1) and  (self.VcutData.ecoords!=[]):
+            Feed_Rate = float(self.Vcut_feed.get())*feed_factor
+            self.statusMessage.set("Vector Cut: Determining Cut Order....")
+            self.master.update()
+            if not self.VcutData.sorted and self.inside_first.get():
+                self.sort_vector_paths(self.VcutData)
 
 
 ##                DEBUG_PLOT=False
@@ -3450,205 +3344,237 @@ class Application(Frame):
 ##                    plt.plot(X,Y)
 
 
-                self.statusMessage.set("Generating EGV data...")
-                self.master.update()
-
-                Vcut_coords = self.VcutData.ecoords
-                if self.mirror.get() or self.rotate.get():
-                    Vcut_coords = self.mirror_rotate_vector_coords(Vcut_coords)
-
-                Vcut_coords,startx,starty = self.scale_vector_coords(Vcut_coords,startx,starty)
-                Vector_Cut_egv_inst = egv(target=lambda s:Vector_Cut_data.append(s))   
-                Vector_Cut_egv_inst.make_egv_data(
-                                                Vcut_coords,                      \
-                                                startX=startx,                    \
-                                                startY=starty,                    \
-                                                Feed = Feed_Rate,                 \
-                                                board_name=self.board_name.get(), \
-                                                Raster_step = 0,                  \
-                                                update_gui=self.update_gui,       \
-                                                stop_calc=self.stop,              \
-                                                FlipXoffset=FlipXoffset,          \
-                                                Rapid_Feed_Rate = Rapid_Feed,     \
-                                                use_laser=True
-                                                )
-
-            if (operation_type.find("Vector_Eng") > -1) and  (self.VengData.ecoords!=[]):
-                Feed_Rate = float(self.Veng_feed.get())*feed_factor
-                self.statusMessage.set("Vector Engrave: Determining Cut Order....")
-                self.master.update()
-                if not self.VengData.sorted and self.inside_first.get():
-                    self.VengData.set_ecoords(self.optimize_paths(self.VengData.ecoords,inside_check=False),data_sorted=True)
-                self.statusMessage.set("Generating EGV data...")
-                self.master.update()
-
-                Veng_coords = self.VengData.ecoords
-                if self.mirror.get() or self.rotate.get():
-                    Veng_coords = self.mirror_rotate_vector_coords(Veng_coords)
-
-                Veng_coords,startx,starty = self.scale_vector_coords(Veng_coords,startx,starty)
-                Vector_Eng_egv_inst = egv(target=lambda s:Vector_Eng_data.append(s))
-                Vector_Eng_egv_inst.make_egv_data(
-                                                Veng_coords,                      \
-                                                startX=startx,                    \
-                                                startY=starty,                    \
-                                                Feed = Feed_Rate,                 \
-                                                board_name=self.board_name.get(), \
-                                                Raster_step = 0,                  \
-                                                update_gui=self.update_gui,       \
-                                                stop_calc=self.stop,              \
-                                                FlipXoffset=FlipXoffset,          \
-                                                Rapid_Feed_Rate = Rapid_Feed,     \
-                                                use_laser=True
-                                                )
-
-
-            if (operation_type.find("Trace_Eng") > -1) and (self.trace_coords!=[]):
-                Feed_Rate = float(self.trace_speed.get())*feed_factor
-                laser_on = self.trace_w_laser.get()
-                self.statusMessage.set("Generating EGV data...")
-                self.master.update()
-                Trace_Eng_egv_inst = egv(target=lambda s:Trace_Eng_data.append(s))
-                Trace_Eng_egv_inst.make_egv_data(
-                                                self.trace_coords,                \
-                                                startX=startx,                    \
-                                                startY=starty,                    \
-                                                Feed = Feed_Rate,                 \
-                                                board_name=self.board_name.get(), \
-                                                Raster_step = 0,                  \
-                                                update_gui=self.update_gui,       \
-                                                stop_calc=self.stop,              \
-                                                FlipXoffset=FlipXoffset,          \
-                                                Rapid_Feed_Rate = Rapid_Feed,     \
-                                                use_laser=laser_on
-                                                )
-                
+            Vcut_coords = self.VcutData.ecoords
+            if self.mirror.get() or self.rotate.get():
+                Vcut_coords = self.mirror_rotate_vector_coords(Vcut_coords)
+
+            Vcut_coords,startx,starty = self.scale_vector_coords(Vcut_coords,startx,starty)
+            Vector_Cut_job = self.make_egv_job(
+                                            Vcut_coords,                      \
+                                            startX=startx,                    \
+                                            startY=starty,                    \
+                                            Feed = Feed_Rate,                 \
+                                            board_name=self.board_name.get(), \
+                                            Raster_step = 0,                  \
+                                            stop_calc=self.stop,              \
+                                            FlipXoffset=FlipXoffset,          \
+                                            Rapid_Feed_Rate = Rapid_Feed,     \
+                                            use_laser=True
+                                            )
+
+        if (operation_type.find("Vector_Eng") > -1) and  (self.VengData.ecoords!=[]):
+            Feed_Rate = float(self.Veng_feed.get())*feed_factor
+            self.statusMessage.set("Vector Engrave: Determining Cut Order....")
+            self.master.update()
+            if not self.VengData.sorted and self.inside_first.get():
+                self.sort_vector_paths(self.VengData,inside_check=False)
+            Veng_coords = self.VengData.ecoords
+            if self.mirror.get() or self.rotate.get():
+                Veng_coords = self.mirror_rotate_vector_coords(Veng_coords)
+
+            Veng_coords,startx,starty = self.scale_vector_coords(Veng_coords,startx,starty)
+            Vector_Eng_job = self.make_egv_job(
+                                            Veng_coords,                      \
+                                            startX=startx,                    \
+                                            startY=starty,                    \
+                                            Feed = Feed_Rate,                 \
+                                            board_name=self.board_name.get(), \
+                                            Raster_step = 0,                  \
+                                            stop_calc=self.stop,              \
+                                            FlipXoffset=FlipXoffset,          \
+                                            Rapid_Feed_Rate = Rapid_Feed,     \
+                                            use_laser=True
+                                            )
+
+
+        if (operation_type.find("Trace_Eng") > -1) and (self.trace_coords!=[]):
+            Feed_Rate = float(self.trace_speed.get())*feed_factor
+            laser_on = self.trace_w_laser.get()
+            Trace_Eng_job = self.make_egv_job(
+                                            self.trace_coords,                \
+                                            startX=startx,                    \
+                                            startY=starty,                    \
+                                            Feed = Feed_Rate,                 \
+                                            board_name=self.board_name.get(), \
+                                            Raster_step = 0,                  \
+                                            stop_calc=self.stop,              \
+                                            FlipXoffset=FlipXoffset,          \
+                                            Rapid_Feed_Rate = Rapid_Feed,     \
+                                            use_laser=laser_on
+                                            )
+            
+            
+        if (operation_type.find("Raster_Eng") > -1) and  (self.RengData.ecoords!=[]):
+            Feed_Rate = float(self.Reng_feed.get())*feed_factor
+            Raster_step = self.get_raster_step_1000in()
+            if not self.engraveUP.get():
+                Raster_step = -Raster_step
                 
-            if (operation_type.find("Raster_Eng") > -1) and  (self.RengData.ecoords!=[]):
-                Feed_Rate = float(self.Reng_feed.get())*feed_factor
-                Raster_step = self.get_raster_step_1000in()
-                if not self.engraveUP.get():
-                    Raster_step = -Raster_step
-                    
-                raster_startx = 0
+            raster_startx = 0
 
-                Yscale = float(self.LaserYscale.get())
-                if self.rotary.get():
-                    Rscale = float(self.LaserRscale.get())
-                    Yscale = Yscale*Rscale
-                raster_starty = Yscale*starty
+            Yscale = float(self.LaserYscale.get())
+            if self.rotary.get():
+                Rscale = float(self.LaserRscale.get())
+                Yscale = Yscale*Rscale
+            raster_starty = Yscale*starty
+
+            raster_data = self.RengData.raster_runs
+            if raster_data is None:
+                raster_data = self.RengData.ecoords
+            Raster_Eng_job = self.make_egv_job(
+                                            raster_data,                      \
+                                            startX=raster_startx,             \
+                                            startY=raster_starty,             \
+                                            Feed = Feed_Rate,                 \
+                                            board_name=self.board_name.get(), \
+                                            Raster_step = Raster_step,        \
+                                            stop_calc=self.stop,              \
+                                            FlipXoffset=FlipXoffset,          \
+                                            Rapid_Feed_Rate = Rapid_Feed,     \
+                                            use_laser=True
+                                            )
+
+        if (operation_type.find("Gcode_Cut") > -1) and (self.GcodeData.ecoords!=[]):
+            Gcode_coords = self.GcodeData.ecoords
+            if self.mirror.get() or self.rotate.get():
+                Gcode_coords = self.mirror_rotate_vector_coords(Gcode_coords)
+
+            Gcode_coords,startx,starty = self.scale_vector_coords(Gcode_coords,startx,starty)
+            G_code_Cut_job = self.make_egv_job(
+                                            Gcode_coords,                     \
+                                            startX=startx,                    \
+                                            startY=starty,                    \
+                                            Feed = None,                      \
+                                            board_name=self.board_name.get(), \
+                                            Raster_step = 0,                  \
+                                            stop_calc=self.stop,              \
+                                            FlipXoffset=FlipXoffset,          \
+                                            Rapid_Feed_Rate = Rapid_Feed,     \
+                                            use_laser=True
+                                            )
+
+        jobs = []
+        if Trace_Eng_job!=None:
+            jobs.append(("Trace_Eng",Trace_Eng_job,1,False))
+        if Raster_Eng_job!=None:
+            jobs.append(("Raster_Eng",Raster_Eng_job,int(float(self.Reng_passes.get())),True))
+        if Vector_Eng_job!=None:
+            jobs.append(("Vector_Eng",Vector_Eng_job,int(float(self.Veng_passes.get())),False))
+        if Vector_Cut_job!=None:
+            jobs.append(("Vector_Cut",Vector_Cut_job,int(float(self.Vcut_passes.get())),False))
+        if G_code_Cut_job!=None:
+            jobs.append(("Gcode_Cut",G_code_Cut_job,int(float(self.Gcde_passes.get())),False))
+        return jobs
+
+    def make_egv_job(self,ecoords,**kwargs):
+        # Returns a function that generates the EGV data for ecoords
+        # (used by EGV_STREAM to generate the data while it is being sent)
+        # The data of jobs made before is read from the EGV cache.
+        settings = {}
+        for name in kwargs:
+            if name != "stop_calc":
+                settings[name] = kwargs[name]
+        cache = self.egv_cache
+        key = cache.key(ecoords,settings)
+        if cache.contains(key):
+            self.egv_cache_hits = self.egv_cache_hits+1
+        else:
+            self.egv_cache_misses = self.egv_cache_misses+1
 
-                self.statusMessage.set("Generating EGV data...")
-                self.master.update()
-                Raster_Eng_egv_inst = egv(target=lambda s:Raster_Eng_data.append(s))
-                Raster_Eng_egv_inst.make_egv_data(
-                                                self.RengData.ecoords,            \
-                                                startX=raster_startx,             \
-                                                startY=raster_starty,             \
-                                                Feed = Feed_Rate,                 \
-                                                board_name=self.board_name.get(), \
-                                                Raster_step = Raster_step,        \
-                                                update_gui=self.update_gui,       \
-                                                stop_calc=self.stop,              \
-                                                FlipXoffset=FlipXoffset,          \
-                                                Rapid_Feed_Rate = Rapid_Feed,     \
-                                                use_laser=True
-                                                )
-                #print(len(Raster_Eng_data))
-                Raster_Eng_data=Raster_Eng_egv_inst.strip_redundant_codes(Raster_Eng_data)
-                #print(len(Raster_Eng_data))
-
-            if (operation_type.find("Gcode_Cut") > -1) and (self.GcodeData.ecoords!=[]):
-                self.statusMessage.set("Generating EGV data...")
-                self.master.update()
-                Gcode_coords = self.GcodeData.ecoords
-                if self.mirror.get() or self.rotate.get():
-                    Gcode_coords = self.mirror_rotate_vector_coords(Gcode_coords)
-
-                Gcode_coords,startx,starty = self.scale_vector_coords(Gcode_coords,startx,starty)
-                G_code_Cut_egv_inst = egv(target=lambda s:G_code_Cut_data.append(s))
-                G_code_Cut_egv_inst.make_egv_data(
-                                                Gcode_coords,                     \
-                                                startX=startx,                    \
-                                                startY=starty,                    \
-                                                Feed = None,                      \
-                                                board_name=self.board_name.get(), \
-                                                Raster_step = 0,                  \
-                                                update_gui=self.update_gui,       \
-                                                stop_calc=self.stop,              \
-                                                FlipXoffset=FlipXoffset,          \
-                                                Rapid_Feed_Rate = Rapid_Feed,     \
-                                                use_laser=True
-                                                )
-                
-            ### Join Resulting Data together ###
-            data=[]
-            data.append(ord("I"))
-            if Trace_Eng_data!=[]:
-                trace_passes=1
-                for k in range(trace_passes):
-                    if len(data)> 4:
-                        data[-4]=ord("@")
-                    data.extend(Trace_Eng_data)
-            if Raster_Eng_data!=[]:
-                num_passes = int(float(self.Reng_passes.get()))
-                for k in range(num_passes):
-                    if len(data)> 4:
-                        data[-4]=ord("@")
-                    data.extend(Raster_Eng_data)
-            if Vector_Eng_data!=[]:
-                num_passes = int(float(self.Veng_passes.get()))
-                for k in range(num_passes):
-                    if len(data)> 4:
-                        data[-4]=ord("@")
-                    data.extend(Vector_Eng_data)
-            if Vector_Cut_data!=[]:
-                num_passes = int(float(self.Vcut_passes.get()))
-                for k in range(num_passes):
-                    if len(data)> 4:
-                        data[-4]=ord("@")
-                    data.extend(Vector_Cut_data)
-            if G_code_Cut_data!=[]:
-                num_passes = int(float(self.Gcde_passes.get()))
-                for k in range(num_passes):
-                    if len(data)> 4:
-                        data[-4]=ord("@")
-                    data.extend(G_code_Cut_data)
-            if len(data)< 4:
-                raise Exception("No laser data was generated.")    
-                
-            self.master.update()
-            if output_filename != None:
-                self.write_egv_to_file(data,output_filename)
-            else:
-                self.send_egv_data(data, 1, output_filename)
-                self.menu_View_Refresh()
-                
-        except MemoryError as e:
-            msg1 = "Memory Error:"
-            msg2 = "Memory Error:  Out of Memory."
-            self.statusMessage.set(msg2)
-            self.statusbar.configure( bg = 'red' )
-            message_box(msg1, msg2)
-            debug_message(traceback.format_exc())
-        
+        def make_data(data,update,pool):
+            # pool is the EGV_STREAM's pool of workers (or None)
+            cached = cache.get(key)
+            if cached != None:
+                data.extend(cached)
+                return
+            # write the data to the cache as it is passed on by update()
+            entry = cache.writer(key)
+            def update_record(msg=None):
+                entry.write(data)
+                update(msg)
+            try:
+                egv_inst = egv(target=data)
+                egv_inst.make_egv_data(ecoords,update_gui=update_record,pool=pool,**kwargs)
+            except:
+                entry.abort()
+                raise
+            entry.write(data)
+            entry.close()
+        return make_data
+
+    def egv_time_settings(self):
+        # Everything that changes the EGV data of the operations
+        settings = [self.RengData.version, self.VengData.version,
+                    self.VcutData.version, self.GcodeData.version]
+        for var in (self.Reng_feed, self.Veng_feed, self.Vcut_feed,
+                    self.Reng_passes, self.Veng_passes, self.Vcut_passes, self.Gcde_passes,
+                    self.board_name, self.units, self.rast_step, self.engraveUP,
+                    self.HomeUR, self.inputCSYS, self.mirror, self.rotate, self.rotary,
+                    self.rapid_feed, self.inside_first, self.tour_time,
+                    self.LaserXscale, self.LaserYscale, self.LaserRscale):
+            settings.append(var.get())
+        return tuple(settings)
+
+    def egv_operations(self,jobs):
+        # Generates the EGV data of jobs from make_egv_jobs() (or reads it
+        # from the EGV cache).  Returns a list of (name,data,passes).
+        operations = []
+        for name,job,num_passes,strip_redundant in jobs:
+            data = bytearray()
+            job_data = bytearray()
+            def update(msg=None):
+                job_data.extend(data)
+                del data[:]
+                self.update_gui(msg)
+            job(data,update,None)
+            job_data.extend(data)
+            operations.append((name,job_data,num_passes))
+        return operations
+
+    def egv_time_estimator(self):
+        # The time estimate calibrated with the jobs run on this board
+        board_name = self.board_name.get()
+        return EGV_TIME(board=board_name.split('-')[1],
+                        coefficients=self.time_calibration.coefficients(board_name))
+
+    def calc_egv_times(self):
+        # Generates the EGV data of the operations (or reads it from the
+        # EGV cache) and estimates the time of each operation from it
+        try:
+            jobs = self.make_egv_jobs("Raster_Eng+Vector_Eng+Vector_Cut+Gcode_Cut")
+            operations = self.egv_operations(jobs)
+            estimator = self.egv_time_estimator()
+            self.egv_times = (self.egv_time_settings(),estimator.operation_times(operations))
+            self.statusMessage.set("Job Time Calculated from the EGV Data")
         except Exception as e:
-            msg1 = "Sending Data Stopped: "
-            msg2 = "%s" %(e)
-            if msg2 == "":
-                formatted_lines = traceback.format_exc().splitlines()
-            self.statusMessage.set((msg1+msg2).split("\n")[0] )
+            self.egv_times = None
+            self.statusMessage.set("Job Time Calculation Stopped: %s" %(e))
             self.statusbar.configure( bg = 'red' )
-            message_box(msg1, msg2)
             debug_message(traceback.format_exc())
 
-    def send_egv_data(self,data,num_passes=1,output_filename=None):        
+    def record_run_time(self,features):
+        # Adds the time the laser took to run the job with features (the
+        # features of the EGV_STREAM that was sent) to the time
+        # calibration.  The time is only complete when K40 Whisperer waited
+        # for the laser to finish.
+        if not self.wait.get() or features == None or self.k40 == None:
+            return
+        try:
+            self.time_calibration.add(self.board_name.get(),features,self.k40.laser_time)
+        except:
+            debug_message(traceback.format_exc())
+
+    def send_egv_data(self,data,num_passes=1,output_filename=None,max_block=None):
         pre_process_CRC        = self.pre_pr_crc.get()
         if self.k40 != None:
             self.k40.timeout       = int(float( self.t_timeout.get()  )) 
             self.k40.n_timeouts    = int(float( self.n_timeouts.get() ))
             time_start = time()
-            self.k40.send_data(data,self.update_gui,self.stop,num_passes,pre_process_CRC, wait_for_laser=self.wait.get())
+            if isinstance(data,EGV_STREAM):
+                self.k40.send_data_stream(data,self.update_gui,self.stop,wait_for_laser=self.wait.get())
+            else:
+                self.k40.send_data(data,self.update_gui,self.stop,num_passes,pre_process_CRC, wait_for_laser=self.wait.get(),
+                                   max_block=max_block)
             self.run_time = time()-time_start
             if DEBUG:
                 print(("Elapsed Time: %.6f" %(time()-time_start)))
@@ -3662,23 +3588,21 @@ class Application(Frame):
     ##########################################################################
     ##########################################################################
     def write_egv_to_file(self,data,fname):
-        if len(data) == 0:
-            raise Exception("No data available to write to file.")
+        if isinstance(data,EGV_STREAM):
+            chunks = data
+            data.start(idle=self.update_gui)
+        else:
+            chunks = [bytearray(data)]
+            if len(data) == 0:
+                raise Exception("No data available to write to file.")
         try:
-            fout = open(fname,'w')
+            fout = open(fname,'wb',EGV_BUFFER_SIZE)
         except:
             raise Exception("Unable to open file ( %s ) for writing." %(fname))
-        fout.write("Document type : LHYMICRO-GL file\n")
-        fout.write("Creator-Software: K40 Whisperer\n")
-        
-        fout.write("\n")
-        fout.write("%0%0%0%0%")
-        for char_val in data:
-            char = chr(char_val)
-            fout.write("%s" %(char))
-            
-        #fout.write("\n")
-        fout.close
+        try:
+            write_egv_file(fout,chunks)
+        finally:
+            fout.close()
         self.menu_View_Refresh()
         self.statusMessage.set("Data saved to: %s" %(fname))
         
@@ -3889,6 +3813,7 @@ class Application(Frame):
         self.set_gui("disabled")
         self.stop[0]=False
         self.make_raster_coords()
+        self.calc_egv_times()
         self.stop[0]=True
         self.refreshTime()
         self.set_gui("normal")
@@ -4313,6 +4238,8 @@ class Application(Frame):
         if self.halftone.get():
             self.Label_Halftone_DPI.configure(state="normal")
             self.Halftone_DPI_OptionMenu.configure(state="normal")
+            self.Label_Dither.configure(state="normal")
+            self.Dither_OptionMenu.configure(state="normal")
             self.Label_Halftone_u.configure(state="normal")
             self.Label_bezier_M1.configure(state="normal")
             self.bezier_M1_Slider.configure(state="normal")
@@ -4323,6 +4250,8 @@ class Application(Frame):
         else:
             self.Label_Halftone_DPI.configure(state="disabled")
             self.Halftone_DPI_OptionMenu.configure(state="disabled")
+            self.Label_Dither.configure(state="disabled")
+            self.Dither_OptionMenu.configure(state="disabled")
             self.Label_Halftone_u.configure(state="disabled")
             self.Label_bezier_M1.configure(state="disabled")
             self.bezier_M1_Slider.configure(state="disabled")
@@ -4392,7 +4321,9 @@ class Application(Frame):
     #        CANVAS PLOTTING STUFF           #
     ##########################################
     def Plot_Data(self):
-        self.PreviewCanvas.delete(ALL)
+        # The Reng, Veng, Vcut and Gcode layers are kept on the canvas and
+        # are only drawn again when their data or the zoom level changes
+        # (see PreviewLayer)
         self.calc_button.place_forget()
 
         for seg in self.segID:
@@ -4430,16 +4361,15 @@ class Application(Frame):
             x_rgt =  maxx / self.PlotScale - self.laserX / self.PlotScale + (cszw-(xmax-xmin)/self.PlotScale)/2
             y_bot = -miny / self.PlotScale + self.laserY / self.PlotScale + (cszh-(ymax-ymin)/self.PlotScale)/2
             y_top = -maxy / self.PlotScale + self.laserY / self.PlotScale + (cszh-(ymax-ymin)/self.PlotScale)/2
-            self.segID.append( self.PreviewCanvas.create_rectangle(
-                            x_lft, y_bot, x_rgt, y_top, fill="gray80", outline="gray80", width = 0) )
         else:
             self.PlotScale = max((maxx-minx)/(cszw-buff), (maxy-miny)/(cszh-buff))
             x_lft = cszw/2 + (minx-midx) / self.PlotScale
             x_rgt = cszw/2 + (maxx-midx) / self.PlotScale
             y_bot = cszh/2 + (maxy-midy) / self.PlotScale
             y_top = cszh/2 + (miny-midy) / self.PlotScale
-            self.segID.append( self.PreviewCanvas.create_rectangle(
-                            x_lft, y_bot, x_rgt, y_top, fill="gray80", outline="gray80", width = 0) )
+        laser_area = self.PreviewCanvas.create_rectangle(
+                            x_lft, y_bot, x_rgt, y_top, fill="gray80", outline="gray80", width = 0)
+        self.segID.append(laser_area)
 
 
         ######################################
@@ -4453,8 +4383,10 @@ class Application(Frame):
                         self.SCALE = new_SCALE
                         nw=int(self.SCALE*self.wim)
                         nh=int(self.SCALE*self.him)
+                        if self.rotate.get():
+                            nh=int(self.SCALE*self.wim)
+                            nw=int(self.SCALE*self.him)
 
-                        plot_im = self.RengData.image.convert("L")                        
 ##                        if self.unsharp_flag.get():
 ##                            from PIL import ImageFilter
 ##                            filter = ImageFilter.UnsharpMask()
@@ -4462,132 +4394,96 @@ class Application(Frame):
 ##                            filter.percent   = int(float(self.unsharp_p.get()))
 ##                            filter.threshold = int(float(self.unsharp_t.get()))
 ##                            plot_im = plot_im.filter(filter)
-                        
-                        if self.negate.get():
-                            plot_im = ImageOps.invert(plot_im)
-
-                        if self.halftone.get() == False:
-                            plot_im = plot_im.point(lambda x: 0 if x<128 else 255, '1')
-                            plot_im = plot_im.convert("L")
 
-                        if self.mirror.get():
-                            plot_im = ImageOps.mirror(plot_im)
-
-                        if self.rotate.get():
-                            plot_im = plot_im.rotate(90,expand=True)
-                            nh=int(self.SCALE*self.wim)
-                            nw=int(self.SCALE*self.him)
-                            
+                        if self.tiled_raster.get() and raster_tiles.NUMPY:
+                            # made a band at a time (no full size images)
+                            self.raster_pipeline.drop(FULL_SIZE_STEPS)
+                            def make_preview():
+                                return preview_tiles(self.RengData.image, (nw,nh),
+                                                     self.negate.get(),
+                                                     self.mirror.get(),
+                                                     self.rotate.get(),
+                                                     threshold=not self.halftone.get())
+                            key = (self.negate.get(), self.mirror.get(), self.rotate.get(),
+                                   not self.halftone.get(), (nw,nh))
+                            plot_im = self.raster_pipeline.cached("tiled preview", self.RengData.image,
+                                                                  key, make_preview)
+                        else:
+                            plot_im = self.raster_pipeline.preview(self.RengData.image, (nw,nh),
+                                                                   self.negate.get(),
+                                                                   self.mirror.get(),
+                                                                   self.rotate.get(),
+                                                                   threshold=not self.halftone.get())
                         try:
-                            self.UI_image = ImageTk.PhotoImage(plot_im.resize((nw,nh), Image.LANCZOS))
+                            self.UI_image = ImageTk.PhotoImage(plot_im)
                         except:
                             debug_message("Imaging_Free Used.")
-                            self.UI_image = self.Imaging_Free(plot_im.resize((nw,nh), Image.LANCZOS))
+                            self.UI_image = self.Imaging_Free(plot_im)
                 except:
                     self.SCALE = 1
                     debug_message(traceback.format_exc())
                     
                 self.Plot_Raster(self.laserX+.001, self.laserY-.001, x_lft,y_top,self.PlotScale,im=self.UI_image)
+                self.PreviewCanvas.tag_lower(self.segID[-1])
         else:
             self.UI_image = None
+        self.PreviewCanvas.tag_lower(laser_area)
+
+        # view transform of the layers (canvas = a + x*s, b - y*s)
+        s = 1.0/self.PlotScale
+        view = (s, x_lft + XlineShift*s, y_top - YlineShift*s)
+        mirror_rotate = self.mirror.get() or self.rotate.get()
+        vector_key = (self.mirror.get(), self.rotate.get(),
+                      self.inputCSYS.get() and self.RengData.image == None,
+                      tuple(self.Design_bounds), xmin, ymax)
+        def vector_coords(data):
+            if mirror_rotate:
+                return self.mirror_rotate_vector_coords(data.ecoords)
+            return data.ecoords
+        rebuilt = False
 
 
         ######################################
         ###       Plot Reng Coords         ###
         ######################################
-        if self.include_Rpth.get() and self.RengData.ecoords!=[]:
-            loop_old = -1
-
-            #####
-            Xscale = 1/float(self.LaserXscale.get())
-            Yscale = 1/float(self.LaserYscale.get())
-            if self.rotary.get():
-                Rscale = 1/float(self.LaserRscale.get())
-                Yscale = Yscale*Rscale
-            ######
-
-            for line in self.RengData.ecoords:
-                XY    = line
-                x1    = XY[0]*Xscale
-                y1    = XY[1]*Yscale-ymax
-                loop  = XY[2]
-                color = "black"
-                # check and see if we need to move to a new discontinuous start point
-                if (loop == loop_old):
-                    self.Plot_Line(xold, yold, x1, y1, x_lft, y_top, XlineShift, YlineShift, self.PlotScale, color)
-                loop_old = loop
-                xold=x1
-                yold=y1
+        Xscale = 1/float(self.LaserXscale.get())
+        Yscale = 1/float(self.LaserYscale.get())
+        if self.rotary.get():
+            Rscale = 1/float(self.LaserRscale.get())
+            Yscale = Yscale*Rscale
+        rebuilt |= self.RengLayer.update(
+            (self.RengData.version, Xscale, Yscale, ymax), view,
+            lambda: (self.RengData.ecoords, Xscale, Yscale, 0.0, ymax),
+            visible=self.include_Rpth.get() and self.RengData.ecoords!=[])
 
-            
         ######################################
         ###       Plot Veng Coords         ###
         ######################################
-        if self.include_Veng.get():
-            loop_old = -1
-            
-
-            plot_coords = self.VengData.ecoords
-            if self.mirror.get() or self.rotate.get():
-                plot_coords = self.mirror_rotate_vector_coords(plot_coords)
-
-            for line in plot_coords:
-                XY    = line
-                x1    = (XY[0]-xmin)
-                y1    = (XY[1]-ymax)
-                loop  = XY[2]
-                # check and see if we need to move to a new discontinuous start point
-                if (loop == loop_old):
-                    self.Plot_Line(xold, yold, x1, y1, x_lft, y_top, XlineShift, YlineShift, self.PlotScale, "blue")
-                loop_old = loop
-                xold=x1
-                yold=y1
+        rebuilt |= self.VengLayer.update(
+            (self.VengData.version,)+vector_key, view,
+            lambda: (vector_coords(self.VengData), 1, 1, xmin, ymax),
+            visible=self.include_Veng.get())
 
         ######################################
         ###       Plot Vcut Coords         ###
         ######################################
-        if self.include_Vcut.get():
-            loop_old = -1
-
-            plot_coords = self.VcutData.ecoords
-            if self.mirror.get() or self.rotate.get():
-                    plot_coords = self.mirror_rotate_vector_coords(plot_coords)
-                
-            for line in plot_coords:
-                XY    = line
-                x1    = (XY[0]-xmin)
-                y1    = (XY[1]-ymax)
-                loop  = XY[2]
-                # check and see if we need to move to a new discontinuous start point
-                if (loop == loop_old):
-                    self.Plot_Line(xold, yold, x1, y1, x_lft, y_top, XlineShift, YlineShift, self.PlotScale, "red")
-                loop_old = loop
-                xold=x1
-                yold=y1
+        rebuilt |= self.VcutLayer.update(
+            (self.VcutData.version,)+vector_key, view,
+            lambda: (vector_coords(self.VcutData), 1, 1, xmin, ymax),
+            visible=self.include_Vcut.get())
 
         ######################################
         ###       Plot Gcode Coords        ###
         ######################################
-        if self.include_Gcde.get():  
-            loop_old = -1
-            scale=1
+        rebuilt |= self.GcodeLayer.update(
+            (self.GcodeData.version,)+vector_key, view,
+            lambda: (vector_coords(self.GcodeData), 1, 1, xmin, ymax),
+            visible=self.include_Gcde.get())
 
-            plot_coords = self.GcodeData.ecoords
-            if self.mirror.get() or self.rotate.get():
-                    plot_coords = self.mirror_rotate_vector_coords(plot_coords)
-                
-            for line in plot_coords:
-                XY    = line
-                x1    = (XY[0]-xmin)*scale
-                y1    = (XY[1]-ymax)*scale
-
-                loop  = XY[2]
-                # check and see if we need to move to a new discontinuous start point
-                if (loop == loop_old):
-                    self.Plot_Line(xold, yold, x1, y1, x_lft, y_top, XlineShift, YlineShift, self.PlotScale, "white")
-                loop_old = loop
-                xold=x1
-                yold=y1
+        if rebuilt:
+            # keep the layers stacked in the order they are drawn
+            for layer in (self.RengLayer,self.VengLayer,self.VcutLayer,self.GcodeLayer):
+                self.PreviewCanvas.tag_raise(layer.tag)
 
 
         ######################################
@@ -4602,6 +4498,8 @@ class Application(Frame):
                 Yscale = Yscale*Rscale
             ######
             trace_coords = self.make_trace_path()
+            loop_old = -1
+            scale = 1
             for i in range(len(trace_coords)):
                 trace_coords[i]=[trace_coords[i][0]*Xscale,trace_coords[i][1]*Yscale,trace_coords[i][2]]
 
@@ -4773,7 +4671,7 @@ class Application(Frame):
     ################################################################################
     def GEN_Settings_Window(self):
         gen_width = 560
-        gen_settings = Toplevel(width=gen_width, height=575) #460+75)
+        gen_settings = Toplevel(width=gen_width, height=627) #460+75+26)
         gen_settings.grab_set() # Use grab_set to prevent user input in the main window
         gen_settings.focus_set()
         gen_settings.resizable(0,0)
@@ -4859,6 +4757,14 @@ class Application(Frame):
         self.Checkbutton_Reduce_Memory.configure(variable=self.reduced_mem)
         self.reduced_mem.trace_variable("w", self.Reduced_Memory_Callback)
 
+        D_Yloc=D_Yloc+D_dY
+        self.Label_Tiled_Raster = Label(gen_settings,text="Tiled Raster Processing")
+        self.Label_Tiled_Raster.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Checkbutton_Tiled_Raster = Checkbutton(gen_settings,text="(keeps large rasters on disk instead of in memory)", anchor=W)
+        self.Checkbutton_Tiled_Raster.place(x=xd_entry_L, y=D_Yloc, width=350, height=23)
+        self.Checkbutton_Tiled_Raster.configure(variable=self.tiled_raster)
+        self.tiled_raster.trace_variable("w", self.Reset_RasterPath_and_Update_Time)
+
         D_Yloc=D_Yloc+D_dY
         self.Label_Wait = Label(gen_settings,text="Wait for Laser to Finish")
         self.Label_Wait.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
@@ -4982,6 +4888,17 @@ class Application(Frame):
         self.Entry_Laser_Y_Scale.configure(textvariable=self.LaserYscale)
         self.LaserYscale.trace_variable("w", self.Entry_Laser_Y_Scale_Callback)
         self.entry_set(self.Entry_Laser_Y_Scale,self.Entry_Laser_Y_Scale_Check(),2)
+
+        D_Yloc=D_Yloc+D_dY
+        self.Label_Tour_Time = Label(gen_settings,text="Path Optimization Time")
+        self.Label_Tour_Time.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Label_Tour_Time_u = Label(gen_settings,text="seconds (0 = off)", anchor=W)
+        self.Label_Tour_Time_u.place(x=xd_units_L, y=D_Yloc, width=w_units*3, height=21)
+        self.Entry_Tour_Time = Entry(gen_settings,width="15")
+        self.Entry_Tour_Time.place(x=xd_entry_L, y=D_Yloc, width=w_entry, height=23)
+        self.Entry_Tour_Time.configure(textvariable=self.tour_time)
+        self.tour_time.trace_variable("w", self.Entry_Tour_Time_Callback)
+        self.entry_set(self.Entry_Tour_Time,self.Entry_Tour_Time_Check(),2)
                 
         D_Yloc=D_Yloc+D_dY+10
         self.Label_SaveConfig = Label(gen_settings,text="Configuration File")
@@ -5007,7 +4924,7 @@ class Application(Frame):
     ################################################################################
     def RASTER_Settings_Window(self):
         Wset=425+280
-        Hset=330 #260
+        Hset=354 #260
         raster_settings = Toplevel(width=Wset, height=Hset)
         raster_settings.grab_set() # Use grab_set to prevent user input in the main window
         raster_settings.focus_set()
@@ -5081,6 +4998,13 @@ class Application(Frame):
         self.Label_Halftone_u = Label(raster_settings,text="dpi", anchor=W)
         self.Label_Halftone_u.place(x=xd_units_L+30, y=D_Yloc, width=w_units, height=21)
 
+        D_Yloc=D_Yloc+D_dY
+        self.Label_Dither = Label(raster_settings,text="Dither Method", anchor=CENTER )
+        self.Dither_OptionMenu = OptionMenu(raster_settings, self.dither_method, *DITHER_METHODS)
+        self.Label_Dither.place(x=xd_label_L, y=D_Yloc, width=w_label, height=21)
+        self.Dither_OptionMenu.place(x=xd_entry_L, y=D_Yloc, width=w_entry+60, height=23)
+        self.dither_method.trace_variable("w", self.Reset_RasterPath_and_Update_Time)
+
         ############
         D_Yloc=D_Yloc+D_dY+5
         self.Label_bezier_M1  = Label(raster_settings,
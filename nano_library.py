@@ -31,7 +31,12 @@ from shutil import copyfile
 from egv import egv
 import traceback
 from windowsinhibitor import WindowsInhibitor
-from time import time
+from time import time, sleep
+import threading
+try:
+    import queue
+except:
+    import Queue as queue
 
 ##############################################################################
 
@@ -53,10 +58,13 @@ class K40_CLASS:
         self.TASK_COMPLETE_M3 = 204
         #######################
         self.hello   = [160]
+        self.blank   = [166,0,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,166,80]
         self.unlock  = [166,0,73,83,50,80,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,166,15]
         self.home    = [166,0,73,80,80,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,166,228]
         self.estop  =  [166,0,73,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,166,130]
         self.USB_Location = None
+        self.crc_table    = self.make_crc_table()
+        self.laser_time   = 0.0 # time of the last job on the laser (see sending_time())
 
 
     def say_hello(self):
@@ -148,7 +156,7 @@ class K40_CLASS:
     #  The latest version of this library may be found at:
     #  http://www.pjrc.com/teensy/td_libs_OneWire.html
     #######################################################################
-    def OneWireCRC(self,line):
+    def OneWireCRC_bitwise(self,line):
         crc=0
         for i in range(len(line)):
             inbyte=line[i]
@@ -159,12 +167,136 @@ class K40_CLASS:
                     crc ^= 0x8C
                 inbyte >>= 1
         return crc
+
+    def make_crc_table(self):
+        # CRC of every possible single byte (the CRC is then computed one
+        # byte at a time using a table lookup instead of bit by bit)
+        table = []
+        for i in range(256):
+            table.append(self.OneWireCRC_bitwise([i]))
+        return table
+
+    def OneWireCRC(self,line):
+        crc=0
+        table = self.crc_table
+        for inbyte in line:
+            crc = table[crc ^ inbyte]
+        return crc
+    #######################################################################
+    def frame_packets(self,data,final=True):
+        # Build the packets for data in one preallocated buffer.  Each packet
+        # is 34 bytes long and carries up to 30 bytes of data.  If final is
+        # True and the last packet is full an empty packet is added (needed
+        # by the M3 board).
+        n_data = len(data)
+        n_packets = max( (n_data+29)//30, 1)
+        if final and n_data > 0 and n_data % 30 == 0:
+            n_packets = n_packets+1
+        if not isinstance(data,bytearray):
+            data = bytearray(data)
+        packets = bytearray(self.blank)*n_packets
+        table   = self.crc_table
+        for k in range(n_packets):
+            o = k*34
+            chunk = data[k*30:k*30+30]
+            packets[o+2:o+2+len(chunk)] = chunk
+            crc=0
+            for inbyte in packets[o+1:o+32]:
+                crc = table[crc ^ inbyte]
+            packets[o+33] = crc
+        return memoryview(packets)
+
+    def pass_packets(self,data,passes=1,block=True,max_block=None):
+        # Yields the packets of data sent passes times (the same packets as
+        # frame_packets(join_passes(data,passes))) without joining the
+        # passes or copying data (data can be a memoryview of a file).  The
+        # "@"/"F" footer of each pass is set in the pieces of data as they
+        # are framed.  If block is True the full packets inside a pass are
+        # framed together (max_block bytes at a time if max_block is set),
+        # and when a later pass starts at the same place in its first
+        # packet (with the same footer) the packets of the earlier pass are
+        # used again so their CRCs are only computed once.  Only one pass
+        # of packets is kept.
+        len_data = len(data)
+        footer   = len_data-4
+        def piece(i,j,code):
+            # data[i:j] with the footer code of the pass
+            p = data[i:j]
+            if code != None and i <= footer < j:
+                p = bytearray(p)
+                p[footer-i] = code
+            return p
+
+        carry = bytearray() # start of a packet that the next pass completes
+        saved = None        # (key,packets) of a pass
+        for j in range(passes):
+            start = 0
+            code  = None
+            if passes > 1:
+                if j > 0:
+                    start = 1
+                if j == passes-1:
+                    code = ord("F")
+                else:
+                    code = ord("@")
+            if len(carry) > 0:
+                n = min(30-len(carry),len_data-start)
+                carry.extend(piece(start,start+n,code))
+                start = start+n
+                if len(carry) < 30:
+                    continue
+                yield self.frame_packets(carry,final=False)
+                carry = bytearray()
+            end = start+(len_data-start)//30*30
+            if end > start:
+                if not block:
+                    for i in range(start,end,30):
+                        yield self.frame_packets(piece(i,i+30,code),final=False)
+                elif max_block != None and end-start > max_block:
+                    step = max(max_block//30,1)*30
+                    for i in range(start,end,step):
+                        yield self.frame_packets(piece(i,min(i+step,end),code),final=False)
+                else:
+                    key = (start,code)
+                    if saved != None and saved[0] == key:
+                        packets = saved[1]
+                    else:
+                        packets = self.frame_packets(piece(start,end,code),final=False)
+                        if j > 0 and saved == None:
+                            saved = (key,packets)
+                    yield packets
+            carry = bytearray(piece(end,len_data,code))
+        # the last packet (an empty one if the last packet was full)
+        yield self.frame_packets(carry,final=True)
+
+    def join_passes(self,data,passes=1):
+        # The first byte ("I") is only sent with the first pass and the
+        # footer of each pass except the last is changed from "F" to "@"
+        if passes <= 1:
+            return data
+        data = bytearray(data)
+        joined = bytearray()
+        for j in range(passes):
+            if j == passes-1:
+                data[-4]=ord("F")
+            else:
+                data[-4]=ord("@")
+            if j == 0:
+                joined.extend(data)
+            else:
+                joined.extend(data[1:])
+        return joined
+
     #######################################################################
     def none_function(self,dummy=None,bgcolor=None):
         #Don't delete this function (used in send_data)
         return False
     
-    def send_data(self,data,update_gui=None,stop_calc=None,passes=1,preprocess_crc=True, wait_for_laser=False):
+    def send_data(self,data,update_gui=None,stop_calc=None,passes=1,preprocess_crc=True, wait_for_laser=False,
+                  max_block=None):
+        # data can be any object with a length that can be sliced (a list,
+        # bytes or a memoryview of a file).  max_block limits the data that
+        # is framed before it is sent (see pass_packets()).
         if stop_calc == None:
             stop_calc=[]
             stop_calc.append(0)
@@ -174,68 +306,124 @@ class K40_CLASS:
         NoSleep = WindowsInhibitor()
         NoSleep.inhibit()
 
-        blank   = [166,0,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,70,166,80]
-        packets = []
-        packet  = blank[:]
-        cnt=2
+        # The passes are not joined, the "@"/"F" footers are set as the
+        # packets of each pass are made
         len_data = len(data)
-        for j in range(passes):
-            if j == 0:
-                istart = 0
-            else:
-                istart = 1
-            if passes > 1:
-                if j == passes-1:
-                    data[-4]=ord("F")
-                else:
-                    data[-4]=ord("@")
-            timestamp=0   
-            for i in range(istart,len_data):
-                if cnt > 31:
-                    packet[-1] = self.OneWireCRC(packet[1:len(packet)-2])
-                    stamp=int(3*time()) #update every 1/3 of a second
-                    if not preprocess_crc:
-                        self.send_packet_w_error_checking(packet,update_gui,stop_calc)
-                        if (stamp != timestamp):
-                            timestamp=stamp #interlock
-                            update_gui("Sending Data to Laser = %.1f%%" %(100.0*float(i)/float(len_data)))
-                    else:
-                        packets.append(packet)
-                        if (stamp != timestamp):
-                            timestamp=stamp #interlock
-                            update_gui("Calculating CRC data and Generate Packets: %.1f%%" %(100.0*float(i)/float(len_data)))
-                    packet = blank[:]
-                    cnt = 2
-                    
-                    if stop_calc[0]==True:
-                        NoSleep.uninhibit()
-                        self.stop_sending_data()
-                        #raise Exception("Action Stopped by User.")
-                packet[cnt]=data[i]
-                cnt=cnt+1
-        packet[-1]=self.OneWireCRC(packet[1:len(packet)-2])
-        if not preprocess_crc:
-            self.send_packet_w_error_checking(packet,update_gui,stop_calc)
-            if cnt > 31:
-                self.send_packet_w_error_checking(blank,update_gui,stop_calc)
-            
-        else:
-            packets.append(packet)
-            if cnt > 31:
-                packets.append(blank[:])
-            update_gui("CRC data and Packets are Ready")
-        packet_cnt = 0
-
-        for line in packets:
-            update_gui()
-            self.send_packet_w_error_checking(line,update_gui,stop_calc)
-            packet_cnt = packet_cnt+1.0
-            update_gui( "Sending Data to Laser = %.1f%%" %( 100.0*packet_cnt/len(packets) ) )
+        if passes > 1:
+            len_data = len_data + (passes-1)*(len(data)-1)
+        n_packets = max( (len_data+29)//30, 1)
+        if len_data > 0 and len_data % 30 == 0:
+            n_packets = n_packets+1
+
+        def lines():
+            for packets in self.pass_packets(data,passes,block=preprocess_crc,max_block=max_block):
+                for i in range(0,len(packets),34):
+                    yield packets[i:i+34]
+
+        sender = self.send_packets(lines(),update_gui,stop_calc,
+                                   lambda n: "Sending Data to Laser = %.1f%%" %( 100.0*n/n_packets ))
         ##############################################################
         if wait_for_laser:
             self.wait_for_laser_to_finish(update_gui,stop_calc)
+        self.laser_time = self.sending_time(sender)
         NoSleep.uninhibit()
 
+    def send_data_stream(self,stream,update_gui=None,stop_calc=None,wait_for_laser=False):
+        # Send data from an EGV_STREAM while it is still being generated.
+        # The packets (including the CRC) are built in blocks by the
+        # stream's producer thread ahead of being sent.
+        if stop_calc == None:
+            stop_calc=[]
+            stop_calc.append(0)
+        if update_gui == None:
+            update_gui = self.none_function
+
+        NoSleep = WindowsInhibitor()
+        NoSleep.inhibit()
+        try:
+            stream.start(framer=self.frame_packets, chunk_size=30*32, idle=update_gui, packet_size=30)
+            packet_cnt = [0]
+            def lines():
+                for packets in stream:
+                    for i in range(0,len(packets),34):
+                        packet_cnt[0] = packet_cnt[0]+1
+                        yield packets[i:i+34]
+            try:
+                sender = self.send_packets(lines(),update_gui,stop_calc,
+                                           lambda n: "Sending Data to Laser: %d Packets Sent" %(n))
+            except:
+                stream.cancel()
+                if stop_calc[0]==True:
+                    self.stop_sending_data()
+                if packet_cnt[0] > 0:
+                    # The laser has already received part of the job
+                    try:
+                        self.e_stop()
+                    except:
+                        pass
+                raise
+            ##############################################################
+            if wait_for_laser:
+                self.wait_for_laser_to_finish(update_gui,stop_calc)
+            self.laser_time = self.sending_time(sender)
+        finally:
+            NoSleep.uninhibit()
+
+    def sending_time(self,sender):
+        # Time from the first packet sent by sender until now without the
+        # time the sender waited for packets (while the data was still
+        # being generated).  The laser can still be working on the data in
+        # its buffer while the sender waits, so this is a little short
+        # when the data is generated slower than the laser runs.
+        if sender.start_time == None:
+            return 0.0
+        return max(time()-sender.start_time-sender.starved,0.0)
+
+
+    def send_packets(self,lines,update_gui,stop_calc,progress):
+        # Send the packets from lines using a PACKET_SENDER thread.  This
+        # runs in the GUI thread: it keeps the sender's queue full and
+        # passes the messages from the sender to update_gui().
+        # progress(n) returns the status message after n packets are sent.
+        # Returns the sender (when all of the packets were sent).
+        sender = PACKET_SENDER(self)
+        sender.start()
+        timestamp=0
+        gui_time =0
+        try:
+            lines = iter(lines)
+            line  = next(lines,None)
+            finished = False
+            while sender.is_alive():
+                if not finished:
+                    # line == None tells the sender there are no more packets
+                    if sender.put(line):
+                        if line is None:
+                            finished = True
+                        else:
+                            line = next(lines,None)
+                else:
+                    sender.wait()
+                for msg,bgcolor,error_msg in sender.get_messages():
+                    gui_active = update_gui(msg,bgcolor=bgcolor)
+                    if error_msg != None and not gui_active:
+                        raise Exception(error_msg)
+                if stop_calc[0]:
+                    sender.stop()
+                    self.stop_sending_data()
+                t = time()
+                stamp=int(3*t) #update every 1/3 of a second
+                if (stamp != timestamp):
+                    timestamp=stamp #interlock
+                    update_gui( progress(sender.n_sent) )
+                elif t-gui_time > 0.05:
+                    update_gui()
+                    gui_time = t
+            if sender.error != None:
+                raise sender.error
+        finally:
+            sender.stop()
+        return sender
 
     def send_packet_w_error_checking(self,line,update_gui=None,stop_calc=None):
         timeout_cnt = 1
@@ -331,8 +519,8 @@ class K40_CLASS:
         
     def rapid_move(self,dxmils,dymils):
         if (dxmils!=0 or dymils!=0):
-            data=[]
-            egv_inst = egv(target=lambda s:data.append(s))
+            data=bytearray()
+            egv_inst = egv(target=data)
             egv_inst.make_move_data(dxmils,dymils)
             self.send_data(data, wait_for_laser=False)
 
@@ -431,10 +619,253 @@ class K40_CLASS:
             dec_out.append(int(a,16))
         return dec_out
 
+
+##############################################################################
+#  PACKET_SENDER writes the packets to the laser from a background thread.  #
+#  The packets are passed in through a bounded queue.  The status of the    #
+#  laser is read once after each packet is written (a CRC error resends    #
+#  that packet) and that status is used before the next packet, so the     #
+#  status is not read again before each write.  When the status is         #
+#  BUFFER_FULL the sender backs off before asking again.  Messages for the #
+#  GUI are passed back through a second queue (the thread does not touch   #
+#  the GUI).                                                                #
+##############################################################################
+class PACKET_SENDER:
+    def __init__(self, k40, max_packets=256):
+        self.k40       = k40
+        self.packets   = queue.Queue(maxsize=max_packets)
+        self.messages  = queue.Queue()
+        self.thread    = None
+        self.stopped   = False
+        self.error     = None
+        self.n_sent    = 0
+        self.status    = None
+        self.start_time = None # time the first packet was sent
+        self.starved    = 0.0  # time waiting for packets after that
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def is_alive(self):
+        return self.thread.is_alive()
+
+    def put(self, line, timeout=0.05):
+        # Returns False if the queue stayed full for timeout seconds
+        try:
+            self.packets.put(line, timeout=timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def wait(self, timeout=0.05):
+        self.thread.join(timeout)
+
+    def stop(self):
+        self.stopped = True
+        if self.thread != None:
+            while self.thread.is_alive():
+                self.thread.join(0.1)
+
+    def get_messages(self):
+        msgs = []
+        try:
+            while True:
+                msgs.append(self.messages.get_nowait())
+        except queue.Empty:
+            pass
+        return msgs
+
+    def message(self, msg, bgcolor, error_msg=None):
+        # error_msg is raised by send_packets() if the GUI is not active
+        self.messages.put((msg,bgcolor,error_msg))
+
+    ##########################################################################
+    def run(self):
+        try:
+            self.status = self.k40.say_hello()
+            while not self.stopped:
+                t0 = time()
+                try:
+                    line = self.packets.get(timeout=0.1)
+                except queue.Empty:
+                    line = False
+                if self.start_time != None:
+                    self.starved = self.starved+time()-t0
+                if line is False:
+                    continue
+                if line is None:
+                    break
+                if self.start_time == None:
+                    self.start_time = time()
+                self.send(line)
+                self.n_sent = self.n_sent+1
+        except Exception as e:
+            self.error = e
+
+    def check_stopped(self):
+        if self.stopped:
+            raise Exception("Action Stopped by User.")
+
+    def send(self, line):
+        # Same error handling as K40_CLASS.send_packet_w_error_checking()
+        k40 = self.k40
+        timeout_cnt = 1
+        crc_cnt     = 1
+        while True:
+            self.check_stopped()
+            if self.status == k40.BUFFER_FULL:
+                delay = 0.001
+                self.status = k40.say_hello()
+                while self.status == k40.BUFFER_FULL:
+                    self.check_stopped()
+                    sleep(delay)
+                    delay = min(delay*2,0.02)
+                    self.status = k40.say_hello()
+            try:
+                k40.send_packet(line)
+            except:
+                self.status = None
+                timeout_cnt=timeout_cnt+1
+                if timeout_cnt < k40.n_timeouts:
+                    msg = "USB Timeout #%d" %(timeout_cnt)
+                    self.message(msg,'yellow')
+                else:
+                    msg = "The laser cutter is not responding (%d attempts). Press stop to stop trying!"  %(timeout_cnt)
+                    self.message(msg,'red',"The laser cutter is not responding after %d attempts." %(timeout_cnt))
+
+                if timeout_cnt > 20:
+                   # try reconnect to laser
+                   try:
+                       k40.initialize_device(k40.USB_Location)
+                   except:
+                       pass
+                continue
+            ######################################
+            # the status of the packet that was just written
+            self.status = k40.say_hello()
+
+            if self.status == k40.CRC_ERROR:
+                crc_cnt=crc_cnt+1
+                if crc_cnt < k40.n_timeouts:
+                    msg = "Data transmission (CRC) error #%d" %(crc_cnt)
+                    self.message(msg,'yellow')
+                else:
+                    msg = "There are many data transmission errors (%d). Press stop to stop trying!"  %(crc_cnt)
+                    self.message(msg,'red',"There are many data transmission errors (%d)."  %(crc_cnt))
+                continue
+            # OK, BUFFER_FULL (backs off before the next packet) or no status
+            break
+
+
 if __name__ == "__main__":
     k40=K40_CLASS()
     run_laser = False
 
+    if "--benchmark" in sys.argv:
+        # Compare the bit by bit CRC packet framing with frame_packets()
+        data = [ord("B"),ord("a")]*150000
+        blank = k40.blank
+        t0=time()
+        packets = []
+        for i in range(0,len(data),30):
+            packet = blank[:]
+            packet[2:32] = data[i:i+30]
+            packet[-1] = k40.OneWireCRC_bitwise(packet[1:len(packet)-2])
+            packets.append(packet)
+        t_old = time()-t0
+        t0=time()
+        packets_new = k40.frame_packets(data)
+        t_new = time()-t0
+        n_packets = len(packets)
+        print("bit by bit CRC : %10.0f packets/s" %(n_packets/t_old))
+        print("frame_packets  : %10.0f packets/s" %(n_packets/t_new))
+        print("identical      :",[bytes(p) for p in packets]==[packets_new[i*34:i*34+34].tobytes() for i in range(n_packets)])
+
+        # Packets of a job sent 10 times, joined passes compared with the
+        # passes framed as they are sent (the packets of a pass are used
+        # again when the passes line up with the packets)
+        import tracemalloc
+        for n,name in ((150000,"join_passes"),(150000,"pass_packets"),(149998,"pass_packets")):
+            data = bytearray([ord("I")]+[ord("B"),ord("a")]*n+[ord("F")]*4)
+            tracemalloc.start()
+            t0=time()
+            if name == "join_passes":
+                n_bytes = len(k40.frame_packets(k40.join_passes(data,10)))
+            else:
+                n_bytes = 0
+                for packets in k40.pass_packets(data,10):
+                    n_bytes = n_bytes+len(packets)
+            t = time()-t0
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print("%-15s: %6.2f s  peak memory %6.1f MB  (%d bytes/pass, %d packets)" \
+                  %(name,t,peak/1e6,len(data),n_bytes//34))
+
+        # Send packets to a simulated laser (each USB transfer takes 0.25 ms,
+        # the laser runs 3000 packets/s and holds 64 packets).  The GUI
+        # update takes 0.5 ms.
+        class SIMULATED_LASER:
+            def __init__(self):
+                self.buffer = 0.0
+                self.t_last = time()
+                self.status = k40.OK
+                self.received = []
+                self.crc_errors = 0
+                self.overflows  = 0
+            def drain(self):
+                t = time()
+                self.buffer = max(self.buffer-(t-self.t_last)*3000,0)
+                self.t_last = t
+            def write(self,addr,line,timeout):
+                sleep(0.00025)
+                self.drain()
+                if len(line) == 1:
+                    return
+                if self.buffer >= 64:
+                    # the packet is lost
+                    self.overflows = self.overflows+1
+                    return
+                if len(self.received)%500 == 7 and self.crc_errors < len(self.received)//500+1:
+                    self.status = k40.CRC_ERROR
+                    self.crc_errors = self.crc_errors+1
+                    return
+                self.buffer = self.buffer+1
+                self.received.append(bytes(line))
+                self.status = k40.OK
+            def read(self,addr,length,timeout):
+                sleep(0.00025)
+                self.drain()
+                if self.status != k40.CRC_ERROR:
+                    if self.buffer >= 64:
+                        self.status = k40.BUFFER_FULL
+                    else:
+                        self.status = k40.OK
+                return [255,self.status]
+
+        def update_gui(msg=None,bgcolor=None):
+            sleep(0.0005)
+            return True
+        data = [ord("B"),ord("a")]*30000
+        packets = k40.frame_packets(data)
+        n_packets = len(packets)//34
+        expected = [packets[i*34:i*34+34].tobytes() for i in range(n_packets)]
+        for name in ("synchronous","sender thread"):
+            k40.dev = SIMULATED_LASER()
+            t0=time()
+            if name == "synchronous":
+                for k in range(n_packets):
+                    update_gui()
+                    k40.send_packet_w_error_checking(packets[k*34:k*34+34],update_gui,[0])
+            else:
+                k40.send_data(data,update_gui,[0])
+            rate = n_packets/(time()-t0)
+            print("%-15s: %10.0f packets/s  (%d CRC errors, %d packets lost in a full buffer, all packets received = %s)" \
+                  %(name,rate,k40.dev.crc_errors,k40.dev.overflows,k40.dev.received==expected))
+        k40.dev = None
+        sys.exit()
+
     try:
         USB_LOCATION=k40.initialize_device(verbose=False)
         
@@ -0,0 +1,629 @@
+#!/usr/bin/env python
+"""
+    This script orders the loops of a vector path to reduce the rapid moves
+
+    Copyright (C) <2017-2023>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from math import *
+from time import time
+
+##############################################################################
+# LoopGrid is a uniform grid of the loop end points that supports removing  #
+# loops.  nearest() returns the same loop end as a linear search over the   #
+# remaining loops (lowest loop number wins a tie, beginnings win a tie with  #
+# ends).                                                                   #
+##############################################################################
+class LoopGrid:
+    def __init__(self,bx,by,ex,ey,loops):
+        self.bx = bx
+        self.by = by
+        self.ex = ex
+        self.ey = ey
+        # Entries are (x,y,code) with code=loop for loop beginnings and
+        # code=n_total+loop for loop ends, so the smallest (dist,code) is
+        # the loop end the linear search would pick.
+        self.n_total = len(bx)
+        self.build(loops)
+
+    def build(self,loops):
+        bx,by,ex,ey = self.bx,self.by,self.ex,self.ey
+        self.n_loops = len(loops)
+        self.n_built = len(loops)
+        if loops == []:
+            xmin = xmax = ymin = ymax = 0.0
+        else:
+            xb = [bx[i] for i in loops]
+            yb = [by[i] for i in loops]
+            xe = [ex[i] for i in loops]
+            ye = [ey[i] for i in loops]
+            xmin = min(min(xb),min(xe))
+            xmax = max(max(xb),max(xe))
+            ymin = min(min(yb),min(ye))
+            ymax = max(max(yb),max(ye))
+        self.xmin = xmin
+        self.ymin = ymin
+        w = xmax-xmin
+        h = ymax-ymin
+        # about one loop per cell
+        n = max(len(loops),1)
+        if w > 0 and h > 0:
+            cs = sqrt(w*h/n)
+        else:
+            cs = max(w,h)/n
+        if cs <= 0:
+            cs = 1.0
+        self.cs = cs
+        self.nx = int(w/cs)+1
+        self.ny = int(h/cs)+1
+        # The grid has a border of empty cells so the 3x3 block around any
+        # cell can be searched without bounds checks.
+        NY = self.ny+2
+        cells = self.cells = [[] for i in range((self.nx+2)*NY)]
+        if loops == []:
+            self.kb = {}
+            self.ke = {}
+            return
+        n_total = self.n_total
+        keys_b = [(int((x-xmin)/cs)+1)*NY + int((y-ymin)/cs)+1 for x,y in zip(xb,yb)]
+        keys_e = [(int((x-xmin)/cs)+1)*NY + int((y-ymin)/cs)+1 for x,y in zip(xe,ye)]
+        for k,entry in zip(keys_b,zip(xb,yb,loops)):
+            cells[k].append(entry)
+        for k,entry in zip(keys_e,zip(xe,ye,[n_total+i for i in loops])):
+            cells[k].append(entry)
+        # cell of the beginning and end of each remaining loop
+        self.kb = dict(zip(loops,keys_b))
+        self.ke = dict(zip(loops,keys_e))
+
+    def remove(self,i):
+        cell = self.cells[self.kb.pop(i)]
+        for k in range(len(cell)):
+            if cell[k][2] == i:
+                del cell[k]
+                break
+        cell = self.cells[self.ke.pop(i)]
+        code = self.n_total+i
+        for k in range(len(cell)):
+            if cell[k][2] == code:
+                del cell[k]
+                break
+        self.n_loops = self.n_loops-1
+        # Rebuild a smaller grid when most of the loops are gone so the
+        # searches do not have to walk through lots of empty cells.
+        if self.n_loops > 0 and self.n_loops*4 < self.n_built:
+            self.build(sorted(self.kb))
+
+    def nearest(self,x,y):
+        # Returns (loop,use_end) of the closest loop end
+        cells = self.cells
+        nx,ny,cs = self.nx,self.ny,self.cs
+        NY = ny+2
+        fx = (x-self.xmin)/cs
+        fy = (y-self.ymin)/cs
+        cx = int(floor(fx))
+        cy = int(floor(fy))
+        # distance (in cells) from the point to the edge of its cell
+        edge = min(fx-cx,cx+1-fx,fy-cy,cy+1-fy)-1e-9
+        best = 1e300
+        best_code = -1
+        r = 0
+        if 0 <= cx < nx and 0 <= cy < ny:
+            k = (cx+1)*NY+cy+1
+            blocks = ((k,),
+                      (k-NY-1,k-NY,k-NY+1,k-1,k+1,k+NY-1,k+NY,k+NY+1))
+        else:
+            blocks = ()
+        for block in blocks:
+            if r > 0:
+                lb = max(r-1+edge,0)*cs
+                if best < lb*lb:
+                    break
+            for kk in block:
+                for px,py,code in cells[kk]:
+                    dx = x - px
+                    dy = y - py
+                    dist = dx*dx + dy*dy
+                    if dist < best or (dist == best and code < best_code):
+                        best = dist
+                        best_code = code
+            r = r+1
+
+        # search the rest of the grid one ring of cells at a time
+        r_max = max(cx,nx-1-cx,cy,ny-1-cy)
+        while r <= r_max:
+            if r > 0:
+                # every point in ring r is at least this far away
+                lb = max(r-1+edge,0)*cs
+                if best < lb*lb:
+                    break
+            ring = [(i,cy-r) for i in range(cx-r,cx+r+1)] + \
+                   [(i,cy+r) for i in range(cx-r,cx+r+1)] + \
+                   [(cx-r,j) for j in range(cy-r+1,cy+r)] + \
+                   [(cx+r,j) for j in range(cy-r+1,cy+r)]
+            if r == 0:
+                ring = ring[:1]
+            for i,j in ring:
+                if i < 0 or j < 0 or i >= nx or j >= ny:
+                    continue
+                for px,py,code in cells[(i+1)*NY+j+1]:
+                    dx = x - px
+                    dy = y - py
+                    dist = dx*dx + dy*dy
+                    if dist < best or (dist == best and code < best_code):
+                        best = dist
+                        best_code = code
+            r = r+1
+        if best_code >= self.n_total:
+            return best_code-self.n_total,True
+        return best_code,False
+
+
+##############################################################################
+class PathOrder:
+    def __init__(self):
+        pass
+
+    def loop_ends(self,ecoords,i_loop=2):
+        ##########################
+        ###   find loop ends   ###
+        ##########################
+        Lbeg=[]
+        Lend=[]
+        if len(ecoords)>0:
+            Lbeg.append(0)
+            loop_old=ecoords[0][i_loop]
+            for i in range(1,len(ecoords)):
+                loop = ecoords[i][i_loop]
+                if loop != loop_old:
+                    Lbeg.append(i)
+                    Lend.append(i-1)
+                loop_old=loop
+            Lend.append(len(ecoords)-1)
+        return Lbeg,Lend
+
+    #######################################################################
+    # Greedy nearest neighbour ordering of the loops.  Returns a list of
+    # [first index,last index] pairs (reversed loops have first > last).
+    #######################################################################
+    def sort_paths(self,ecoords,i_loop=2):
+        Lbeg,Lend = self.loop_ends(ecoords,i_loop)
+        order_out = []
+        if Lbeg == []:
+            return order_out
+        bx = [ecoords[i][0] for i in Lbeg]
+        by = [ecoords[i][1] for i in Lbeg]
+        ex = [ecoords[i][0] for i in Lend]
+        ey = [ecoords[i][1] for i in Lend]
+        total = len(Lbeg)
+        grid = LoopGrid(bx,by,ex,ey,list(range(total)))
+
+        order_out.append([Lbeg[0],Lend[0]])
+        inext = 0
+        use_end = False
+        for i in range(total-1):
+            grid.remove(inext)
+            if use_end:
+                Xcur,Ycur = bx[inext],by[inext]
+            else:
+                Xcur,Ycur = ex[inext],ey[inext]
+            inext,use_end = grid.nearest(Xcur,Ycur)
+            if use_end:
+                order_out.append([Lend[inext],Lbeg[inext]])
+            else:
+                order_out.append([Lbeg[inext],Lend[inext]])
+        return order_out
+
+    #######################################################################
+    # Original linear search version of sort_paths() (used for testing)
+    #######################################################################
+    def sort_paths_linear(self,ecoords,i_loop=2):
+        Lbeg,Lend = self.loop_ends(ecoords,i_loop)
+
+        #######################################################
+        # Find new order based on distance to next beg or end #
+        #######################################################
+        order_out = []
+        use_beg=0
+        if len(ecoords)>0:
+            order_out.append([Lbeg[0],Lend[0]])
+        inext = 0
+        total=len(Lbeg)
+        for i in range(total-1):
+            if use_beg==1:
+                ii=Lbeg.pop(inext)
+                Lend.pop(inext)
+            else:
+                ii=Lend.pop(inext)
+                Lbeg.pop(inext)
+
+            Xcur = ecoords[ii][0]
+            Ycur = ecoords[ii][1]
+
+            dx = Xcur - ecoords[ Lbeg[0] ][0]
+            dy = Ycur - ecoords[ Lbeg[0] ][1]
+            min_dist = dx*dx + dy*dy
+
+            dxe = Xcur - ecoords[ Lend[0] ][0]
+            dye = Ycur - ecoords[ Lend[0] ][1]
+            min_diste = dxe*dxe + dye*dye
+
+            inext=0
+            inexte=0
+            for j in range(1,len(Lbeg)):
+                dx = Xcur - ecoords[ Lbeg[j] ][0]
+                dy = Ycur - ecoords[ Lbeg[j] ][1]
+                dist = dx*dx + dy*dy
+                if dist < min_dist:
+                    min_dist=dist
+                    inext=j
+                ###
+                dxe = Xcur - ecoords[ Lend[j] ][0]
+                dye = Ycur - ecoords[ Lend[j] ][1]
+                diste = dxe*dxe + dye*dye
+                if diste < min_diste:
+                    min_diste=diste
+                    inexte=j
+                ###
+            if min_diste < min_dist:
+                inext=inexte
+                order_out.append([Lend[inexte],Lbeg[inexte]])
+                use_beg=1
+            else:
+                order_out.append([Lbeg[inext],Lend[inext]])
+                use_beg=0
+        ###########################################################
+        return order_out
+
+
+    #######################################################################
+    # Improve an ordering of cuts with 2-opt (segment reversal) and
+    # Or-opt (moving chains of one to three cuts, optionally reversed)
+    # moves to reduce the total rapid move distance between cuts.
+    #
+    # cuts   : list of cuts, each a list of [x,y] points
+    # order  : list of cut numbers in the order they will be cut
+    # before : before[i] is a list of cuts that must be cut before cut i
+    #          (the inside loops of cut i) or None for no constraints
+    #
+    # Returns (order,reverse,rapid_in,rapid_out) where reverse[i] is True
+    # if cut i should be cut in the reverse direction and rapid_in and
+    # rapid_out are the total rapid distances before and after.
+    #######################################################################
+    def optimize_order(self,cuts,order,before=None,time_limit=1.0,n_near=8):
+        t_end = time()+time_limit
+        n = len(order)
+        order_in = list(order)
+        order   = list(order)
+        reverse = [False]*len(cuts)
+        SX = [cut[ 0][0] for cut in cuts]
+        SY = [cut[ 0][1] for cut in cuts]
+        EX = [cut[-1][0] for cut in cuts]
+        EY = [cut[-1][1] for cut in cuts]
+        rapid_in = self.rapid_distance(cuts,order,reverse)
+        if n < 3 or time_limit <= 0:
+            return order,reverse,rapid_in,rapid_in
+
+        if before == None:
+            before = [[] for i in range(len(cuts))]
+        after = [[] for i in range(len(cuts))]
+        for i in range(len(cuts)):
+            for j in before[i]:
+                after[j].append(i)
+
+        pos = [0]*len(cuts)
+        for k in range(n):
+            pos[order[k]] = k
+        near = self.near_cuts(SX,SY,EX,EY,order,n_near)
+
+        def start(c):
+            if reverse[c]:
+                return EX[c],EY[c]
+            return SX[c],SY[c]
+
+        def end(c):
+            if reverse[c]:
+                return SX[c],SY[c]
+            return EX[c],EY[c]
+
+        def dist(p1,p2):
+            return sqrt((p1[0]-p2[0])**2 + (p1[1]-p2[1])**2)
+
+        def can_reverse(i,j):
+            # no cut in order[i..j] may be required to come before another
+            for k in range(i,j+1):
+                for c in before[order[k]]:
+                    if i <= pos[c] <= j:
+                        return False
+            return True
+
+        def can_move(i,j,t):
+            # can order[i..j] be moved in front of position t
+            if t > j:
+                for k in range(i,j+1):
+                    for c in after[order[k]]:
+                        if j < pos[c] < t:
+                            return False
+            else:
+                for k in range(i,j+1):
+                    for c in before[order[k]]:
+                        if t <= pos[c] < i:
+                            return False
+            return True
+
+        def do_reverse(i,j):
+            seg = order[i:j+1]
+            seg.reverse()
+            order[i:j+1] = seg
+            for k in range(i,j+1):
+                c = order[k]
+                pos[c] = k
+                reverse[c] = not reverse[c]
+
+        def do_move(i,j,t,flip):
+            chain = order[i:j+1]
+            if flip:
+                chain.reverse()
+                for c in chain:
+                    reverse[c] = not reverse[c]
+            del order[i:j+1]
+            if t > j:
+                t = t-len(chain)
+            order[t:t] = chain
+            for k in range(min(i,t),max(j+1,t+len(chain))):
+                pos[order[k]] = k
+
+        eps = 1e-9
+        improved = True
+        while improved and time() < t_end:
+            improved = False
+            ##################
+            #  2-opt moves   #
+            ##################
+            for i in range(1,n):
+                if time() > t_end:
+                    break
+                a = order[i-1]
+                b = order[i]
+                A = end(a)
+                B = start(b)
+                d_ab = dist(A,B)
+                for c in near[a]:
+                    j = pos[c]
+                    if j > i:
+                        # reverse order[i..j]
+                        delta = dist(A,end(c)) - d_ab
+                        if j+1 < n:
+                            S_next = start(order[j+1])
+                            delta = delta + dist(B,S_next) - dist(end(c),S_next)
+                        if delta < -eps and can_reverse(i,j):
+                            do_reverse(i,j)
+                            improved = True
+                            break
+                    elif j < i-1:
+                        # reverse order[j+1..i-1]
+                        S_first = start(order[j+1])
+                        delta = dist(end(c),A) + dist(S_first,B) \
+                                - dist(end(c),S_first) - d_ab
+                        if delta < -eps and can_reverse(j+1,i-1):
+                            do_reverse(j+1,i-1)
+                            improved = True
+                            break
+                else:
+                    # reverse the beginning or the end of the order
+                    if dist(start(order[0]),B) - d_ab < -eps and can_reverse(0,i-1):
+                        do_reverse(0,i-1)
+                        improved = True
+                    elif dist(A,end(order[n-1])) - d_ab < -eps and can_reverse(i,n-1):
+                        do_reverse(i,n-1)
+                        improved = True
+
+            ##################
+            #  Or-opt moves  #
+            ##################
+            for L in (1,2,3):
+                i = 0
+                while i+L <= n:
+                    if time() > t_end:
+                        break
+                    j = i+L-1
+                    S_chain = start(order[i])
+                    E_chain = end(order[j])
+                    gain = 0.0
+                    if i > 0:
+                        gain = gain + dist(end(order[i-1]),S_chain)
+                    if j+1 < n:
+                        gain = gain + dist(E_chain,start(order[j+1]))
+                    if i > 0 and j+1 < n:
+                        gain = gain - dist(end(order[i-1]),start(order[j+1]))
+                    best = None
+                    candidates = set()
+                    for c in near[order[i]]+near[order[j]]:
+                        k = pos[c]
+                        candidates.add(k)
+                        candidates.add(k+1)
+                    for t in candidates:
+                        # insert in front of position t
+                        if i <= t <= j+1:
+                            continue
+                        P = None
+                        Q = None
+                        if t > 0:
+                            P = end(order[t-1])
+                        if t < n:
+                            Q = start(order[t])
+                        for flip in (False,True):
+                            if flip:
+                                S1,E1 = E_chain,S_chain
+                            else:
+                                S1,E1 = S_chain,E_chain
+                            add = 0.0
+                            if P != None:
+                                add = add + dist(P,S1)
+                            if Q != None:
+                                add = add + dist(E1,Q)
+                            if P != None and Q != None:
+                                add = add - dist(P,Q)
+                            delta = add-gain
+                            if delta < -eps and (best == None or delta < best[0]):
+                                best = (delta,t,flip)
+                    if best != None:
+                        delta,t,flip = best
+                        if (not flip or can_reverse(i,j)) and can_move(i,j,t):
+                            do_move(i,j,t,flip)
+                            improved = True
+                    i = i+1
+
+        rapid_out = self.rapid_distance(cuts,order,reverse)
+        if rapid_out > rapid_in:
+            # never return a worse order
+            return order_in,[False]*len(cuts),rapid_in,rapid_in
+        return order,reverse,rapid_in,rapid_out
+
+    def rapid_distance(self,cuts,order,reverse):
+        # Total length of the rapid moves between the cuts
+        total = 0.0
+        last = None
+        for c in order:
+            if reverse[c]:
+                first,next_last = cuts[c][-1],cuts[c][0]
+            else:
+                first,next_last = cuts[c][0],cuts[c][-1]
+            if last != None:
+                total = total + sqrt((first[0]-last[0])**2 + (first[1]-last[1])**2)
+            last = next_last
+        return total
+
+    def near_cuts(self,SX,SY,EX,EY,cut_list,n_near):
+        # Returns a list of (up to) n_near cuts close to each cut.  The
+        # ends of the cuts are put in a uniform grid and the search is
+        # expanded one ring of cells at a time until enough cuts are found.
+        near = [[] for i in range(len(SX))]
+        n = len(cut_list)
+        if n < 2:
+            return near
+        xs = [SX[c] for c in cut_list]+[EX[c] for c in cut_list]
+        ys = [SY[c] for c in cut_list]+[EY[c] for c in cut_list]
+        xmin = min(xs)
+        ymin = min(ys)
+        w = max(xs)-xmin
+        h = max(ys)-ymin
+        if w > 0 and h > 0:
+            cs = sqrt(w*h*n_near/(2.0*n))
+        else:
+            cs = max(w,h)*n_near/(2.0*n)
+        if cs <= 0:
+            cs = 1.0
+        nx = int(w/cs)+1
+        ny = int(h/cs)+1
+        cells = {}
+        for c in cut_list:
+            for x,y in ((SX[c],SY[c]),(EX[c],EY[c])):
+                key = (int((x-xmin)/cs),int((y-ymin)/cs))
+                cells.setdefault(key,[]).append(c)
+
+        for c in cut_list:
+            found = set()
+            r = 1
+            while True:
+                for x,y in ((SX[c],SY[c]),(EX[c],EY[c])):
+                    cx = int((x-xmin)/cs)
+                    cy = int((y-ymin)/cs)
+                    for i in range(cx-r,cx+r+1):
+                        for j in range(cy-r,cy+r+1):
+                            if i == cx-r or i == cx+r or j == cy-r or j == cy+r or r == 1:
+                                found.update(cells.get((i,j),()))
+                found.discard(c)
+                if len(found) >= n_near or r > max(nx,ny):
+                    break
+                r = r+1
+            def cut_dist(k):
+                return min((SX[c]-SX[k])**2 + (SY[c]-SY[k])**2,
+                           (SX[c]-EX[k])**2 + (SY[c]-EY[k])**2,
+                           (EX[c]-SX[k])**2 + (EY[c]-SY[k])**2,
+                           (EX[c]-EX[k])**2 + (EY[c]-EY[k])**2)
+            near[c] = sorted(found,key=cut_dist)[:n_near]
+        return near
+
+if __name__ == "__main__":
+    # Benchmark loop count versus sort time
+    import random
+
+    def test_loops(n_loops,seed=0):
+        # Small square loops scattered over a 20x12 inch bed
+        random.seed(seed)
+        ecoords = []
+        for loop in range(n_loops):
+            x = random.random()*20.0
+            y = random.random()*12.0
+            s = 0.01+random.random()*0.05
+            for px,py in ((x,y),(x+s,y),(x+s,y+s),(x,y+s),(x,y)):
+                ecoords.append([px,py,loop])
+        return ecoords
+
+    sorter = PathOrder()
+    print("   loops   linear (s)   grid (s)  identical")
+    for n_loops in (1000,5000,10000,20000,50000,100000,200000):
+        ecoords = test_loops(n_loops)
+        t0 = time()
+        order = sorter.sort_paths(ecoords)
+        t_grid = time()-t0
+        if n_loops <= 5000:
+            t0 = time()
+            order_linear = sorter.sort_paths_linear(ecoords)
+            t_linear = time()-t0
+            print("%8d %12.3f %10.3f  %s" %(n_loops,t_linear,t_grid,order==order_linear))
+        else:
+            print("%8d %12s %10.3f" %(n_loops,"-",t_grid))
+
+    # Rapid move reduction of optimize_order() after the greedy sort.  Each
+    # part is an outer loop with a loop inside that has to be cut first.
+    print("")
+    print("   parts   greedy rapid   optimized rapid   reduction   time (s)")
+    for n_parts in (100,1000,5000):
+        random.seed(1)
+        cuts = []
+        before = []
+        for k in range(n_parts):
+            x = random.random()*20.0
+            y = random.random()*12.0
+            s = 0.05+random.random()*0.2
+            outer = [[x,y],[x+s,y],[x+s,y+s],[x,y+s],[x,y]]
+            inner = [[x+s/4,y+s/4],[x+s/2,y+s/4],[x+s/2,y+s/2],[x+s/4,y+s/4]]
+            cuts.append(inner)
+            before.append([])
+            cuts.append(outer)
+            before.append([len(cuts)-2])
+        ecoords = []
+        for i in range(len(cuts)):
+            for px,py in cuts[i]:
+                ecoords.append([px,py,i])
+        # greedy order with the inside loops moved in front of their parts
+        order = []
+        done = [False]*len(cuts)
+        for beg,end in sorter.sort_paths(ecoords):
+            i = ecoords[beg][2]
+            for j in before[i]+[i]:
+                if not done[j]:
+                    order.append(j)
+                    done[j] = True
+        t0 = time()
+        order,reverse,rapid_in,rapid_out = sorter.optimize_order(cuts,order,before,time_limit=10.0)
+        t_opt = time()-t0
+        for i in range(len(cuts)):
+            for j in before[i]:
+                assert order.index(j) < order.index(i)
+        print("%8d %14.2f %17.2f %10.1f%% %10.2f" %(n_parts,rapid_in,rapid_out,
+                                                    100.0*(rapid_in-rapid_out)/rapid_in,t_opt))
+    print("DONE")
@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+"""
+    This script keeps the canvas items of the preview so they do not need
+    to be created again every time the preview is refreshed
+
+    Copyright (C) <2017-2023>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from math import *
+from ecoords import ECoordArray
+
+NUMPY=True
+try:
+    import numpy
+except:
+    NUMPY = False
+
+#######################################################################
+# Level of detail.  Each zoom level is half an octave of the canvas
+# scale s (pixels per unit).  The paths are simplified with a tolerance
+# of half a pixel at the smallest scale of the level.
+#######################################################################
+def lod_level(s):
+    return int(floor(2*log(s,2)))
+
+def lod_tolerance(level):
+    return 0.5/(2.0**(level/2.0))
+
+#######################################################################
+# Douglas-Peucker simplification of one polyline.  Returns the indexes
+# of the points that are kept (always includes the first and last).
+#######################################################################
+def douglas_peucker(px,py,tol):
+    n = len(px)
+    if n < 3:
+        return list(range(n))
+    keep = [False]*n
+    keep[0] = keep[n-1] = True
+    tol2 = tol*tol
+    use_numpy = NUMPY and n > 200
+    if use_numpy:
+        PX = numpy.array(px)
+        PY = numpy.array(py)
+    stack = [(0,n-1)]
+    while stack != []:
+        i,j = stack.pop()
+        if j-i < 2:
+            continue
+        x1,y1 = px[i],py[i]
+        dx = px[j]-x1
+        dy = py[j]-y1
+        d2 = dx*dx+dy*dy
+        if use_numpy and j-i > 200:
+            # distance from the segment i-j
+            vx = PX[i+1:j]-x1
+            vy = PY[i+1:j]-y1
+            if d2 > 0:
+                t = numpy.clip((vx*dx+vy*dy)/d2,0.0,1.0)
+                vx = vx-t*dx
+                vy = vy-t*dy
+            dist = vx*vx+vy*vy
+            k = int(numpy.argmax(dist))
+            dmax = dist[k]
+            k = k+i+1
+        else:
+            x2,y2 = px[j],py[j]
+            dmax = -1.0
+            k = i
+            for m in range(i+1,j):
+                vx = px[m]-x1
+                vy = py[m]-y1
+                dot = vx*dx+vy*dy
+                if dot <= 0:
+                    dist = vx*vx+vy*vy
+                elif dot >= d2:
+                    vx = px[m]-x2
+                    vy = py[m]-y2
+                    dist = vx*vx+vy*vy
+                else:
+                    c = vx*dy-vy*dx
+                    dist = c*c/d2
+                if dist > dmax:
+                    dmax = dist
+                    k = m
+        if dmax > tol2:
+            keep[k] = True
+            stack.append((i,k))
+            stack.append((k,j))
+    return [i for i in range(n) if keep[i]]
+
+#######################################################################
+# Simplify ecoords for drawing.  The plotted points are
+#     (x*xscale-x0, y*yscale-y0)
+# Each run of points with the same loop number is one polyline (same as
+# the segments drawn by the old Plot_Line loop).  Points that fall in
+# the same tol sized cell as the previous point are dropped, the rest
+# are simplified with douglas_peucker() and polylines that reduce to
+# two points in the same cells as an earlier polyline are skipped (so
+# many loops smaller than a pixel only draw once).
+# Returns a list of flat [x1,y1,x2,y2,...] lists.
+#######################################################################
+def simplify_loops(coords,xscale,yscale,x0,y0,tol):
+    if NUMPY:
+        return simplify_loops_numpy(coords,xscale,yscale,x0,y0,tol)
+    X = [c[0]*xscale-x0 for c in coords]
+    Y = [c[1]*yscale-y0 for c in coords]
+    L = [c[2] for c in coords]
+    polylines = []
+    seen = set()
+    n = len(X)
+    i0 = 0
+    while i0 < n:
+        i1 = i0+1
+        while i1 < n and L[i1] == L[i0]:
+            i1 = i1+1
+        if i1-i0 >= 2:
+            px = [X[i0]]
+            py = [Y[i0]]
+            cell = (floor(X[i0]/tol),floor(Y[i0]/tol))
+            cells = [cell]
+            for i in range(i0+1,i1):
+                c = (floor(X[i]/tol),floor(Y[i]/tol))
+                if c != cell or i == i1-1:
+                    px.append(X[i])
+                    py.append(Y[i])
+                    cells.append(c)
+                cell = c
+            if len(px) == 2:
+                key = (cells[0],cells[1])
+                if key in seen:
+                    i0 = i1
+                    continue
+                seen.add(key)
+            flat = []
+            for i in douglas_peucker(px,py,tol):
+                flat.append(px[i])
+                flat.append(py[i])
+            polylines.append(flat)
+        i0 = i1
+    return polylines
+
+def simplify_loops_numpy(coords,xscale,yscale,x0,y0,tol):
+    if isinstance(coords,ECoordArray):
+        x,y,L,feed = coords.numpy_arrays()
+    else:
+        x = numpy.array([c[0] for c in coords],dtype=numpy.float64)
+        y = numpy.array([c[1] for c in coords],dtype=numpy.float64)
+        L = numpy.array([c[2] for c in coords])
+    n = len(x)
+    if n < 2:
+        return []
+    X = x*xscale-x0
+    Y = y*yscale-y0
+    brk    = numpy.flatnonzero(L[1:] != L[:-1])+1
+    starts = numpy.concatenate(([0],brk))
+    ends   = numpy.concatenate((brk,[n]))
+
+    CX = numpy.floor(X/tol).astype(numpy.int64)
+    CY = numpy.floor(Y/tol).astype(numpy.int64)
+    keep = numpy.ones(n,dtype=bool)
+    keep[1:] = (CX[1:] != CX[:-1]) | (CY[1:] != CY[:-1])
+    keep[starts] = True
+    keep[ends-1] = True
+    idx = numpy.flatnonzero(keep)
+    # kept points of each run are idx[k0[r]:k1[r]]
+    k0 = numpy.searchsorted(idx,starts)
+    k1 = numpy.searchsorted(idx,ends)
+    cnt = k1-k0
+    runs = numpy.flatnonzero(ends-starts >= 2)
+
+    # two point polylines, skip the ones with the same cells as an earlier one
+    two = runs[cnt[runs] == 2]
+    if len(two) > 0:
+        a = starts[two]
+        b = ends[two]-1
+        cells = numpy.column_stack((CX[a],CY[a],CX[b],CY[b]))
+        first = numpy.unique(cells,axis=0,return_index=True)[1]
+        two = two[first]
+    runs = numpy.sort(numpy.concatenate((two,runs[cnt[runs] > 2])))
+
+    XK = X[idx].tolist()
+    YK = Y[idx].tolist()
+    k0 = k0.tolist()
+    k1 = k1.tolist()
+    polylines = []
+    for r in runs.tolist():
+        px = XK[k0[r]:k1[r]]
+        py = YK[k0[r]:k1[r]]
+        flat = []
+        if len(px) > 2:
+            for i in douglas_peucker(px,py,tol):
+                flat.append(px[i])
+                flat.append(py[i])
+        else:
+            flat = [px[0],py[0],px[1],py[1]]
+        polylines.append(flat)
+    return polylines
+
+
+##############################################################################
+# PreviewLayer holds the canvas items of one data set (all items have the   #
+# layer tag).  The items are drawn with the view transform                  #
+#     x_canvas = a + x*s      y_canvas = b - y*s                            #
+# When only the transform changes (within one zoom level) the existing     #
+# items are scaled and moved by the canvas.  The items are only created    #
+# again when the key (the data version and anything else that changes the  #
+# drawn coordinates) or the zoom level changes.  The simplified polylines  #
+# of each zoom level are cached until the key changes.                     #
+##############################################################################
+class PreviewLayer:
+    def __init__(self, canvas, tag, color, tags=()):
+        self.canvas    = canvas
+        self.tag       = tag
+        self.color     = color
+        self.tags      = tuple(tags)+(tag,)
+        self.key       = None
+        self.level     = None
+        self.transform = None
+        self.visible   = True
+        self.lod       = {}
+
+    def clear(self):
+        self.canvas.delete(self.tag)
+        self.key       = None
+        self.level     = None
+        self.transform = None
+        self.lod       = {}
+
+    def moved(self, dx, dy):
+        # The items were moved on the canvas by someone else (mouse pan)
+        if self.transform != None:
+            s,a,b = self.transform
+            self.transform = (s,a+dx,b+dy)
+
+    def polylines(self, level, get_data):
+        if level not in self.lod:
+            coords,xscale,yscale,x0,y0 = get_data()
+            self.lod[level] = simplify_loops(coords,xscale,yscale,x0,y0,lod_tolerance(level))
+        return self.lod[level]
+
+    def draw(self, polylines, s, a, b):
+        for flat in polylines:
+            xy = flat[:]
+            xy[0::2] = [a+x*s for x in flat[0::2]]
+            xy[1::2] = [b-y*s for y in flat[1::2]]
+            self.canvas.create_line(xy, fill=self.color, capstyle="round",
+                                    width = 0, tags=self.tags)
+
+    def update(self, key, transform, get_data, visible=True):
+        # get_data() returns (coords,xscale,yscale,x0,y0) and is only
+        # called when the polylines need to be made.  Returns True if the
+        # items were created again.
+        if not visible:
+            # Hidden layers are not drawn.  If the view changed the items
+            # are drawn again when the layer is shown.
+            if key != self.key:
+                self.clear()
+            elif self.visible:
+                self.canvas.itemconfigure(self.tag, state="hidden")
+            self.visible = False
+            if transform != self.transform:
+                self.transform = None
+            return False
+
+        if key != self.key:
+            self.lod = {}
+        s,a,b = transform
+        level = lod_level(s)
+        rebuilt = False
+        if key != self.key or level != self.level or self.transform == None:
+            self.canvas.delete(self.tag)
+            self.draw(self.polylines(level,get_data), s, a, b)
+            self.key   = key
+            self.level = level
+            self.visible = True
+            rebuilt = True
+        elif transform != self.transform:
+            s0,a0,b0 = self.transform
+            if s != s0:
+                # scale about (a0,b0) so that point stays put
+                self.canvas.scale(self.tag, a0, b0, s/s0, s/s0)
+            if a != a0 or b != b0:
+                self.canvas.move(self.tag, a-a0, b-b0)
+        self.transform = transform
+
+        if visible and not self.visible:
+            self.canvas.itemconfigure(self.tag, state="normal")
+            self.visible = True
+        return rebuilt
+
+
+if __name__ == "__main__":
+    # Number of canvas items and points needed to draw a design at
+    # different zoom levels (the old preview drew one item per segment)
+    import random
+    from time import time
+
+    random.seed(0)
+    coords = []
+    loop = 0
+    for k in range(20000):
+        loop = loop+1
+        cx = random.uniform(0,20)
+        cy = random.uniform(0,12)
+        r  = random.uniform(0.001,0.5)
+        m  = random.randint(3,100)
+        for j in range(m+1):
+            a = 2*pi*j/m
+            coords.append([cx+r*cos(a),cy+r*sin(a),loop])
+    print("%d points, %d segments" %(len(coords),len(coords)-loop))
+    for s in (20,80,320,1280):
+        level = lod_level(s)
+        t0 = time()
+        polylines = simplify_loops(coords,1,1,0,0,lod_tolerance(level))
+        npts = sum([len(flat) for flat in polylines])//2
+        print("%5d pixels/inch  %6d items %8d points  %7.3f s" %(s,len(polylines),npts,time()-t0))
+    print("DONE")
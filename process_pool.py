@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+"""
+    This script makes the pools of worker processes used to make raster
+    data on more than one core
+
+    Copyright (C) <2017-2023>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import sys
+from collections import deque
+
+POOL=True
+try:
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+except:
+    POOL = False
+
+in_worker = False # True in the worker processes (they do not make pools)
+
+def start_worker():
+    global in_worker
+    in_worker = True
+
+#######################################################################
+# The worker processes are forked.  A process started with "spawn"
+# (the only way on Windows) runs the main script again, and
+# k40_whisperer.py would open a second window, so there are no workers
+# where fork is not available.  There are no workers on macOS either:
+# fork is there but a forked copy of a process that has loaded Cocoa/Tk
+# (or numpy with Accelerate) can crash or hang, which is why Python
+# uses "spawn" there by default.
+#######################################################################
+def fork_context():
+    if not POOL or sys.platform == "darwin":
+        return None
+    try:
+        return multiprocessing.get_context("fork")
+    except:
+        return None
+
+def default_workers():
+    if fork_context() == None:
+        return 1
+    try:
+        return multiprocessing.cpu_count()
+    except:
+        return 1
+
+def process_pool(workers):
+    # Returns None when the work should be done in this process
+    context = fork_context()
+    if workers <= 1 or context == None or in_worker:
+        return None
+    try:
+        pool = ProcessPoolExecutor(workers,mp_context=context,initializer=start_worker)
+    except:
+        return None
+    pool.workers = workers
+    return pool
+
+def no_work(i):
+    return i
+
+def start_pool(workers):
+    # Makes a pool and starts its worker processes now, so they are forked
+    # from the calling thread (the main thread) and not from the thread
+    # that first gives the pool some work.  Forking copies only the thread
+    # that forks, and locks held by the other threads stay locked in the
+    # workers.
+    pool = process_pool(workers)
+    if pool != None:
+        for i in pool.map(no_work,range(workers)):
+            pass
+    return pool
+
+def stop_pool(pool, cancel=False):
+    # With cancel the tasks that have not started are dropped and the
+    # worker processes are stopped (they can not see stop_calc so they
+    # would finish the task they are doing on their own)
+    if cancel:
+        processes = getattr(pool,"_processes",None) or {}
+        for process in list(processes.values()):
+            try:
+                process.terminate()
+            except:
+                pass
+    try:
+        pool.shutdown(wait=not cancel, cancel_futures=cancel)
+    except TypeError:
+        # Python older than 3.9
+        pool.shutdown(wait=not cancel)
+
+##############################################################################
+# OrderedTasks runs tasks in a pool and returns the results in the order   #
+# the tasks were added.  At most max_pending tasks are waiting so the data #
+# of the tasks does not all need to be in memory at once.                  #
+##############################################################################
+class OrderedTasks:
+    def __init__(self,pool,max_pending):
+        self.pool        = pool
+        self.max_pending = max_pending
+        self.pending     = deque()
+
+    def add(self,function,*args):
+        # Returns the results of the tasks that are done (in order)
+        results = []
+        while len(self.pending) >= self.max_pending:
+            results.append(self.pending.popleft().result())
+        self.pending.append(self.pool.submit(function,*args))
+        while len(self.pending) > 0 and self.pending[0].done():
+            results.append(self.pending.popleft().result())
+        return results
+
+    def finish(self):
+        results = []
+        while len(self.pending) > 0:
+            results.append(self.pending.popleft().result())
+        return results
+
+    def cancel(self):
+        for future in self.pending:
+            future.cancel()
+        self.pending.clear()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""
+    This script prepares raster images for engraving and for the preview
+    and keeps the results of each step for the settings they were made with
+
+    Copyright (C) <2017-2023>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from PIL import Image
+
+NEGATE_MAP    = [255-v for v in range(256)]
+# steps that keep images of the full size of the raster
+FULL_SIZE_STEPS = ("oriented","scaled","bilevel","pyramid","preview")
+THRESHOLD_MAP = [0 if v<128 else 255 for v in range(256)]
+
+# Image.transpose() method for (mirror,rotate).  Mirroring and then
+# rotating 90 degrees is a transpose.
+TRANSPOSE = {(False,False): None,
+             (True, False): Image.FLIP_LEFT_RIGHT,
+             (False,True ): Image.ROTATE_90,
+             (True, True ): Image.TRANSPOSE}
+
+##############################################################################
+# RASTER_PIPELINE makes the images of the raster steps:                     #
+#     oriented()  grayscale image, negated, mirrored and rotated             #
+#     scaled()    oriented image scaled by the laser scale factors           #
+#     bilevel()   scaled image as a halftone or black and white ('1') image  #
+#     pyramid()   oriented image (black and white if not halftone) and     #
+#                 images of half the size of the one before it (built when  #
+#                 they are needed)                                          #
+#     preview()   pyramid image resized to the preview size                  #
+# Each step starts from the result of the step before it.  The last        #
+# max_entries results of each step are kept with the image and settings   #
+# they were made from, so changing a setting only redoes the steps that    #
+# depend on it and changing it back redoes nothing.  The results of an     #
+# image are dropped when a different image is used.                        #
+##############################################################################
+class RASTER_PIPELINE:
+    def __init__(self, max_entries=2):
+        self.max_entries = max_entries
+        self.clear()
+
+    def clear(self):
+        self.cache = {} # {step:[(image,key,result),...]} most recent last
+
+    def drop(self, steps):
+        # Drops the results of steps (a list of step names)
+        for step in steps:
+            self.cache.pop(step,None)
+
+    def cached(self, step, image, key, make):
+        entries = [e for e in self.cache.get(step,[]) if e[0] is image]
+        for entry in entries:
+            if entry[1] == key:
+                entries.remove(entry)
+                entries.append(entry)
+                self.cache[step] = entries
+                return entry[2]
+        result = make()
+        if self.max_entries > 0:
+            entries.append((image,key,result))
+            del entries[:-self.max_entries]
+        self.cache[step] = entries
+        return result
+
+    def oriented(self, image, negate=False, mirror=False, rotate=False):
+        def make():
+            im = image.convert("L")
+            if negate:
+                im = im.point(NEGATE_MAP)
+            method = TRANSPOSE[(bool(mirror),bool(rotate))]
+            if method != None:
+                im = im.transpose(method)
+            return im
+        return self.cached("oriented",image,(bool(negate),bool(mirror),bool(rotate)),make)
+
+    def scaled(self, image, negate=False, mirror=False, rotate=False, Xscale=1.0, Yscale=1.0):
+        oriented = self.oriented(image,negate,mirror,rotate)
+        if Xscale == 1.0 and Yscale == 1.0:
+            return oriented
+        def make():
+            wim,him = oriented.size
+            return oriented.resize((int(wim*Xscale),int(him*Yscale)))
+        return self.cached("scaled",image,(bool(negate),bool(mirror),bool(rotate),Xscale,Yscale),make)
+
+    def bilevel(self, image, negate=False, mirror=False, rotate=False, Xscale=1.0, Yscale=1.0,
+                halftone=None, halftone_key=None):
+        # halftone is None or a function that converts the scaled image to
+        # a halftone image.  halftone_key holds all the settings it uses.
+        scaled = self.scaled(image,negate,mirror,rotate,Xscale,Yscale)
+        def make():
+            if halftone != None:
+                return halftone(scaled)
+            return scaled.point(THRESHOLD_MAP,'1')
+        key = (bool(negate),bool(mirror),bool(rotate),Xscale,Yscale,halftone != None,halftone_key)
+        return self.cached("bilevel",image,key,make)
+
+    def pyramid(self, image, negate=False, mirror=False, rotate=False, threshold=True):
+        # Returns the list of levels built so far (see pyramid_level())
+        def make():
+            im = self.oriented(image,negate,mirror,rotate)
+            if threshold:
+                im = im.point(THRESHOLD_MAP)
+            return [im]
+        key = (bool(negate),bool(mirror),bool(rotate),bool(threshold))
+        return self.cached("pyramid",image,key,make)
+
+    def pyramid_level(self, levels, size):
+        # Smallest level that is at least size (or the full size image if
+        # size is larger).  Levels are added to levels as they are needed.
+        w,h = size
+        for level in levels:
+            if level.size[0] < 2*w or level.size[1] < 2*h:
+                return level
+        while levels[-1].size[0] >= 2*w and levels[-1].size[1] >= 2*h and min(levels[-1].size) > 1:
+            levels.append(half_size(levels[-1]))
+        return levels[-1]
+
+    def preview(self, image, size, negate=False, mirror=False, rotate=False, threshold=True):
+        # size is the (width,height) of the preview image.  It is resized
+        # from the nearest pyramid level so the time does not depend on the
+        # resolution of the image (after the first preview).
+        levels = self.pyramid(image,negate,mirror,rotate,threshold)
+        def make():
+            return self.pyramid_level(levels,size).resize(size, Image.LANCZOS)
+        key = (bool(negate),bool(mirror),bool(rotate),bool(threshold),tuple(size))
+        return self.cached("preview",image,key,make)
+
+def half_size(im):
+    # Average of each 2x2 block of pixels
+    w,h = im.size
+    try:
+        return im.reduce(2)
+    except AttributeError:
+        # Pillow older than 7.0
+        return im.resize((max(w//2,1),max(h//2,1)), Image.BOX)
+
+
+if __name__ == "__main__":
+    # Time of the old raster steps (one image after another and the pixel
+    # by pixel rotation) and of the pipeline, first with empty cache and
+    # then after changing a setting that does not change the image
+    from time import time
+    from PIL import ImageOps
+
+    def rotate_raster_old(image_in):
+        wim,him = image_in.size
+        im_rotated = Image.new("L", (him, wim), "white")
+        image_in_np   = image_in.load()
+        im_rotated_np = im_rotated.load()
+        for i in range(1,him):
+            for j in range(1,wim):
+                im_rotated_np[i,wim-j] = image_in_np[j,i]
+        return im_rotated
+
+    image = Image.radial_gradient("L").resize((3000,2000)).convert("RGB")
+    t0 = time()
+    im = image.convert("L")
+    im = ImageOps.invert(im)
+    im = ImageOps.mirror(im)
+    oriented_old = rotate_raster_old(im)
+    im = oriented_old.resize((int(oriented_old.size[0]*1.01),int(oriented_old.size[1]*0.99)))
+    old = im.point(lambda x: 0 if x<128 else 255, '1')
+    t_old = time()-t0
+
+    pipeline = RASTER_PIPELINE()
+    t0 = time()
+    new = pipeline.bilevel(image,True,True,True,1.01,0.99)
+    t_new = time()-t0
+    t0 = time()
+    again = pipeline.bilevel(image,True,True,True,1.01,0.99)
+    t_again = time()-t0
+    print("3000x2000 raster steps: old %.3f s  pipeline %.3f s  cached %.6f s" %(t_old,t_new,t_again))
+    # The old rotation moved the image down one pixel and left the first
+    # row and column white
+    oriented = pipeline.oriented(image,True,True,True)
+    w,h = oriented.size
+    print("same oriented image (one pixel lower in the old one):",
+          oriented_old.crop((1,1,w,h)).tobytes() == oriented.crop((1,0,w,h-1)).tobytes())
+
+    t0 = time()
+    preview = pipeline.preview(image,(600,400),True,True,True)
+    t_preview = time()-t0
+    t0 = time()
+    preview = pipeline.preview(image,(600,400),True,True,True)
+    print("preview %.3f s  cached %.6f s" %(t_preview,time()-t0))
+
+    # Preview of a large image at changing zoom levels resized from the
+    # full size image and from the pyramid
+    image = Image.radial_gradient("L").resize((12000,8000))
+    pipeline = RASTER_PIPELINE()
+    pipeline.pyramid(image)
+    for size in ((900,600),(700,466),(500,333),(1200,800)):
+        t0 = time()
+        full = image.point(THRESHOLD_MAP).resize(size, Image.LANCZOS)
+        t_full = time()-t0
+        t0 = time()
+        preview = pipeline.preview(image,size)
+        t_preview = time()-t0
+        print("12000x8000 preview %4dx%-4d  from full size %.3f s  from pyramid %.3f s  levels %d" \
+              %(size[0],size[1],t_full,t_preview,len(pipeline.pyramid(image))))
+    print("DONE")
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+"""
+    This script converts bitmap images into raster scan lines
+
+    Copyright (C) <2017-2023>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+from math import *
+from time import time
+from convex_hull import hull2D
+from ecoords import ECoordArray, RasterRuns
+from process_pool import process_pool, stop_pool, OrderedTasks
+from raster_tiles import TILED_RASTER
+
+NUMPY=True
+try:
+    import numpy
+except:
+    NUMPY = False
+
+STRIPE_ROWS = 64 # scan lines in each stripe of make_raster_runs()
+pool_pixels = None # image pixels for the (forked) worker processes
+
+#######################################################################
+# Runs of a stripe of scan lines.  rows are the (i_step,i) pairs of
+# the stripe.  Returns (y,LEFT,RIGHT,x0,x1) for each scan line with
+# engraving.  This is a module level function so it can run in a
+# worker process (that has the pixels from when it was forked).
+#######################################################################
+def scan_stripe(pixels,rows,dpi,im_height_mils):
+    if pixels is None:
+        pixels = pool_pixels
+    scan = RasterScan(dpi)
+    lines = []
+    for k in range(len(rows)):
+        i_step,i = rows[k]
+        starts,ends,laser,left,right = scan.row_runs(pixels[i])
+        ion = numpy.flatnonzero(laser)
+        if len(ion) == 0:
+            continue
+        y = (im_height_mils-i_step)/1000.0
+        LEFT  = int(left[ion].min())
+        RIGHT = int(right[ion].max())
+        # x positions are accumulated the same way as the python loop
+        x1 = numpy.cumsum((ends-starts)/dpi)
+        x0 = numpy.concatenate(([0.0],x1[:-1]))
+        # start and end point of each laser on run
+        lines.append( (y,LEFT,RIGHT,x0[ion],x1[ion]) )
+    return lines
+
+##############################################################################
+class RasterScan:
+    def __init__(self, input_dpi=1000.0, use_numpy=True, workers=1):
+        self.input_dpi = input_dpi
+        self.use_numpy = use_numpy and NUMPY
+        self.cutoff    = 128
+        self.workers   = workers
+
+    def none_function(self,dummy=None):
+        #Don't delete this function (used in make_raster_coords)
+        pass
+
+    #######################################################################
+    # Convert a bi-level image into raster ecoords.  Returns the ecoords,
+    # the total engraving length, the number of engraved scan lines and
+    # the convex hull of the engraved area.
+    #######################################################################
+    def make_raster_coords(self,image,Raster_step,update_gui=None,stop_calc=None):
+        if stop_calc == None:
+            stop_calc=[]
+            stop_calc.append(0)
+        if update_gui == None:
+            update_gui = self.none_function
+
+        if self.use_numpy:
+            return self.make_raster_coords_numpy(image,Raster_step,update_gui,stop_calc)
+        else:
+            return self.make_raster_coords_python(image,Raster_step,update_gui,stop_calc)
+
+    def scan_rows(self,him,Raster_step):
+        # Returns (i_step,i) pairs for each scan line
+        im_height_mils = int(him/self.input_dpi*1000.0)
+        rows = []
+        for i_step in range(0,im_height_mils,Raster_step):
+            rows.append( (i_step, floor(i_step*self.input_dpi/1000.0)) )
+        return rows,im_height_mils
+
+    #######################################################################
+    # Per row run detection using numpy.  The run boundaries are found
+    # with a vectorized diff and the results match the pixel by pixel
+    # loop in make_raster_coords_python() exactly (including the way the
+    # last run in each row is evaluated).
+    #######################################################################
+    def row_runs(self,row):
+        wim = len(row)
+        chg    = numpy.flatnonzero(row[1:] != row[:-1]) + 1
+        starts = numpy.concatenate(([0],chg))
+        ends   = numpy.concatenate((chg,[wim]))
+        laser  = numpy.logical_not(row[starts])
+        # The last run is evaluated using the second to last pixel
+        laser[-1] = not row[wim-2]
+        left  = starts.copy()
+        right = ends.copy()
+        left[-1]  = starts[-1]-1
+        right[-1] = wim-1
+        return starts,ends,laser,left,right
+
+    def make_raster_coords_numpy(self,image,Raster_step,update_gui,stop_calc):
+        runs,LENGTH,n_scanlines,hcoords = self.make_raster_runs(image,Raster_step,update_gui,stop_calc)
+        if len(runs) == 0:
+            return [],LENGTH,n_scanlines,hcoords
+        return runs.ecoords(),LENGTH,n_scanlines,hcoords
+
+    #######################################################################
+    # Same as make_raster_coords() but returns the scan lines as
+    # RasterRuns (egv.make_egv_data() takes them in place of the ecoords).
+    # Needs numpy.  The scan lines are found in stripes of STRIPE_ROWS
+    # rows, in worker processes when there is more than one worker, and
+    # put back together in order.  image can be a 1 bit TILED_RASTER, its
+    # rows are read as they are scanned.
+    #######################################################################
+    def make_raster_runs(self,image,Raster_step,update_gui=None,stop_calc=None):
+        if stop_calc == None:
+            stop_calc=[]
+            stop_calc.append(0)
+        if update_gui == None:
+            update_gui = self.none_function
+        wim,him = image.size
+        if isinstance(image,TILED_RASTER):
+            pixels = image
+        else:
+            pixels = numpy.asarray(image)
+            if pixels.dtype != numpy.bool_:
+                pixels = pixels > self.cutoff
+        dpi = self.input_dpi
+
+        x0_rows=[]
+        x1_rows=[]
+        y_rows=[]
+        hcoords=[]
+        LENGTH=0
+        n_scanlines=0
+        timestamp=0
+        lengths=[]
+        rows,im_height_mils = self.scan_rows(him,Raster_step)
+
+        def add_lines(lines):
+            # the lines are added in order so LENGTH and the hull are the
+            # same as when the scan lines are done one after the other
+            for y,LEFT,RIGHT,x0,x1 in lines:
+                lengths.append((RIGHT - LEFT)/dpi)
+                hcoords.append([LEFT/dpi,y])
+                hcoords.append([RIGHT/dpi,y])
+                x0_rows.append(x0)
+                x1_rows.append(x1)
+                y_rows.append(y)
+
+        global pool_pixels
+        pool = None
+        if len(rows) > STRIPE_ROWS:
+            pool_pixels = pixels
+            pool = process_pool(self.workers)
+        tasks = None
+        if pool != None:
+            tasks = OrderedTasks(pool,2*self.workers)
+        finished = False
+        try:
+            for k in range(0,len(rows),STRIPE_ROWS):
+                stamp=int(3*time()) #update every 1/3 of a second
+                if (stamp != timestamp):
+                    timestamp=stamp #interlock
+                    update_gui("Creating Scan Lines: %.1f %%" %( (100.0*rows[k][1])/him ) )
+                if stop_calc[0]==True:
+                    raise Exception("Action stopped by User.")
+                stripe = rows[k:k+STRIPE_ROWS]
+                if tasks != None:
+                    for lines in tasks.add(scan_stripe,None,stripe,dpi,im_height_mils):
+                        add_lines(lines)
+                else:
+                    add_lines(scan_stripe(pixels,stripe,dpi,im_height_mils))
+            if tasks != None:
+                for lines in tasks.finish():
+                    add_lines(lines)
+            finished = True
+        finally:
+            if tasks != None:
+                tasks.cancel()
+            if pool != None:
+                stop_pool(pool,cancel=not finished)
+            pool_pixels = None
+
+        for length in lengths:
+            LENGTH = LENGTH + length
+        n_scanlines = len(y_rows)
+
+        if hcoords!=[]:
+            hcoords = hull2D().convexHullecoords(hcoords)
+        if x0_rows == []:
+            empty = numpy.zeros(0)
+            return RasterRuns(empty,numpy.zeros(1,dtype=numpy.int64),empty,empty),LENGTH,n_scanlines,hcoords
+        first = numpy.cumsum([0]+[len(x) for x in x0_rows])
+        runs = RasterRuns(numpy.array(y_rows),first,numpy.concatenate(x0_rows),numpy.concatenate(x1_rows))
+        return runs,LENGTH,n_scanlines,hcoords
+
+    #######################################################################
+    # Original pixel by pixel loop (used when numpy is not available)
+    #######################################################################
+    def make_raster_coords_python(self,image,Raster_step,update_gui,stop_calc):
+        Reng_np = image.load()
+        wim,him = image.size
+        cutoff = self.cutoff
+        ecoords=[]
+        hcoords=[]
+        x=0
+        y=0
+        loop=1
+        LENGTH=0
+        n_scanlines = 0
+
+        my_hull = hull2D()
+        bignumber = 9999999;
+        timestamp=0
+        rows,im_height_mils = self.scan_rows(him,Raster_step)
+        for i_step,i in rows:
+            stamp=int(3*time()) #update every 1/3 of a second
+            if (stamp != timestamp):
+                timestamp=stamp #interlock
+                update_gui("Creating Scan Lines: %.1f %%" %( (100.0*i)/him ) )
+            if stop_calc[0]==True:
+                raise Exception("Action stopped by User.")
+            line = []
+            cnt=1
+            LEFT  = bignumber;
+            RIGHT =-bignumber;
+            for j in range(1,wim):
+                if (Reng_np[j,i] == Reng_np[j-1,i]):
+                    cnt = cnt+1
+                else:
+                    if Reng_np[j-1,i]:
+                        laser = "U"
+                    else:
+                        laser = "D"
+                        LEFT  = min(j-cnt,LEFT)
+                        RIGHT = max(j,RIGHT)
+
+                    line.append((cnt,laser))
+                    cnt=1
+            if Reng_np[j-1,i] > cutoff:
+                laser = "U"
+            else:
+                laser = "D"
+                LEFT  = min(j-cnt,LEFT)
+                RIGHT = max(j,RIGHT)
+
+            line.append((cnt,laser))
+            if LEFT != bignumber and RIGHT != -bignumber:
+                LENGTH = LENGTH + (RIGHT - LEFT)/self.input_dpi
+                n_scanlines = n_scanlines + 1
+
+            y=(im_height_mils-i_step)/1000.0
+            x=0
+            if LEFT != bignumber:
+                hcoords.append([LEFT/self.input_dpi,y])
+            if RIGHT != -bignumber:
+                hcoords.append([RIGHT/self.input_dpi,y])
+            if hcoords!=[]:
+                hcoords = my_hull.convexHullecoords(hcoords)
+
+            for seg in line:
+                delta = seg[0]/self.input_dpi
+                if seg[1]=="D":
+                    loop=loop+1
+                    ecoords.append([x      ,y,loop])
+                    ecoords.append([x+delta,y,loop])
+                x = x + delta
+        return ecoords,LENGTH,n_scanlines,hcoords
+
+
+if __name__ == "__main__":
+    # Benchmark the numpy scan line builder against the python loop
+    import random
+    from PIL import Image, ImageDraw
+
+    def test_image(wim,him,seed=0):
+        random.seed(seed)
+        im = Image.new("L", (wim,him), 255)
+        draw = ImageDraw.Draw(im)
+        for k in range(200):
+            x0 = random.randint(0,wim-1)
+            y0 = random.randint(0,him-1)
+            x1 = x0+random.randint(1,wim//4)
+            y1 = y0+random.randint(1,him//4)
+            if k%2:
+                draw.ellipse((x0,y0,x1,y1),fill=0)
+            else:
+                draw.rectangle((x0,y0,x1,y1),fill=0,outline=255)
+        return im.point(lambda x: 0 if x<128 else 255, '1')
+
+    sizes = [(1000,1000),(4000,2000),(6000,4000)]
+    for wim,him in sizes:
+        image = test_image(wim,him)
+        results = []
+        for use_numpy in (False,True):
+            if use_numpy and not NUMPY:
+                continue
+            scan = RasterScan(1000.0,use_numpy=use_numpy)
+            t0 = time()
+            results.append(scan.make_raster_coords(image,3))
+            print("%5dx%-5d numpy=%-5s %8.3f s" %(wim,him,use_numpy,time()-t0))
+        if len(results) == 2:
+            print("            identical =",results[0]==results[1])
+
+    # Scan lines and EGV data of a dithered image made with worker processes
+    if NUMPY:
+        from egv import egv
+        image = Image.radial_gradient("L").resize((6000,4000)).convert("1")
+        results = []
+        for workers in (1,2,4,8):
+            t0 = time()
+            runs = RasterScan(1000.0,workers=workers).make_raster_runs(image,1)[0]
+            t_scan = time()-t0
+            data = bytearray()
+            t0 = time()
+            egv(target=data).make_egv_data(runs,Feed=50,Raster_step=1,workers=workers)
+            t_egv = time()-t0
+            if workers == 1:
+                t1 = t_scan+t_egv
+            results.append(data)
+            print("workers=%d  scan lines %6.2f s  EGV data %6.2f s  speedup %5.2f" \
+                  %(workers,t_scan,t_egv,t1/(t_scan+t_egv)))
+        print("identical =",results.count(results[0]) == len(results))
+    print("DONE")
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+"""
+    This script keeps raster images in memory mapped files and prepares
+    them for engraving a band of rows at a time
+
+    Copyright (C) <2017-2023>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import os
+import tempfile
+from math import ceil
+from time import time
+from PIL import Image
+from halftone import ERROR_KERNELS, ERROR_DIFFUSION, bayer_numpy
+
+NUMPY=True
+try:
+    import numpy
+except:
+    NUMPY = False
+
+TILE_ROWS = 256 # rows of each band
+
+##############################################################################
+# TILED_RASTER is an image in a memory mapped temporary file, packed 1 bit  #
+# per pixel (bits=1, True is white) or 8 bits per pixel (bits=8).  Rows     #
+# are read and written in bands so only the bands in use are in memory.    #
+# raster_scan.RasterScan takes it in place of a '1' image (image[i] is     #
+# row i).  The file is deleted by close() (or when the object is deleted). #
+##############################################################################
+class TILED_RASTER:
+    def __init__(self, width, height, bits=1, directory=None):
+        self.size = (width,height)
+        self.bits = bits
+        if bits == 1:
+            self.row_bytes = (width+7)//8
+        else:
+            self.row_bytes = width
+        fd,self.filename = tempfile.mkstemp(suffix=".raster",dir=directory)
+        os.close(fd)
+        # an empty file can not be mapped
+        self.data = numpy.memmap(self.filename,dtype=numpy.uint8,mode="w+",
+                                 shape=(max(height,1),max(self.row_bytes,1)))
+
+    @classmethod
+    def from_image(cls, image, bits=8, tile_rows=TILE_ROWS, directory=None):
+        # Copy a PIL image into a TILED_RASTER a band at a time
+        image = image.convert("L")
+        width,height = image.size
+        raster = cls(width,height,bits,directory)
+        for y0 in range(0,height,tile_rows):
+            y1 = min(y0+tile_rows,height)
+            rows = numpy.asarray(image.crop((0,y0,width,y1)))
+            if bits == 1:
+                rows = rows >= 128
+            raster.write_rows(y0,rows)
+        return raster
+
+    def write_rows(self, y0, rows):
+        if self.bits == 1:
+            rows = numpy.packbits(rows,axis=1)
+        self.data[y0:y0+len(rows),:rows.shape[1]] = rows
+
+    def read_rows(self, y0, y1):
+        # rows y0 to y1-1 (bool for bits=1, uint8 for bits=8)
+        rows = self.data[y0:y1]
+        if self.bits == 1:
+            return numpy.unpackbits(rows,axis=1)[:,:self.size[0]].astype(bool)
+        return numpy.array(rows[:,:self.size[0]])
+
+    def read_columns(self, x0, x1):
+        # columns x0 to x1-1 of all rows (bits=8 only)
+        return numpy.array(self.data[:self.size[1],x0:x1])
+
+    def __getitem__(self, i):
+        return self.read_rows(i,i+1)[0]
+
+    def image(self):
+        # The whole image as a PIL image ('1' or 'L')
+        rows = self.read_rows(0,self.size[1])
+        if self.bits == 1:
+            return Image.fromarray(rows.astype(numpy.uint8)*255).convert('1')
+        return Image.fromarray(rows)
+
+    def close(self):
+        if self.data is not None:
+            self.data._mmap.close()
+            self.data = None
+            try:
+                os.remove(self.filename)
+            except:
+                pass
+
+    def __del__(self):
+        try:
+            self.close()
+        except:
+            pass
+
+#######################################################################
+# Rows of the source image (a PIL 'L' image or an 8 bit TILED_RASTER)
+# negated, mirrored and rotated the same as RASTER_PIPELINE.oriented()
+# (rows is an array of the row numbers in the oriented image)
+#######################################################################
+def oriented_rows(source, rows, negate, mirror, rotate):
+    width,height = source.size
+    r0 = int(rows.min())
+    r1 = int(rows.max())+1
+    if rotate:
+        # row r of the rotated image is column width-1-r of the source
+        # (column r when it is also mirrored)
+        if mirror:
+            c0,c1,cols = r0,r1,rows
+        else:
+            c0,c1,cols = width-r1,width-r0,width-1-rows
+        if isinstance(source,TILED_RASTER):
+            band = source.read_columns(c0,c1)
+        else:
+            band = numpy.asarray(source.crop((c0,0,c1,height)))
+        pixels = band[:,cols-c0].T
+    else:
+        if isinstance(source,TILED_RASTER):
+            band = source.read_rows(r0,r1)
+        else:
+            band = numpy.asarray(source.crop((0,r0,width,r1)))
+        pixels = band[rows-r0]
+        if mirror:
+            pixels = pixels[:,::-1]
+    if negate:
+        pixels = 255-pixels
+    return numpy.ascontiguousarray(pixels)
+
+def nearest(n_out, n_in):
+    # index of the input pixel nearest to the center of each output pixel
+    return numpy.minimum(((numpy.arange(n_out)+0.5)*(float(n_in)/n_out)).astype(numpy.int64),n_in-1)
+
+#######################################################################
+# Same as RASTER_PIPELINE.bilevel() a band of rows at a time.  Returns a
+# 1 bit TILED_RASTER.  halftone is None or (npixels,val_map,method): the
+# image is averaged in npixels x npixels blocks, val_map is applied and
+# it is dithered with method.  The scale factors and the halftone
+# resizing use the nearest pixel.  Floyd-Steinberg uses the numpy error
+# diffusion (not PIL) so it can be done a band at a time.
+#######################################################################
+def bilevel_tiles(source, negate=False, mirror=False, rotate=False, Xscale=1.0, Yscale=1.0,
+                  halftone=None, tile_rows=TILE_ROWS, directory=None, update_gui=None, stop_calc=None):
+    if stop_calc == None:
+        stop_calc=[0]
+    if update_gui == None:
+        update_gui = lambda msg=None: None
+    width,height = source.size
+    if rotate:
+        width,height = height,width
+    nw = int(width*Xscale)
+    nh = int(height*Yscale)
+    x_index = None
+    if nw != width:
+        x_index = nearest(nw,width)
+    y_index = nearest(nh,height)
+    timestamp = [0]
+    def progress(msg,fraction):
+        stamp=int(3*time()) #update every 1/3 of a second
+        if (stamp != timestamp[0]):
+            timestamp[0]=stamp #interlock
+            update_gui("%s: %.1f %%" %(msg,100.0*fraction))
+        if stop_calc[0]==True:
+            raise Exception("Action Stopped by User.")
+
+    def scaled_rows(y0,y1):
+        pixels = oriented_rows(source,y_index[y0:y1],negate,mirror,rotate)
+        if x_index is not None:
+            pixels = pixels[:,x_index]
+        return pixels
+
+    out = TILED_RASTER(nw,nh,1,directory)
+    if halftone == None:
+        for y0 in range(0,nh,tile_rows):
+            progress("Preparing Raster",float(y0)/max(nh,1))
+            y1 = min(y0+tile_rows,nh)
+            out.write_rows(y0,scaled_rows(y0,y1) >= 128)
+        return out
+
+    npixels,val_map,method = halftone
+    hw = nw//npixels
+    hh = nh//npixels
+    if hw == 0 or hh == 0:
+        # smaller than one halftone cell: no dots (white)
+        out.data[:] = 255
+        return out
+    lut = numpy.array(val_map,dtype=numpy.uint8)
+    dots = TILED_RASTER(hw,hh,1,directory)
+    try:
+        # the halftone image (one pixel for each npixels x npixels block)
+        diffusion = None
+        if method in ERROR_KERNELS:
+            diffusion = ERROR_DIFFUSION(ERROR_KERNELS[method],hw)
+        band_rows = max(tile_rows//npixels,1)
+        for h0 in range(0,hh,band_rows):
+            progress("Creating Halftone Image",float(h0)/hh)
+            h1 = min(h0+band_rows,hh)
+            pixels = scaled_rows(h0*npixels,h1*npixels)[:,:hw*npixels]
+            blocks = pixels.reshape(h1-h0,npixels,hw,npixels).mean(axis=(1,3))
+            pixels = lut[numpy.round(blocks).astype(numpy.uint8)]
+            if diffusion != None:
+                white = diffusion.band(pixels)
+            else:
+                white = bayer_numpy(pixels,h0)
+            dots.write_rows(h0,white)
+        # back to the scaled size
+        dot_x = nearest(nw,hw)
+        dot_y = nearest(nh,hh)
+        for y0 in range(0,nh,tile_rows):
+            progress("Preparing Raster",float(y0)/nh)
+            y1 = min(y0+tile_rows,nh)
+            rows = dot_y[y0:y1]
+            band = dots.read_rows(int(rows[0]),int(rows[-1])+1)
+            out.write_rows(y0,band[rows-rows[0]][:,dot_x])
+    finally:
+        dots.close()
+    return out
+
+#######################################################################
+# Preview image of size (width,height) made a band of rows at a time
+# (the same image as RASTER_PIPELINE.preview() without its full size
+# images).  Each band of output rows is the average of the rows of the
+# oriented image it covers (black and white when threshold is True).
+#######################################################################
+def preview_tiles(source, size, negate=False, mirror=False, rotate=False, threshold=True,
+                  tile_rows=TILE_ROWS):
+    width,height = source.size
+    if rotate:
+        width,height = height,width
+    nw,nh = size
+    preview = Image.new("L",(nw,nh),255)
+    if nw <= 0 or nh <= 0 or width == 0 or height == 0:
+        return preview
+    f = float(height)/nh
+    band_rows = max(int(tile_rows/f),1)
+    for y0 in range(0,nh,band_rows):
+        y1 = min(y0+band_rows,nh)
+        s0 = y0*f
+        s1 = min(y1*f,height)
+        r0 = int(s0)
+        r1 = min(max(int(ceil(s1)),r0+1),height)
+        pixels = oriented_rows(source,numpy.arange(r0,r1),negate,mirror,rotate)
+        if threshold:
+            pixels = numpy.where(pixels >= 128,255,0).astype(numpy.uint8)
+        band = Image.fromarray(pixels).resize((nw,y1-y0),Image.BOX,box=(0,s0-r0,width,s1-r0))
+        preview.paste(band,(0,y0))
+    return preview
+
+
+if __name__ == "__main__":
+    # Peak memory of a bed sized (12000x8000 pixels) raster prepared (and
+    # its preview made) as full size images and a band at a time (run each
+    # case in a new process so the peak memory of each is measured by
+    # itself)
+    import sys
+    import subprocess
+    import resource
+    from raster_pipeline import RASTER_PIPELINE
+    from raster_scan import RasterScan
+    # the classes RasterScan knows (not the ones of __main__)
+    from raster_tiles import TILED_RASTER, bilevel_tiles, preview_tiles
+
+    def peak_mb():
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            peak = peak/1024
+        return peak/1024.0
+
+    if len(sys.argv) > 1:
+        case = sys.argv[1]
+        image = Image.radial_gradient("L").resize((12000,8000))
+        base = peak_mb()
+        t0 = time()
+        if case.endswith("preview"):
+            if case == "full preview":
+                preview = RASTER_PIPELINE(max_entries=1).preview(image,(900,600),True,True,True)
+            else:
+                preview = preview_tiles(image,(900,600),True,True,True)
+            print("%-14s %6.1f s   peak memory above the source image %6.0f MB" \
+                  %(case,time()-t0,peak_mb()-base))
+            sys.exit(0)
+        if case == "full":
+            bilevel = RASTER_PIPELINE(max_entries=0).bilevel(image,True,True,True,1.0,1.01)
+        else:
+            bilevel = bilevel_tiles(image,True,True,True,1.0,1.01)
+        runs = RasterScan(1000.0).make_raster_runs(bilevel,1)
+        print("%-14s %6.1f s   peak memory above the source image %6.0f MB   scan lines %d" \
+              %(case,time()-t0,peak_mb()-base,runs[2]))
+        if case == "tiled":
+            bilevel.close()
+        sys.exit(0)
+
+    for case in ("full","tiled","full preview","tiled preview"):
+        subprocess.call([sys.executable,__file__,case])
+
+    # The tiled raster has the same pixels as the full size images (the
+    # scale factors are 1 so no pixels are resized)
+    image = Image.radial_gradient("L").resize((1200,800))
+    pipeline = RASTER_PIPELINE()
+    same = True
+    for negate in (False,True):
+        for mirror in (False,True):
+            for rotate in (False,True):
+                full  = pipeline.bilevel(image,negate,mirror,rotate)
+                tiled = bilevel_tiles(image,negate,mirror,rotate,tile_rows=100)
+                same  = same and full.tobytes() == tiled.image().tobytes()
+                tiled.close()
+    print("same pixels as RASTER_PIPELINE.bilevel():",same)
+    source = TILED_RASTER.from_image(image,bits=8)
+    tiled = bilevel_tiles(source,True,True,True,tile_rows=100)
+    print("same pixels from an 8 bit TILED_RASTER:", \
+          pipeline.bilevel(image,True,True,True).tobytes() == tiled.image().tobytes())
+    print("DONE")
@@ -0,0 +1,114 @@
+"""
+    Tests of the EGV time estimate (run with python -m pytest)
+"""
+import random
+from egv import egv
+from egv_decoder import EGV_TIME
+from egv_stream import EGV_STREAM
+from LaserSpeed import LaserSpeed
+
+def close(a, b):
+    return abs(a-b) <= 1e-9*max(abs(a),abs(b),1.0)
+
+def speed_code(mm_per_second, raster_step=0):
+    code = LaserSpeed.get_code_from_speed(mm_per_second, raster_step=raster_step, board="M2")
+    return code.encode("ascii")
+
+def test_straight_cut():
+    # 1000 mils to the right with the laser on: 1 inch at the speed of
+    # the speed code
+    code = speed_code(10)
+    speed = LaserSpeed.get_speed_from_code(code.decode("ascii"), board="M2")
+    data = b"I"+code+b"NRBS1E"+b"D"+b"B"+b"zzz235"+b"FNSE-"
+    times,counts = EGV_TIME().estimate(data)
+    assert counts["cut_mils"] == 1000
+    assert close(times["cut"], 25.4/speed)
+    assert times["turnaround"] == 0.0
+
+def test_diagonal_cut():
+    # Each diagonal step takes the step period plus the diagonal
+    # correction in the speed code
+    code = speed_code(10)
+    code_value, gear, step_value, diagonal, raster_step = LaserSpeed.parse_speed_code(code.decode("ascii"))
+    b, m, gear = LaserSpeed.get_gearing("M2", gear=gear, uses_raster_step=False)
+    period = 0.0254/LaserSpeed.get_speed_from_code(code.decode("ascii"), board="M2")
+    assert step_value > 0 and diagonal > 0
+    data = b"I"+code+b"NRBS1E"+b"D"+b"M"+b"100"+b"FNSE-"
+    times,counts = EGV_TIME().estimate(data)
+    assert close(times["cut"], 100*(period+diagonal*step_value/(-m)/1000.0))
+    assert times["cut"] > 100*period
+
+def test_raster_turnarounds():
+    # Three 100 mil rows: two changes of direction, each one a 2 mil step
+    # to the next row at the step period
+    code = speed_code(100, raster_step=2)
+    period = 0.0254/LaserSpeed.get_speed_from_code(code.decode("ascii"), board="M2")
+    data = b"I"+code+b"NRBS1E"+b"D"+b"B100"+b"T100"+b"B100"+b"FNSE-"
+    times,counts = EGV_TIME().estimate(data)
+    assert counts["turnarounds"] == 2
+    assert close(times["cut"], 300*period)
+    assert close(times["turnaround"], 2*2*period)
+
+def test_rapid_move():
+    # 1000 mils at rapid_speed plus the overhead of one rapid move
+    data = b"I"+b"Bzzz235"+b"S1P"
+    times,counts = EGV_TIME(rapid_speed=100.0, rapid_overhead=0.5).estimate(data)
+    assert counts["rapids"] == 1
+    assert close(times["rapid"], 25.4/100.0+0.5)
+    assert times["cut"] == 0.0
+
+def test_features_and_predict():
+    code = speed_code(100, raster_step=2)
+    data = b"I"+code+b"NRBS1E"+b"D"+b"B100"+b"T100"+b"B100"+b"FNSE-"
+    estimator = EGV_TIME(coefficients={"step_time":1.0, "turnaround_time":1.0, "turnarounds":0.5})
+    times,counts = estimator.estimate(data)
+    features = estimator.features([("Raster_Eng",data,3)])
+    assert features["turnarounds"] == 3*2
+    assert close(estimator.predict(features), 3*(times["cut"]+times["travel"]+times["turnaround"])+3*2*0.5)
+
+def vector_job(feed):
+    coords = [[0,0,1],[2,0,1],[2,2,1],[1,3,1],[0,2,1],[0,0,1],[3,1,2],[4,1,2],[4,2,2]]
+    data = bytearray()
+    egv(target=data.append).make_egv_data(coords,Feed=feed)
+    return data
+
+def raster_job(feed):
+    rows = []
+    for k in range(50):
+        rows.append([0.1,1.0-k*0.002,k+1])
+        rows.append([0.6,1.0-k*0.002,k+1])
+    data = bytearray()
+    egv(target=data.append).make_egv_data(rows,Feed=feed,Raster_step=2)
+    return data
+
+def test_estimate_in_pieces():
+    # The data cut anywhere gives the same estimate as all of it at once
+    random.seed(0)
+    for data in (vector_job(10),raster_job(100)):
+        whole = EGV_TIME().estimate(data)
+        for trial in range(20):
+            estimator = EGV_TIME()
+            estimator.estimate_start()
+            i = 0
+            while i < len(data):
+                j = i+random.randint(1,40)
+                estimator.estimate_part(data[i:j])
+                i = j
+            assert estimator.estimate_finish() == whole
+
+def test_stream_features():
+    # The features collected by EGV_STREAM as the data is sent are the
+    # features of the operations
+    operations = [("Raster_Eng",raster_job(100),2),("Vector_Cut",vector_job(10),3)]
+    stream = EGV_STREAM(chunk_size=64,estimator=EGV_TIME())
+    for name,data,passes in operations:
+        def make_data(job,update,pool,data=data):
+            job.extend(data)
+            update()
+        stream.add_job(make_data,passes)
+    for chunk in stream:
+        pass
+    expected = EGV_TIME().features(operations)
+    assert sorted(stream.features) == sorted(expected)
+    for name in expected:
+        assert close(stream.features[name],expected[name])
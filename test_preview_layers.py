@@ -0,0 +1,65 @@
+"""
+    Tests of the preview layers (run with python -m pytest)
+"""
+from preview_layers import PreviewLayer
+
+class STUB_CANVAS:
+    # Records the items created and the calls that change them
+    def __init__(self):
+        self.items = {} # {id:state}
+        self.calls = []
+
+    def create_line(self, xy, **kwargs):
+        self.calls.append("create_line")
+        self.items[len(self.calls)] = kwargs.get("state","normal")
+
+    def delete(self, tag):
+        self.calls.append("delete")
+        self.items = {}
+
+    def itemconfigure(self, tag, state=None):
+        self.calls.append("itemconfigure")
+        for item in self.items:
+            self.items[item] = state
+
+    def scale(self, *args):
+        self.calls.append("scale")
+
+    def move(self, *args):
+        self.calls.append("move")
+
+def square_data():
+    coords = [[0,0,1],[1,0,1],[1,1,1],[0,1,1],[0,0,1]]
+    return (coords,1,1,0,0)
+
+def test_hidden_layer_is_not_drawn_after_zoom():
+    canvas = STUB_CANVAS()
+    layer = PreviewLayer(canvas,"LAYER","blue")
+    layer.update(1,(10.0,0,0),square_data)
+    assert canvas.items and all(state == "normal" for state in canvas.items.values())
+
+    layer.update(1,(10.0,0,0),square_data,visible=False)
+    assert all(state == "hidden" for state in canvas.items.values())
+
+    # zoom (new level) and pan while the layer is hidden
+    canvas.calls = []
+    assert layer.update(1,(40.0,5,5),square_data,visible=False) == False
+    assert layer.update(1,(41.0,6,5),square_data,visible=False) == False
+    assert "create_line" not in canvas.calls
+    assert all(state == "hidden" for state in canvas.items.values())
+    assert layer.visible == False
+
+    # shown again with the new view
+    layer.update(1,(41.0,6,5),square_data)
+    assert layer.visible == True
+    assert canvas.items and all(state == "normal" for state in canvas.items.values())
+
+def test_hidden_layer_shown_without_view_change_is_not_rebuilt():
+    canvas = STUB_CANVAS()
+    layer = PreviewLayer(canvas,"LAYER","blue")
+    layer.update(1,(10.0,0,0),square_data)
+    layer.update(1,(10.0,0,0),square_data,visible=False)
+    canvas.calls = []
+    assert layer.update(1,(10.0,0,0),square_data) == False
+    assert "create_line" not in canvas.calls
+    assert all(state == "normal" for state in canvas.items.values())
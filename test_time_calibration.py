@@ -0,0 +1,55 @@
+"""
+    Tests of the fit of the job time estimate (run with python -m pytest)
+"""
+import random
+from egv_decoder import EGV_TIME
+from time_calibration import TIME_CALIBRATION
+
+def random_job():
+    turnarounds = random.choice([0,random.randint(100,2000)])
+    return {"step_time"       : random.uniform(10,600),
+            "rapid_time"      : random.uniform(1,30),
+            "turnaround_time" : turnarounds*random.uniform(0.0002,0.002),
+            "turnarounds"     : turnarounds,
+            "packets"         : random.randint(100,20000),
+            "rapids"          : random.randint(0,500),
+            "speed_changes"   : random.randint(0,4),
+            "runs"            : 1}
+
+def machine_time(f):
+    # a machine that is slower than its speed codes with a 0.3 s
+    # turnaround, USB time per packet and time to start a job
+    return 1.08*f["step_time"]+1.1*f["rapid_time"]+f["turnaround_time"]+0.3*f["turnarounds"] \
+           +0.002*f["packets"]+0.05*f["rapids"]+0.5*f["speed_changes"]+1.5
+
+def mean_error(coefficients, tests):
+    estimator = EGV_TIME(coefficients=coefficients)
+    errors = [abs(estimator.predict(f)/machine_time(f)-1) for f in tests]
+    return sum(errors)/len(errors)
+
+def test_one_job():
+    # One recorded job only scales the default coefficients: the
+    # coefficients with a default of zero stay zero, the estimate of the
+    # recorded job gets closer and the error of other jobs does not grow
+    random.seed(1)
+    tests = [random_job() for i in range(200)]
+    job = random_job()
+    coefficients = TIME_CALIBRATION(None).fit([(job,machine_time(job))])
+    for name in EGV_TIME.FEATURES:
+        if EGV_TIME.DEFAULT_COEFFICIENTS.get(name,0.0) == 0.0:
+            assert coefficients[name] == 0.0
+    before = EGV_TIME().predict(job)
+    after  = EGV_TIME(coefficients=coefficients).predict(job)
+    assert abs(after-machine_time(job)) < abs(before-machine_time(job))
+    assert mean_error(coefficients,tests) <= mean_error(None,tests)
+
+def test_many_jobs():
+    # With more jobs than coefficients the fit finds the machine's times
+    random.seed(2)
+    tests = [random_job() for i in range(200)]
+    samples = []
+    for i in range(100):
+        job = random_job()
+        samples.append((job,machine_time(job)))
+    coefficients = TIME_CALIBRATION(None).fit(samples)
+    assert mean_error(coefficients,tests) < 0.02
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+    This script keeps the measured run times of laser jobs and fits the
+    coefficients of the job time estimate to them
+
+    Copyright (C) <2017-2023>  <Scorch>
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+import os
+import json
+from math import *
+from egv_decoder import EGV_TIME
+
+##############################################################################
+# TIME_CALIBRATION stores (features,measured time) pairs of the jobs run   #
+# on each machine in a file (one JSON record per line).  coefficients()   #
+# fits the EGV_TIME coefficients of a machine with least squares.  The     #
+# coefficients are pulled toward the default coefficients scaled by one    #
+# fitted factor (ridge regression, prior_weight), so a few jobs correct    #
+# the overall estimate and the separate coefficients move to the machine's #
+# own values as more jobs are recorded.  Until there are as many jobs as   #
+# coefficients only the one factor is fitted.                              #
+# Only the last max_samples jobs of each machine are kept.                 #
+##############################################################################
+class TIME_CALIBRATION:
+    def __init__(self, filename, max_samples=500, prior_weight=1.0):
+        self.filename     = filename
+        self.max_samples  = max_samples
+        self.prior_weight = prior_weight
+        self.samples      = None # {machine:[(features,time),...]}
+        self.fitted       = {}
+
+    def load(self):
+        self.samples = {}
+        try:
+            fin = open(self.filename,'r')
+        except:
+            return
+        for line in fin:
+            try:
+                record = json.loads(line)
+                self.samples.setdefault(record["machine"],[]).append((record["features"],record["time"]))
+            except:
+                pass
+        fin.close()
+
+    def save(self):
+        try:
+            fout = open(self.filename+".tmp",'w')
+            for machine in sorted(self.samples):
+                for features,t in self.samples[machine]:
+                    record = {"machine":machine, "features":features, "time":t}
+                    fout.write(json.dumps(record,sort_keys=True)+"\n")
+            fout.close()
+            if os.path.isfile(self.filename):
+                os.remove(self.filename)
+            os.rename(self.filename+".tmp",self.filename)
+        except:
+            pass
+
+    def add(self, machine, features, measured_time):
+        if self.samples == None:
+            self.load()
+        samples = self.samples.setdefault(machine,[])
+        samples.append((dict(features),measured_time))
+        del samples[:-self.max_samples]
+        self.fitted.pop(machine,None)
+        self.save()
+
+    def coefficients(self, machine):
+        # Returns the fitted coefficients of machine (a dictionary)
+        if self.samples == None:
+            self.load()
+        if machine not in self.fitted:
+            self.fitted[machine] = self.fit(self.samples.get(machine,[]))
+        return self.fitted[machine]
+
+    def fit(self, samples):
+        names = EGV_TIME.FEATURES
+        prior = [EGV_TIME.DEFAULT_COEFFICIENTS.get(name,0.0) for name in names]
+        X = [[float(features.get(name,0.0)) for name in names] for features,t in samples]
+        y = [float(t) for features,t in samples]
+        # Each feature is scaled by its rms value so the prior has the
+        # same weight for all of them.  Features that are always zero keep
+        # the default coefficient.
+        n = len(names)
+        scale = []
+        for j in range(n):
+            s = sqrt(sum([x[j]*x[j] for x in X])/max(len(X),1))
+            scale.append(s)
+        cols = [j for j in range(n) if scale[j] > 0]
+        coefficients = dict(zip(names,prior))
+        if cols == []:
+            return coefficients
+        # First fit one factor g for the whole estimate: the mean ratio of
+        # the recorded to the estimated times, pulled toward 1 with the
+        # weight of prior_weight jobs so one job does not move it all the
+        # way.  The separate coefficients are then pulled toward the
+        # default coefficients times g.
+        e = [sum([prior[j]*x[j] for j in range(n)]) for x in X]
+        ratios = [y[i]/e[i] for i in range(len(y)) if e[i] > 0]
+        g = (sum(ratios)+self.prior_weight) / (len(ratios)+self.prior_weight)
+        prior = [p*g for p in prior]
+        coefficients = dict(zip(names,prior))
+        # The separate coefficients are only fitted when there are at
+        # least as many jobs as coefficients to fit.  With fewer jobs the
+        # fit moves coefficients that the jobs do not tell apart (such as
+        # the ones with a default of zero) and the estimate gets worse.
+        if len(X) < len(cols):
+            return coefficients
+        Z  = [[x[j]/scale[j] for j in cols] for x in X]
+        d0 = [prior[j]*scale[j] for j in cols]
+        m  = len(cols)
+        # (Z'Z + w I) d = Z'y + w d0
+        A = [[sum([z[a]*z[b] for z in Z]) for b in range(m)] for a in range(m)]
+        r = [sum([Z[i][a]*y[i] for i in range(len(Z))]) for a in range(m)]
+        for a in range(m):
+            A[a][a] = A[a][a]+self.prior_weight
+            r[a] = r[a]+self.prior_weight*d0[a]
+        d = self.solve(A,r)
+        for k in range(m):
+            coefficients[names[cols[k]]] = d[k]/scale[cols[k]]
+        return coefficients
+
+    def solve(self, A, r):
+        # Gauss-Jordan elimination with partial pivoting (A is positive
+        # definite so it is never singular)
+        m = len(r)
+        A = [A[i][:]+[r[i]] for i in range(m)]
+        for c in range(m):
+            p = max(range(c,m),key=lambda i: abs(A[i][c]))
+            A[c],A[p] = A[p],A[c]
+            for i in range(m):
+                if i != c and A[i][c] != 0:
+                    f = A[i][c]/A[c][c]
+                    A[i] = [A[i][k]-f*A[c][k] for k in range(m+1)]
+        return [A[i][m]/A[i][i] for i in range(m)]
+
+
+if __name__ == "__main__":
+    # A simulated machine that is 8% slower than its speed codes, has a
+    # 0.3 s turnaround, 2 ms of USB time per packet and 1.5 s to start a
+    # job.  The estimate error of new jobs as jobs are recorded.
+    import random
+    import tempfile
+
+    random.seed(1)
+    def random_job():
+        turnarounds = random.choice([0,random.randint(100,2000)])
+        return {"step_time"       : random.uniform(10,600),
+                "rapid_time"      : random.uniform(1,30),
+                "turnaround_time" : turnarounds*random.uniform(0.0002,0.002),
+                "turnarounds"     : turnarounds,
+                "packets"         : random.randint(100,20000),
+                "rapids"          : random.randint(0,500),
+                "speed_changes"   : random.randint(0,4),
+                "runs"            : 1}
+    def machine_time(f):
+        return 1.08*f["step_time"]+1.1*f["rapid_time"]+f["turnaround_time"]+0.3*f["turnarounds"] \
+               +0.002*f["packets"]+0.05*f["rapids"]+0.5*f["speed_changes"]+1.5
+
+    filename = os.path.join(tempfile.mkdtemp(),"k40_times")
+    calibration = TIME_CALIBRATION(filename)
+    calibration.load()
+    tests = [random_job() for i in range(200)]
+    mean_errors = []
+    for n in (0,1,3,10,30,100):
+        for i in range(n-len(calibration.samples.get("M2",[]))):
+            job = random_job()
+            calibration.add("M2",job,machine_time(job)*random.uniform(0.98,1.02))
+        estimator = EGV_TIME(coefficients=calibration.coefficients("M2"))
+        errors = [abs(estimator.predict(f)/machine_time(f)-1) for f in tests]
+        mean_errors.append(sum(errors)/len(errors))
+        print("%4d jobs recorded: mean error %5.1f%%  max error %5.1f%%" \
+              %(n,100*sum(errors)/len(errors),100*max(errors)))
+    print("one recorded job does not increase the error:",mean_errors[1] <= mean_errors[0])
+    # the records are read back from the file
+    print("reloaded coefficients are the same:",
+          TIME_CALIBRATION(filename).coefficients("M2") == calibration.coefficients("M2"))
+    print("DONE")